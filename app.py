@@ -1,18 +1,69 @@
 from flask import (
     Flask, render_template, request, redirect, session, url_for,
-    render_template_string, flash, jsonify
+    render_template_string, flash, jsonify, g, Response, send_from_directory,
+    stream_with_context, before_render_template, template_rendered, has_request_context,
+    stream_template, get_flashed_messages
 )
+import io
+import csv
+import base64
 import sqlite3
 import os
+import sys
 import glob
+import gzip
+import json
+import time
+import mimetypes
+import queue
+import atexit
+import shutil
+import bisect
+import random
+import threading
+import cProfile
+import tracemalloc
+from collections import Counter, OrderedDict
+
+try:
+    import fcntl   # غير متوفر على ويندوز؛ نكتفي حينها بقفل داخل العملية
+except ImportError:
+    fcntl = None
+
+try:
+    import markdown as markdown_lib   # اختياري: لعرض المقالات المكتوبة بـ Markdown
+    if not hasattr(markdown_lib, "Markdown"):
+        # بدون المكتبة يُستورد مجلد المحتوى markdown/ كـ namespace package
+        markdown_lib = None
+except ImportError:
+    markdown_lib = None
+from html.parser import HTMLParser
+import html as html_lib
+from contextlib import contextmanager, nullcontext
 from functools import wraps
+import click
 from datetime import datetime, timedelta
 import pytz
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import NotFound
 import uuid
 import re
+import zlib
+import difflib
+import hashlib
+import tempfile
+import tarfile
+import math
+import heapq
+from itertools import islice, chain
+import mmap
+import struct
+import select
+import socket
 import secrets
+import urllib.parse
+import urllib.request
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
@@ -33,6 +84,8 @@ BASE_MARKDOWN_DIR = os.path.join(BASE_DIR, "markdown")    # مصدر المحت
 DB_PATH = os.path.join(BASE_DIR, "users.db")
 COMMENTS_DB_PATH = os.path.join(BASE_DIR, "comments.db")
 POSTS_STATS_DB_PATH = os.path.join(BASE_DIR, "posts_stats.db")
+REVISIONS_DB_PATH = os.path.join(BASE_DIR, "revisions.db")
+POSTS_DB_PATH = os.environ.get("CIT_POSTS_DB", os.path.join(BASE_DIR, "posts.db"))
 
 app = Flask(__name__)
 
@@ -61,6 +114,435 @@ app.config.update({
 })
 
 
+# ==============================
+# القياس: Server-Timing + مقاييس Prometheus
+# ==============================
+# عند التعطيل لا تُنشأ اتصالات مُقاسة ولا تُسجَّل أي أزمنة (تكلفة شبه معدومة)
+app.config["METRICS_ENABLED"] = os.environ.get("CIT_METRICS_ENABLED", "0") == "1"
+# توكن اختياري يسمح لـ Prometheus بالقراءة من /metrics دون جلسة مدير
+app.config["METRICS_TOKEN"] = os.environ.get("CIT_METRICS_TOKEN", "")
+
+# حدود المدرّجات بالثواني
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# المراحل التي نقيسها داخل الطلب
+METRICS_PHASES = ("sql", "fs", "template", "email", "markdown", "redis")
+
+_metrics_lock = threading.Lock()
+_metrics_hist = {}   # (name, labels) -> [counts لكل حد, sum, count]
+_NULL_TIMER = nullcontext()
+
+
+def metrics_enabled() -> bool:
+    return app.config.get("METRICS_ENABLED", False)
+
+
+def _observe(name: str, labels: tuple, value: float):
+    """إضافة قيمة لمدرّج (histogram) داخل الذاكرة."""
+    idx = bisect.bisect_left(METRICS_BUCKETS, value)
+    key = (name, labels)
+    with _metrics_lock:
+        entry = _metrics_hist.get(key)
+        if entry is None:
+            entry = _metrics_hist[key] = [[0] * (len(METRICS_BUCKETS) + 1), 0.0, 0]
+        entry[0][idx] += 1
+        entry[1] += value
+        entry[2] += 1
+
+
+def _record_timing(phase: str, seconds: float):
+    """جمع زمن مرحلة (sql/fs/template/email) داخل الطلب الحالي."""
+    if not has_request_context():
+        # عمليات خارج الطلبات (التهيئة، خيوط الخلفية) تذهب مباشرة للمدرّج
+        _observe("cit_phase_duration_seconds", (("phase", phase), ("endpoint", "-")), seconds)
+        return
+    timings = g.get("_timings")
+    if timings is None:
+        timings = g._timings = {}
+    entry = timings.get(phase)
+    if entry is None:
+        timings[phase] = [seconds, 1]
+    else:
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def _timed_block(phase: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_timing(phase, time.perf_counter() - start)
+
+
+def timed(phase: str):
+    """with timed("fs"): ... — لا يفعل شيئًا عند تعطيل القياس."""
+    if not app.config.get("METRICS_ENABLED"):
+        return _NULL_TIMER
+    return _timed_block(phase)
+
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursor يقيس زمن التنفيذ والجلب لكل جملة SQL."""
+
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            _record_timing("sql", time.perf_counter() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            _record_timing("sql", time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _record_timing("sql", time.perf_counter() - start)
+
+    def fetchall(self):
+        start = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _record_timing("sql", time.perf_counter() - start)
+
+
+class _TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _record_timing("sql", time.perf_counter() - start)
+
+
+def db_connect(path: str, **kwargs):
+    """فتح اتصال SQLite (مُقاس عند تفعيل METRICS_ENABLED)."""
+    if app.config.get("METRICS_ENABLED"):
+        kwargs.setdefault("factory", _TimedConnection)
+    return sqlite3.connect(path, **kwargs)
+
+
+def _on_before_render(sender, template, context, **extra):
+    if metrics_enabled():
+        g._tpl_start = time.perf_counter()
+
+
+def _on_template_rendered(sender, template, context, **extra):
+    start = g.pop("_tpl_start", None)
+    if start is not None:
+        _record_timing("template", time.perf_counter() - start)
+
+
+before_render_template.connect(_on_before_render, app)
+template_rendered.connect(_on_template_rendered, app)
+
+
+@app.before_request
+def _metrics_start():
+    if metrics_enabled():
+        g._req_start = time.perf_counter()
+        g._timings = {}
+
+
+@app.after_request
+def _metrics_finish(response):
+    start = g.get("_req_start")
+    if start is None:
+        return response
+
+    endpoint = request.endpoint or "unknown"
+    # نفس القاموس يستمر في الامتلاء أثناء بث الجسم (SQL والقالب يعملان بعد هذا الخطاف)
+    timings = g._timings
+
+    # الترويسة تظهر للمدير فقط حتى لا نكشف تفاصيل داخلية للزوار.
+    # في الرد المتدفّق تُرسل قبل الجسم فلا تغطي إلا ما قبله (headers بدل total)
+    if session.get("role") == "admin":
+        elapsed = time.perf_counter() - start
+        parts = [
+            f'{phase};dur={seconds * 1000:.2f};desc="{count} ops"'
+            for phase, (seconds, count) in timings.items()
+        ]
+        parts.append(f"{'headers' if response.is_streamed else 'total'};dur={elapsed * 1000:.2f}")
+        response.headers["Server-Timing"] = ", ".join(parts)
+
+    def done(_sent_bytes):
+        _observe("cit_request_duration_seconds", (("endpoint", endpoint),), time.perf_counter() - start)
+        for phase, (seconds, _count) in timings.items():
+            _observe("cit_phase_duration_seconds", (("phase", phase), ("endpoint", endpoint)), seconds)
+
+    on_response_done(response, done)
+    return response
+
+
+def _escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    inner = ",".join(f'{k}="{_escape_label(v)}"' for k, v in pairs)
+    return "{" + inner + "}" if inner else ""
+
+
+def render_prometheus_metrics() -> str:
+    """تحويل المدرّجات إلى صيغة Prometheus النصية."""
+    helps = {
+        "cit_request_duration_seconds": "Total request handling time.",
+        "cit_phase_duration_seconds": "Per-request time spent in sql/fs/template/email.",
+        "cit_stream_duration_seconds": "Time to render a streamed page body after its headers.",
+    }
+    with _metrics_lock:
+        snapshot = {k: (list(v[0]), v[1], v[2]) for k, v in _metrics_hist.items()}
+
+    lines = []
+    for name in sorted({k[0] for k in snapshot}):
+        lines.append(f"# HELP {name} {helps.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), (counts, total, count) in sorted(snapshot.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, n in zip(METRICS_BUCKETS, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# ==============================
+# سجل الطلبات المنظّم (JSON Lines) بكتابة غير متزامنة
+# ==============================
+# الطلب يضع سجلًا في طابور بالذاكرة فقط؛ خيط خلفي يكتب الدفعات ويتولّى التدوير والضغط
+app.config.update({
+    "ACCESS_LOG_ENABLED": os.environ.get("CIT_ACCESS_LOG_ENABLED", "1") == "1",
+    "ACCESS_LOG_PATH": os.environ.get("CIT_ACCESS_LOG", os.path.join(BASE_DIR, "logs", "requests.jsonl")),
+    "ACCESS_LOG_MAX_BYTES": int(os.environ.get("CIT_ACCESS_LOG_MAX_BYTES", str(50 * 1024 * 1024))),
+    "ACCESS_LOG_ROTATE_SECONDS": int(os.environ.get("CIT_ACCESS_LOG_ROTATE_SECONDS", "86400")),
+    "ACCESS_LOG_BACKUPS": int(os.environ.get("CIT_ACCESS_LOG_BACKUPS", "14")),
+})
+ACCESS_LOG_QUEUE_MAX = 10000
+ACCESS_LOG_BATCH_MAX = 500
+ACCESS_LOG_FLUSH_SECONDS = 1.0
+
+_access_log_state = {"pid": None, "queue": None, "thread": None, "dropped": 0, "start": {}}
+_access_log_init_lock = threading.Lock()
+
+
+def _ensure_access_log_writer():
+    # كل عملية gunicorn (بعد fork) تحتاج طابورها وخيطها الخاص
+    if _access_log_state["pid"] == os.getpid():
+        return _access_log_state["queue"]
+    with _access_log_init_lock:
+        if _access_log_state["pid"] != os.getpid():
+            q = queue.Queue(maxsize=ACCESS_LOG_QUEUE_MAX)
+            thread = threading.Thread(target=_access_log_loop, args=(q,),
+                                      name="cit-access-log", daemon=True)
+            _access_log_state.update(pid=os.getpid(), queue=q, thread=thread, dropped=0)
+            thread.start()
+    return _access_log_state["queue"]
+
+
+def log_access(record: dict):
+    """إضافة سجل للطابور دون أي I/O؛ يُهمل السجل إذا امتلأ الطابور."""
+    q = _ensure_access_log_writer()
+    try:
+        q.put_nowait(record)
+    except queue.Full:
+        _access_log_state["dropped"] += 1
+
+
+def _access_log_loop(q):
+    batch = []
+    deadline = time.monotonic() + ACCESS_LOG_FLUSH_SECONDS
+    while True:
+        stop = False
+        try:
+            item = q.get(timeout=max(deadline - time.monotonic(), 0))
+            if item is None:
+                stop = True
+            else:
+                batch.append(item)
+                if len(batch) < ACCESS_LOG_BATCH_MAX:
+                    continue
+        except queue.Empty:
+            pass
+
+        if batch:
+            try:
+                _write_access_batch(batch)
+            except Exception as e:
+                print("Access log write error:", e)
+            batch = []
+        if stop:
+            return
+        deadline = time.monotonic() + ACCESS_LOG_FLUSH_SECONDS
+
+
+@contextmanager
+def _file_lock(lock_path: str):
+    """قفل بين العمليات عبر flock (إن توفّر)."""
+    with open(lock_path, "a") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _access_log_started_at(path: str, st) -> float:
+    """زمن أول سجل في الملف الحالي (يُقرأ مرة واحدة لكل inode)."""
+    cache = _access_log_state["start"]
+    if st.st_ino not in cache:
+        cache.clear()
+        started = st.st_mtime
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                started = json.loads(f.readline()).get("ts_epoch", started)
+        except (OSError, ValueError, AttributeError):
+            pass
+        cache[st.st_ino] = started
+    return cache[st.st_ino]
+
+
+def _write_access_batch(batch):
+    path = app.config["ACCESS_LOG_PATH"]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lines = []
+    for rec in batch:
+        rec["ts"] = datetime.utcfromtimestamp(rec["ts_epoch"]).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        lines.append(json.dumps(rec, ensure_ascii=False))
+    data = ("\n".join(lines) + "\n").encode("utf-8")
+
+    rotated = None
+    with _file_lock(path + ".lock"):
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        if st is not None and st.st_size > 0:
+            too_big = st.st_size + len(data) > app.config["ACCESS_LOG_MAX_BYTES"]
+            too_old = time.time() - _access_log_started_at(path, st) > app.config["ACCESS_LOG_ROTATE_SECONDS"]
+            if too_big or too_old:
+                stamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+                rotated = f"{os.path.splitext(path)[0]}-{stamp}-{os.getpid()}.jsonl"
+                os.replace(path, rotated)
+        with open(path, "ab") as f:
+            f.write(data)
+
+    if rotated:
+        # الضغط خارج القفل حتى لا نؤخّر بقية العمليات
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        pattern = f"{os.path.splitext(path)[0]}-*.jsonl.gz"
+        backups = sorted(glob.glob(pattern), key=os.path.getmtime)
+        for old in backups[:max(len(backups) - app.config["ACCESS_LOG_BACKUPS"], 0)]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass
+
+
+@atexit.register
+def _flush_access_log():
+    if _access_log_state["pid"] != os.getpid():
+        return
+    try:
+        _access_log_state["queue"].put(None, timeout=1)
+        _access_log_state["thread"].join(timeout=5)
+    except Exception:
+        pass
+
+
+@app.before_request
+def _access_log_start():
+    if app.config["ACCESS_LOG_ENABLED"]:
+        g._log_start = time.perf_counter()
+
+
+def on_response_done(response, callback):
+    """
+    callback(عدد البايتات المرسلة) بعد انتهاء الرد: فورًا للردود الجاهزة (أو المعروف طولها)،
+    وللرد المتدفّق عند إغلاقه بعد آخر بايت. لا نقرأ الجسم داخل after_request أبدًا،
+    وcallback يعمل حينها خارج سياق الطلب فيجب أن يلتقط ما يحتاجه مسبقًا.
+    """
+    if not response.is_streamed or response.content_length is not None:
+        callback(response.content_length)
+        return
+
+    state = getattr(response, "_cit_done", None)
+    if state is None:
+        state = response._cit_done = {"bytes": 0, "callbacks": []}
+        body = response.response
+
+        def counting():
+            try:
+                for chunk in body:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode("utf-8")
+                    state["bytes"] += len(chunk)
+                    yield chunk
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+
+        def finish():
+            for cb in state["callbacks"]:
+                try:
+                    cb(state["bytes"])
+                except Exception as e:
+                    print("Response finish error:", e)
+
+        response.response = counting()
+        response.call_on_close(finish)
+    state["callbacks"].append(callback)
+
+
+@app.after_request
+def _access_log_finish(response):
+    start = g.pop("_log_start", None)
+    if start is None:
+        return response
+
+    record = {
+        "ts_epoch": None,
+        "method": request.method,
+        "route": request.url_rule.rule if request.url_rule else None,
+        "endpoint": request.endpoint,
+        "path": request.path,
+        "status": response.status_code,
+        "latency_ms": None,
+        "bytes": None,
+        "cache": None,
+        "role": session.get("role") if session.get("logged_in") else "anon",
+    }
+    request_g = g._get_current_object()
+
+    def done(sent_bytes):
+        # زمن الرد المتدفّق يشمل عرض الجسم كاملًا لا حتى الترويسات فقط
+        record.update(ts_epoch=time.time(), bytes=sent_bytes, cache=request_g.get("cache_status"),
+                      latency_ms=round((time.perf_counter() - start) * 1000, 3))
+        log_access(record)
+
+    on_response_done(response, done)
+    return response
+
+
 # ==============================
 # Utilities
 # ==============================
@@ -68,6 +550,51 @@ def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def peek_iter(iterable):
+    """(هل فيه عناصر، مكرر من أوله) دون فقد العنصر الأول؛ بديل |length للمولّدات."""
+    it = iter(iterable)
+    for first in it:
+        return True, chain([first], it)
+    return False, iter(())
+
+
+# عرض القوالب بالتدفق: <head> يصل فورًا والقوائم الطويلة تُقرأ من مولّدات أثناء الإرسال
+STREAM_CHUNK_BYTES = 8192
+
+
+def _buffered_chunks(chunks, endpoint):
+    """يجمع قطع Jinja الصغيرة في دفعات؛ الدفعة الأولى تخرج فور اكتمال <head> ليبدأ تحميل CSS."""
+    start = time.perf_counter()
+    buf, size, head_sent = [], 0, False
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_BYTES or (not head_sent and "</head>" in chunk):
+            head_sent = True
+            yield "".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+    if metrics_enabled():
+        _observe("cit_stream_duration_seconds", (("endpoint", endpoint),), time.perf_counter() - start)
+
+
+def stream_page(template_name: str, **context) -> Response:
+    """
+    مثل render_template لكن الصفحة تُرسل على دفعات أثناء عرضها (ذاكرة ثابتة مهما طالت القوائم).
+    الجلسة تُحفظ قبل عرض الجسم، فنسحب رسائل الفلاش الآن وإلا ظهرت مرة أخرى في الصفحة التالية.
+    """
+    get_flashed_messages(with_categories=True)
+    chunks = stream_template(template_name, **context)
+    return Response(_buffered_chunks(chunks, request.endpoint or "unknown"), mimetype="text/html")
+
+
+def post_pairs_clause(category_col: str, filename_col: str, posts):
+    """(شرط SQL، المعاملات) لعدة (category, filename)؛ صيغة OR يبحث لها SQLite في الفهرس لكل زوج."""
+    clause = " OR ".join([f"({category_col} = ? AND {filename_col} = ?)"] * len(posts))
+    return f"({clause})", [value for post in posts for value in post]
+
+
 def slugify_ar(name: str) -> str:
     """تحويل نص (قد يكون عربي) إلى slug لاتيني آمن للرابط/المجلد."""
     text = name.strip()
@@ -87,23 +614,418 @@ def slugify_ar(name: str) -> str:
     return text or "section"
 
 
-def list_posts_in_category(category_folder: str):
-    """إرجاع قائمة (filename, title) لكل مقال في قسم معيّن (من ملفات .md)."""
-    folder_path = os.path.join(BASE_MARKDOWN_DIR, category_folder)
-    files = glob.glob(os.path.join(folder_path, "*.md"))
-    posts = []
-    for path in files:
-        filename = os.path.splitext(os.path.basename(path))[0]
-        title = filename
+def list_posts_in_category(category_folder: str, include_unpublished: bool = False):
+    """إرجاع قائمة (filename, title) لكل مقال منشور في قسم معيّن (من مخزن المقالات)."""
+    posts = _posts_catalog_cache.get_or_load(
+        category_folder, lambda: post_storage().list_titles(category_folder)
+    )
+    if include_unpublished:
+        return list(posts)
+    return [(fn, title) for fn, title in posts if is_post_visible(category_folder, fn)]
+
+
+def split_post_text(raw: str, filename: str):
+    """أول سطر يبدأ بـ # هو العنوان والباقي المحتوى (HTML من Quill)."""
+    lines = raw.splitlines()
+    if lines and lines[0].lstrip().startswith("#"):
+        return lines[0].lstrip("#").strip(), "\n".join(lines[1:]).strip()
+    return filename, raw
+
+
+def post_title_from_line(first_line: str, filename: str) -> str:
+    if first_line.lstrip().startswith("#"):
+        return first_line.replace("#", "").strip()
+    return filename
+
+
+def search_snippet(content: str, query: str) -> str:
+    idx = content.lower().find(query.lower())
+    if idx == -1:
+        return ""
+    start = max(idx - 50, 0)
+    return content[start:start + 150].replace("\n", " ")
+
+
+# ==============================
+# تخزين المقالات (واجهة قابلة للتبديل: ملفات .md أو قاعدة SQLite واحدة)
+# ==============================
+# CIT_POST_STORAGE=fs (الافتراضي): ملف لكل مقال في markdown/<folder>/<filename>.md
+# CIT_POST_STORAGE=sqlite: جدول posts في posts.db مع فهرس (category, filename)
+# للانتقال بينهما: flask --app app posts-migrate --to sqlite
+POST_STORAGE_BACKEND = os.environ.get("CIT_POST_STORAGE", "fs")
+POSTS_DB_COMPRESS = os.environ.get("CIT_POSTS_COMPRESS", "0") == "1"
+POSTS_COMPRESS_MIN_BYTES = 512
+
+
+class PostStorage:
+    """
+    الواجهة التي تمر منها كل قراءة/كتابة لمحتوى المقالات.
+    النص المخزّن هو نص الملف كاملًا: "# العنوان" ثم المحتوى.
+    """
+    name = ""
+
+    def read(self, category, filename):
+        """النص الكامل أو None إن لم يوجد."""
+        raise NotImplementedError
+
+    def read_versioned(self, category, filename):
+        """(النص، معرّف نسخة يتغيّر مع كل كتابة) أو (None, None)."""
+        raise NotImplementedError
+
+    def write(self, category, filename, text):
+        raise NotImplementedError
+
+    def exists(self, category, filename) -> bool:
+        raise NotImplementedError
+
+    def delete_many(self, items):
+        """يحذف (category, filename) ويعيد مجموعة ما كان موجودًا منها فعلًا."""
+        raise NotImplementedError
+
+    def list_titles(self, category):
+        """قائمة (filename, title)."""
+        raise NotImplementedError
+
+    def iter_texts(self, category):
+        """مولّد (filename, text) لكل مقالات القسم (للبحث والترحيل)."""
+        raise NotImplementedError
+
+    def search(self, category, query):
+        """قائمة (filename, title, snippet) للمقالات المطابقة في العنوان أو النص."""
+        results = []
+        for filename, text in self.iter_texts(category):
+            title = post_title_from_line(text.split("\n", 1)[0], filename)
+            snippet = search_snippet(text, query)
+            if query.lower() in title.lower() or snippet:
+                results.append((filename, title, snippet))
+        return results
+
+    def has_posts(self, category) -> bool:
+        return bool(self.list_titles(category))
+
+    def list_created(self, category):
+        """{filename: وقت الإنشاء "%Y-%m-%d %H:%M:%S"} دون قراءة المحتوى (لتعبئة الفهارس)."""
+        raise NotImplementedError
+
+    def categories(self):
+        """الأقسام التي فيها مقالات (للترحيل)."""
+        raise NotImplementedError
+
+
+class FilePostStorage(PostStorage):
+    name = "fs"
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, category, filename):
+        return os.path.join(self.root, category, f"{filename}.md")
+
+    def read(self, category, filename):
+        with timed("fs"):
+            try:
+                with open(self._path(category, filename), "r", encoding="utf-8") as f:
+                    return f.read()
+            except FileNotFoundError:
+                return None
+
+    def read_versioned(self, category, filename):
+        path = self._path(category, filename)
+        with timed("fs"):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    st = os.fstat(f.fileno())
+                    return f.read(), f"fs:{path}@{st.st_mtime_ns}-{st.st_size}"
+            except FileNotFoundError:
+                return None, None
+
+    def write(self, category, filename, text):
+        os.makedirs(os.path.join(self.root, category), exist_ok=True)
+        with timed("fs"):
+            atomic_write_text(self._path(category, filename), text)
+
+    def exists(self, category, filename):
+        return os.path.exists(self._path(category, filename))
+
+    def delete_many(self, items):
+        deleted = set()
+        for category, filename in items:
+            try:
+                os.remove(self._path(category, filename))
+                deleted.add((category, filename))
+            except FileNotFoundError:
+                pass
+        return deleted
+
+    def list_titles(self, category):
+        posts = []
+        with timed("fs"):
+            for path in glob.glob(os.path.join(self.root, category, "*.md")):
+                filename = os.path.splitext(os.path.basename(path))[0]
+                title = filename
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        title = post_title_from_line(f.readline(), filename)
+                except Exception:
+                    pass
+                posts.append((filename, title))
+        return posts
+
+    def iter_texts(self, category):
+        with timed("fs"):
+            paths = glob.glob(os.path.join(self.root, category, "*.md"))
+        for path in paths:
+            filename = os.path.splitext(os.path.basename(path))[0]
+            try:
+                with timed("fs"), open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+            except Exception:
+                continue
+            yield filename, text
+
+    def has_posts(self, category):
+        return any(glob.glob(os.path.join(self.root, category, "*.md")))
+
+    def list_created(self, category):
+        tz = pytz.timezone("Asia/Riyadh")
+        created = {}
+        for path in glob.glob(os.path.join(self.root, category, "*.md")):
+            filename = os.path.splitext(os.path.basename(path))[0]
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                continue
+            created[filename] = datetime.fromtimestamp(mtime, tz).strftime("%Y-%m-%d %H:%M:%S")
+        return created
+
+    def categories(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d for d in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, d)))
+
+
+class SQLitePostStorage(PostStorage):
+    """
+    جدول واحد مفهرس على (category, filename): القوائم والعدّ والحذف استعلامات
+    بدل مسح المجلدات. المحتوى يُضغط بـ zlib اختياريًا (العنوان يبقى نصًا للقوائم).
+    """
+    name = "sqlite"
+
+    def __init__(self, path, compress=False):
+        self.path = path
+        self.compress = compress
+        self._init_db()
+
+    def _connect(self):
+        conn = db_connect(self.path, timeout=10)
+        # lower() في SQLite لا يعرف إلا ASCII؛ نستخدم str.lower لنطابق سلوك البحث في الملفات
+        conn.create_function("py_lower", 1, lambda v: v.lower() if isinstance(v, str) else v,
+                             deterministic=True)
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        c = conn.cursor()
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                title TEXT NOT NULL,
+                body BLOB NOT NULL,
+                compressed INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT,
+                updated_at TEXT,
+                rev INTEGER NOT NULL DEFAULT 1,
+                UNIQUE(category, filename)
+            )
+        """)
+        # ترقية جدول أُنشئ قبل إضافة عمود rev
+        c.execute("PRAGMA table_info(posts)")
+        if "rev" not in [row[1] for row in c.fetchall()]:
+            c.execute("ALTER TABLE posts ADD COLUMN rev INTEGER NOT NULL DEFAULT 1")
+        conn.commit()
+        conn.close()
+
+    def _encode(self, text):
+        data = text.encode("utf-8")
+        if self.compress and len(data) >= POSTS_COMPRESS_MIN_BYTES:
+            packed = zlib.compress(data, 6)
+            if len(packed) < len(data):
+                return packed, 1
+        return text, 0
+
+    @staticmethod
+    def _decode(body, compressed):
+        if compressed:
+            return zlib.decompress(body).decode("utf-8")
+        return body if isinstance(body, str) else bytes(body).decode("utf-8")
+
+    def read(self, category, filename):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT body, compressed FROM posts WHERE category = ? AND filename = ?",
+            (category, filename),
+        ).fetchone()
+        conn.close()
+        return self._decode(*row) if row else None
+
+    def read_versioned(self, category, filename):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT body, compressed, id, rev FROM posts WHERE category = ? AND filename = ?",
+            (category, filename),
+        ).fetchone()
+        conn.close()
+        if not row:
+            return None, None
+        body, compressed, post_id, rev = row
+        return self._decode(body, compressed), f"sqlite:{post_id}@{rev}"
+
+    def write(self, category, filename, text):
+        body, compressed = self._encode(text)
+        title = post_title_from_line(text.split("\n", 1)[0], filename)
+        now = datetime.now(pytz.timezone("Asia/Riyadh")).strftime("%Y-%m-%d %H:%M:%S")
+        conn = self._connect()
+        conn.execute("""
+            INSERT INTO posts (category, filename, title, body, compressed, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(category, filename) DO UPDATE SET
+                title = excluded.title, body = excluded.body,
+                compressed = excluded.compressed, updated_at = excluded.updated_at,
+                rev = posts.rev + 1
+        """, (category, filename, title, body, compressed, now, now))
+        conn.commit()
+        conn.close()
+
+    def exists(self, category, filename):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT 1 FROM posts WHERE category = ? AND filename = ?", (category, filename)
+        ).fetchone()
+        conn.close()
+        return row is not None
+
+    def delete_many(self, items):
+        items = list(items)
+        conn = self._connect()
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                first_line = f.readline()
-                if first_line.startswith("#"):
-                    title = first_line.replace("#", "").strip()
-        except Exception:
-            pass
-        posts.append((filename, title))
-    return posts
+            c = conn.cursor()
+            deleted = set()
+            for category, filename in items:
+                c.execute("DELETE FROM posts WHERE category = ? AND filename = ?", (category, filename))
+                if c.rowcount:
+                    deleted.add((category, filename))
+            conn.commit()
+        finally:
+            conn.close()
+        return deleted
+
+    def list_titles(self, category):
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT filename, title FROM posts WHERE category = ? ORDER BY id", (category,)
+        ).fetchall()
+        conn.close()
+        return [(fn, title) for fn, title in rows]
+
+    def iter_texts(self, category):
+        conn = self._connect()
+        try:
+            cur = conn.execute(
+                "SELECT filename, body, compressed FROM posts WHERE category = ? ORDER BY id", (category,)
+            )
+            for filename, body, compressed in cur:
+                yield filename, self._decode(body, compressed)
+        finally:
+            conn.close()
+
+    def search(self, category, query):
+        # غير المضغوط يُصفّى داخل SQLite، والمضغوط يُفك ويُفحص في بايثون
+        q = query.lower()
+        conn = self._connect()
+        try:
+            rows = conn.execute("""
+                SELECT filename, title, body, compressed FROM posts
+                WHERE category = ?
+                  AND (compressed = 1 OR instr(py_lower(title), ?) > 0 OR instr(py_lower(body), ?) > 0)
+                ORDER BY id
+            """, (category, q, q)).fetchall()
+        finally:
+            conn.close()
+
+        results = []
+        for filename, title, body, compressed in rows:
+            text = self._decode(body, compressed)
+            snippet = search_snippet(text, query)
+            if q in title.lower() or snippet:
+                results.append((filename, title, snippet))
+        return results
+
+    def has_posts(self, category):
+        conn = self._connect()
+        row = conn.execute("SELECT 1 FROM posts WHERE category = ? LIMIT 1", (category,)).fetchone()
+        conn.close()
+        return row is not None
+
+    def list_created(self, category):
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT filename, created_at FROM posts WHERE category = ?", (category,)
+        ).fetchall()
+        conn.close()
+        return {fn: created for fn, created in rows}
+
+    def categories(self):
+        conn = self._connect()
+        rows = conn.execute("SELECT DISTINCT category FROM posts ORDER BY category").fetchall()
+        conn.close()
+        return [r[0] for r in rows]
+
+
+_post_storages = {}
+
+
+def make_post_storage(backend: str) -> PostStorage:
+    if backend == "fs":
+        return FilePostStorage(BASE_MARKDOWN_DIR)
+    if backend == "sqlite":
+        return SQLitePostStorage(POSTS_DB_PATH, compress=POSTS_DB_COMPRESS)
+    raise ValueError(f"CIT_POST_STORAGE غير معروف: {backend}")
+
+
+def post_storage(backend: str = None) -> PostStorage:
+    backend = backend or POST_STORAGE_BACKEND
+    storage = _post_storages.get(backend)
+    if storage is None:
+        storage = _post_storages[backend] = make_post_storage(backend)
+    return storage
+
+
+@app.cli.command("posts-migrate")
+@click.option("--to", "target", type=click.Choice(["fs", "sqlite"]), required=True)
+@click.option("--from", "source", type=click.Choice(["fs", "sqlite"]), default=None,
+              help="الافتراضي: الخلفية الأخرى")
+def posts_migrate_command(target, source):
+    """نسخ كل المقالات بين الخلفيتين (المصدر لا يُحذف). بعدها اضبط CIT_POST_STORAGE."""
+    source = source or ("fs" if target == "sqlite" else "sqlite")
+    if source == target:
+        raise click.ClickException("❌ المصدر والهدف متطابقان")
+    src, dst = post_storage(source), post_storage(target)
+
+    copied, mismatched = 0, []
+    for category in src.categories():
+        for filename, text in src.iter_texts(category):
+            dst.write(category, filename, text)
+            if dst.read(category, filename) != text:
+                mismatched.append(f"{category}/{filename}")
+            copied += 1
+        click.echo(f"📁 {category}: {len(dst.list_titles(category))} مقال")
+
+    notify_posts_changed([(category, None) for category in dst.categories()])
+    if mismatched:
+        raise click.ClickException(f"❌ {len(mismatched)} مقال لم يطابق بعد النسخ: {mismatched[:5]}")
+    click.echo(f"✅ تم نسخ {copied} مقال من {source} إلى {target}.")
 
 
 def send_email(to_email: str, subject: str, html_content: str):
@@ -128,71 +1050,1058 @@ def send_email(to_email: str, subject: str, html_content: str):
     use_tls = app.config.get("MAIL_USE_TLS", True)
     use_ssl = app.config.get("MAIL_USE_SSL", False)
 
-    if use_ssl:
-        with smtplib.SMTP_SSL(server, port) as s:
-            s.login(username, password)
-            s.sendmail(from_addr, to_email, msg.as_string())
-    else:
-        with smtplib.SMTP(server, port) as s:
-            if use_tls:
-                s.starttls()
-            s.login(username, password)
-            s.sendmail(from_addr, to_email, msg.as_string())
+    with timed("email"):
+        if use_ssl:
+            with smtplib.SMTP_SSL(server, port) as s:
+                s.login(username, password)
+                s.sendmail(from_addr, to_email, msg.as_string())
+        else:
+            with smtplib.SMTP(server, port) as s:
+                if use_tls:
+                    s.starttls()
+                s.login(username, password)
+                s.sendmail(from_addr, to_email, msg.as_string())
 
 
 # ==============================
-# قواعد البيانات (Users + Categories + Password Resets + Email Verifications)
+# الحالة المشتركة بين الخوادم (محلية أو خادم متوافق مع Redis)
 # ==============================
-def init_users_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT DEFAULT 'writer',
-            status TEXT DEFAULT 'active',
-            phone TEXT,
-            created_at TEXT,
-            email_verified INTEGER DEFAULT 0
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS password_resets (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            token TEXT NOT NULL,
-            expires_at TEXT NOT NULL,
-            created_at TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-    """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS email_verifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            token TEXT NOT NULL,
-            expires_at TEXT NOT NULL,
-            created_at TEXT,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-        )
-    """)
-    conn.commit()
-    conn.close()
+# ما يجب أن تتفق عليه كل العمليات: إصدارات إبطال الكاش، دلاء تحديد المعدل،
+# عدّادات المشاهدات والرواج، الكاش النصي المشترك والأقفال.
+# CIT_SHARED_STATE=local (الافتراضي): SQLite + mmap + ملفات بجانب app.py — تكفي لخادم واحد.
+# CIT_SHARED_STATE=redis://:password@host:6379/0 لعدة خوادم خلف موازن حمل.
+# المشاهدات والرواج المسجّلة محليًا لا تنتقل وحدها عند التحويل:
+#   CIT_SHARED_STATE=redis://... flask --app app shared-state-migrate
+# عميل Redis هنا مكتوب فوق بروتوكول RESP مباشرة (بلا اعتماديات): مجمّع اتصالات لكل
+# عملية، وكل عملية مركّبة تذهب في رحلة واحدة (pipeline أو سكربت Lua).
+SHARED_STATE_URL = os.environ.get("CIT_SHARED_STATE", "local")
+REDIS_KEY_PREFIX = os.environ.get("CIT_REDIS_PREFIX", "cit:")
+REDIS_POOL_SIZE = int(os.environ.get("CIT_REDIS_POOL", "8"))
+REDIS_TIMEOUT = float(os.environ.get("CIT_REDIS_TIMEOUT", "2"))
+SHARED_CACHE_DIR = os.environ.get("CIT_CACHE_DIR", os.path.join(BASE_DIR, "cache"))
+SHARED_CACHE_DISK_MAX = 2000    # ملفات لكل namespace في الكاش المحلي
+
+
+class SharedStateError(Exception):
+    """عطل في خادم الحالة المشتركة (اتصال مقطوع أو رد خطأ)."""
+
+
+class SharedState:
+    """
+    الواجهة التي تمر منها كل حالة يجب أن تكون واحدة على كل الخوادم.
+    محتوى المقالات والمستخدمين ليس هنا (انظر PostStorage وقواعد البيانات).
+    """
+    name = ""
+    distributed = False
 
+    # --- إصدارات الإبطال (ناقل الكاش) ---
+    def bump_versions(self, pairs) -> int:
+        """يرفع العدّاد مرة واحدة ويسجّل (namespace, key) بالإصدار الجديد؛ يعيد الإصدار."""
+        raise NotImplementedError
 
-def migrate_add_role_column():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("PRAGMA table_info(users)")
-    cols = [r[1] for r in c.fetchall()]
-    if "role" not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'writer'")
-    if "status" not in cols:
-        c.execute("ALTER TABLE users ADD COLUMN status TEXT DEFAULT 'active'")
-    if "phone" not in cols:
+    def versions_since(self, seen):
+        """(الإصدار الحالي، [(namespace, key) التي تغيّرت بعد seen]). seen=None: الإصدار فقط."""
+        raise NotImplementedError
+
+    # --- تحديد المعدل ---
+    def take_token(self, key_hash: int, capacity: float, rate: float, now: float) -> float:
+        """0 عند السماح وإلا الثواني حتى يتوفر رمز."""
+        raise NotImplementedError
+
+    # --- عدّادات المشاهدات والرواج ---
+    def add_views(self, pending, now: float):
+        """pending = {(category, filename): n}؛ تُضاف للمشاهدات والرواج معًا."""
+        raise NotImplementedError
+
+    def get_views(self, category, filename) -> int:
+        raise NotImplementedError
+
+    def all_views(self):
+        """{(category, filename): views}."""
+        raise NotImplementedError
+
+    def top_posts(self, kind: str, category, limit: int):
+        """[(category, filename, views, score)] تنازليًا؛ score للرواج بعد التناقص حتى الآن."""
+        raise NotImplementedError
+
+    def remove_posts(self, items):
+        raise NotImplementedError
+
+    def merge_views(self, rows, epoch: float, force: bool = False) -> bool:
+        """
+        ينقل عدّادات posts_stats.db عند التحويل إلى خلفية موزعة (انظر shared-state-migrate).
+        rows = [(category, filename, views, trend)] والرواج بالنسبة للمرجع epoch؛ تُضاف لما هو موجود.
+        يعيد False إن سبق النقل (إلا مع force).
+        """
+        raise NotImplementedError
+
+    # --- كاش نصي مشترك (مفاتيح بإصدارات فلا حاجة لإبطال) ---
+    def cache_get(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def cache_set(self, namespace: str, key: str, value: str, ttl: int):
+        raise NotImplementedError
+
+    # --- أقفال ---
+    def try_lock(self, name: str, ttl: int):
+        """context manager يعطي True إن حصلنا على القفل (دون انتظار) وإلا False."""
+        raise NotImplementedError
+
+
+class LocalSharedState(SharedState):
+    """كل شيء على هذا الخادم: cache_bus.db وposts_stats.db وملف mmap وملفات الكاش."""
+    name = "local"
+
+    def __init__(self, cache_root):
+        self.cache_root = cache_root
+        self._bus_local = threading.local()
+        self._cache_writes = Counter()
+        self._thread_locks = {}
+
+    def _bus_conn(self):
+        conn = getattr(self._bus_local, "conn", None)
+        if conn is None or getattr(self._bus_local, "pid", None) != os.getpid():
+            conn = db_connect(CACHE_BUS_DB_PATH, isolation_level=None, timeout=5)
+            self._bus_local.conn, self._bus_local.pid = conn, os.getpid()
+        return conn
+
+    def bump_versions(self, pairs):
+        conn = self._bus_conn()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE bus_seq SET seq = seq + 1 WHERE id = 1")
+            (seq,) = conn.execute("SELECT seq FROM bus_seq WHERE id = 1").fetchone()
+            conn.executemany("""
+                INSERT INTO bus_versions (namespace, key, version) VALUES (?, ?, ?)
+                ON CONFLICT(namespace, key) DO UPDATE SET version = excluded.version
+            """, [(namespace, key, seq) for namespace, key in pairs])
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return seq
+
+    def versions_since(self, seen):
+        conn = self._bus_conn()
+        (seq,) = conn.execute("SELECT seq FROM bus_seq WHERE id = 1").fetchone()
+        if seen is None or seq <= seen:
+            return seq, []
+        rows = conn.execute(
+            "SELECT namespace, key FROM bus_versions WHERE version > ?", (seen,)
+        ).fetchall()
+        return seq, rows
+
+    def take_token(self, key_hash, capacity, rate, now):
+        return _rate_buckets.take(key_hash, capacity, rate, now)
+
+    def add_views(self, pending, now):
+        conn = db_connect(POSTS_STATS_DB_PATH, isolation_level=None, timeout=10)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT value FROM stats_meta WHERE key = 'trend_epoch'").fetchone()
+            epoch = row[0] if row else now
+            exponent = TREND_LAMBDA * (now - epoch)
+            if not row or exponent > TREND_REBASE_EXPONENT:
+                if row:
+                    conn.execute("UPDATE stats SET trend = trend * ?", (math.exp(-exponent),))
+                epoch, exponent = now, 0.0
+                conn.execute("INSERT OR REPLACE INTO stats_meta (key, value) VALUES ('trend_epoch', ?)", (epoch,))
+            weight = math.exp(exponent)
+            conn.executemany("""
+                INSERT INTO stats (category, filename, views, trend) VALUES (?, ?, ?, ?)
+                ON CONFLICT(category, filename) DO UPDATE SET
+                    views = views + excluded.views,
+                    trend = IFNULL(trend, 0) + excluded.trend
+            """, [(cat, fn, n, n * weight) for (cat, fn), n in pending.items()])
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def get_views(self, category, filename):
+        conn = db_connect(POSTS_STATS_DB_PATH)
+        row = conn.execute(
+            "SELECT views FROM stats WHERE category=? AND filename=?", (category, filename)
+        ).fetchone()
+        conn.close()
+        return row[0] if row else 0
+
+    def all_views(self):
+        conn = db_connect(POSTS_STATS_DB_PATH)
+        rows = conn.execute("SELECT category, filename, views FROM stats").fetchall()
+        conn.close()
+        return {(cat, fn): views or 0 for cat, fn, views in rows}
+
+    def top_posts(self, kind, category, limit):
+        column = "trend" if kind == "trending" else "views"
+        conn = db_connect(POSTS_STATS_DB_PATH)
+        if category:
+            rows = conn.execute(f"""
+                SELECT category, filename, views, {column} FROM stats
+                WHERE category = ? AND {column} > 0
+                ORDER BY {column} DESC LIMIT ?
+            """, (category, limit)).fetchall()
+        else:
+            rows = conn.execute(f"""
+                SELECT category, filename, views, {column} FROM stats
+                WHERE {column} > 0
+                ORDER BY {column} DESC LIMIT ?
+            """, (limit,)).fetchall()
+        epoch_row = conn.execute("SELECT value FROM stats_meta WHERE key = 'trend_epoch'").fetchone()
+        conn.close()
+        if kind != "trending":
+            return rows
+        decay = math.exp(-TREND_LAMBDA * (time.time() - epoch_row[0])) if epoch_row else 1.0
+        return [(cat, fn, views, score * decay) for cat, fn, views, score in rows]
+
+    def remove_posts(self, items):
+        conn = db_connect(POSTS_STATS_DB_PATH)
+        conn.executemany("DELETE FROM stats WHERE category=? AND filename=?", items)
+        conn.commit()
+        conn.close()
+
+    def _cache_path(self, namespace, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_root, namespace, f"{digest}.cache")
+
+    def cache_get(self, namespace, key):
+        try:
+            with timed("fs"), open(self._cache_path(namespace, key), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def cache_set(self, namespace, key, value, ttl):
+        # المدة لا تلزم هنا: المفاتيح بإصدارات، ونقصّ أقدم الملفات كل 50 كتابة
+        folder = os.path.join(self.cache_root, namespace)
+        os.makedirs(folder, exist_ok=True)
+        atomic_write_text(self._cache_path(namespace, key), value)
+        self._cache_writes[namespace] += 1
+        if self._cache_writes[namespace] % 50 == 0:
+            self._prune_cache(folder)
+
+    def _prune_cache(self, folder):
+        try:
+            paths = glob.glob(os.path.join(folder, "*.cache"))
+            excess = len(paths) - SHARED_CACHE_DISK_MAX
+            if excess > 0:
+                for path in sorted(paths, key=os.path.getmtime)[:excess]:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    @contextmanager
+    def try_lock(self, name, ttl):
+        # lockf بين العمليات (يُحرَّر تلقائيًا إن ماتت العملية فلا حاجة للمدة)،
+        # وLock بين خيوط العملية نفسها لأن أقفال POSIX لكل عملية لا لكل خيط
+        thread_lock = self._thread_locks.setdefault(name, threading.Lock())
+        if not thread_lock.acquire(blocking=False):
+            yield False
+            return
+        fd = None
+        try:
+            acquired = True
+            if fcntl is not None:
+                folder = os.path.join(self.cache_root, "locks")
+                os.makedirs(folder, exist_ok=True)
+                fd = os.open(os.path.join(folder, f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    acquired = False
+            yield acquired
+        finally:
+            if fd is not None:
+                os.close(fd)
+            thread_lock.release()
+
+
+class _RespError(str):
+    """رد خطأ من الخادم (-ERR ...) يُعاد ضمن ردود الـ pipeline بدل رفعه فورًا."""
+
+
+class _RespConnection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+
+    @staticmethod
+    def _encode(command):
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if isinstance(arg, bytes):
+                data = arg
+            elif isinstance(arg, str):
+                data = arg.encode("utf-8")
+            elif isinstance(arg, float):
+                data = repr(arg).encode("ascii")
+            else:
+                data = str(arg).encode("ascii")
+            parts.append(b"$%d\r\n" % len(data))
+            parts.append(data)
+            parts.append(b"\r\n")
+        return b"".join(parts)
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload
+        if kind == b"-":
+            return _RespError(payload.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            size = int(payload)
+            if size < 0:
+                return None
+            data = self.reader.read(size + 2)
+            if len(data) != size + 2:
+                raise ConnectionError("connection closed by server")
+            return data[:-2]
+        if kind == b"*":
+            count = int(payload)
+            return None if count < 0 else [self._read() for _ in range(count)]
+        raise ConnectionError(f"unexpected RESP reply: {line[:40]!r}")
+
+    def roundtrip(self, commands):
+        """كل الأوامر في sendall واحد ثم الردود بالترتيب (pipelining)."""
+        try:
+            self.sock.sendall(b"".join(self._encode(c) for c in commands))
+            return [self._read() for _ in commands]
+        except (OSError, ValueError) as e:
+            raise SharedStateError(f"redis: {e}") from e
+
+    def is_stale(self) -> bool:
+        """اتصال خامل لا ينتظر ردودًا؛ إن صار قابلًا للقراءة فقد أغلقه الخادم (timeout مثلًا)."""
+        try:
+            return bool(select.select([self.sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RedisClient:
+    """عميل RESP2 صغير: مجمّع اتصالات لكل عملية + pipeline + سكربتات Lua عبر EVALSHA."""
+
+    def __init__(self, url, pool_size=REDIS_POOL_SIZE, timeout=REDIS_TIMEOUT):
+        parsed = urllib.parse.urlsplit(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"Unsupported shared state URL: {url}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.username = urllib.parse.unquote(parsed.username) if parsed.username else None
+        self.password = urllib.parse.unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self._loaded_scripts = set()
+
+    def _connect(self):
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            raise SharedStateError(f"redis {self.host}:{self.port}: {e}") from e
+        conn = _RespConnection(sock)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.username, self.password) if self.username else ("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        for reply in conn.roundtrip(setup) if setup else ():
+            if isinstance(reply, _RespError):
+                conn.close()
+                raise SharedStateError(reply)
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # بعد fork: المقابس الموروثة يشاركنا فيها الأب، نتركها له
+                self._idle, self._pid = [], os.getpid()
+            conn = self._idle.pop() if self._idle else None
+        if conn is not None and conn.is_stale():
+            conn.close()
+            conn = None
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        except BaseException:
+            # قد تكون ردود معلّقة في المقبس؛ لا نعيده للمجمّع
+            conn.close()
+            raise
+        with self._lock:
+            if len(self._idle) < self.pool_size and self._pid == os.getpid():
+                self._idle.append(conn)
+                conn = None
+        if conn is not None:
+            conn.close()
+
+    def pipeline(self, commands):
+        """يرسل الأوامر دفعة واحدة ويعيد الردود بالترتيب؛ أي رد خطأ يرفع SharedStateError."""
+        commands = list(commands)
+        if not commands:
+            return []
+        with timed("redis"), self._connection() as conn:
+            replies = conn.roundtrip(commands)
+        for reply in replies:
+            if isinstance(reply, _RespError):
+                raise SharedStateError(reply)
+        return replies
+
+    def execute(self, *command):
+        return self.pipeline([command])[0]
+
+    def eval(self, script, keys, args):
+        """أول مرة EVAL (يخزّن الخادم السكربت)، بعدها EVALSHA فلا نرسل النص مع كل طلب."""
+        sha = hashlib.sha1(script.encode("utf-8")).hexdigest()
+        if sha in self._loaded_scripts:
+            try:
+                return self.execute("EVALSHA", sha, len(keys), *keys, *args)
+            except SharedStateError as e:
+                if not str(e).startswith("NOSCRIPT"):
+                    raise
+                # الخادم أُعيد تشغيله أو نُفّذ SCRIPT FLUSH
+                self._loaded_scripts.discard(sha)
+        reply = self.execute("EVAL", script, len(keys), *keys, *args)
+        self._loaded_scripts.add(sha)
+        return reply
+
+
+_REDIS_BUMP_SCRIPT = """
+local seq = redis.call('INCR', KEYS[1])
+for i = 1, #ARGV do
+    redis.call('ZADD', KEYS[2], seq, ARGV[i])
+end
+return seq
+"""
+
+_REDIS_TOKEN_SCRIPT = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 't', 'l')
+local tokens, last = tonumber(state[1]), tonumber(state[2])
+if tokens == nil or last == nil then
+    tokens, last = capacity, now
+end
+tokens = math.min(capacity, tokens + math.max(now - last, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 't', tostring(tokens), 'l', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+# نفس منطق LocalSharedState.add_views: المرجع الزمني وإعادة الضبط والإضافة في خطوة ذرّية واحدة.
+# اللوحات: views|trend × (* للكل، c:<القسم>)؛ أعضاء لوحة الكل "category/filename".
+_REDIS_VIEWS_SCRIPT = """
+local prefix, now, lambda, limit = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local epoch = tonumber(redis.call('GET', KEYS[1]))
+local exponent = 0
+if epoch then
+    exponent = lambda * (now - epoch)
+end
+if epoch == nil or exponent > limit then
+    if epoch then
+        local factor = math.exp(-exponent)
+        for _, board in ipairs(redis.call('SMEMBERS', KEYS[2])) do
+            redis.call('ZUNIONSTORE', board, 1, board, 'WEIGHTS', factor)
+        end
+    end
+    redis.call('SET', KEYS[1], ARGV[2])
+    exponent = 0
+end
+local weight = math.exp(exponent)
+redis.call('SADD', KEYS[2], prefix .. 'trend:*')
+for i = 5, #ARGV, 3 do
+    local category, filename, n = ARGV[i], ARGV[i + 1], tonumber(ARGV[i + 2])
+    local member = category .. '/' .. filename
+    redis.call('ZINCRBY', prefix .. 'views:*', n, member)
+    redis.call('ZINCRBY', prefix .. 'views:c:' .. category, n, filename)
+    redis.call('ZINCRBY', prefix .. 'trend:*', n * weight, member)
+    redis.call('ZINCRBY', prefix .. 'trend:c:' .. category, n * weight, filename)
+    redis.call('SADD', KEYS[2], prefix .. 'trend:c:' .. category)
+end
+return 1
+"""
+
+# نقل مرة واحدة من posts_stats.db: الرواج يُحوَّل من مرجع SQLite إلى مرجع Redis
+# (أو يصبح مرجع SQLite هو المرجع إن لم يبدأ Redis بعد)، والعلامة KEYS[3] تمنع التكرار.
+_REDIS_MERGE_VIEWS_SCRIPT = """
+local prefix, source_epoch, lambda = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+if ARGV[4] ~= '1' and redis.call('EXISTS', KEYS[3]) == 1 then
+    return 0
+end
+local epoch = tonumber(redis.call('GET', KEYS[1]))
+if epoch == nil then
+    redis.call('SET', KEYS[1], ARGV[2])
+    epoch = source_epoch
+end
+local factor = math.exp(lambda * (source_epoch - epoch))
+redis.call('SADD', KEYS[2], prefix .. 'trend:*')
+for i = 5, #ARGV, 4 do
+    local category, filename = ARGV[i], ARGV[i + 1]
+    local views, trend = tonumber(ARGV[i + 2]), tonumber(ARGV[i + 3]) * factor
+    local member = category .. '/' .. filename
+    redis.call('ZINCRBY', prefix .. 'views:*', views, member)
+    redis.call('ZINCRBY', prefix .. 'views:c:' .. category, views, filename)
+    redis.call('ZINCRBY', prefix .. 'trend:*', trend, member)
+    redis.call('ZINCRBY', prefix .. 'trend:c:' .. category, trend, filename)
+    redis.call('SADD', KEYS[2], prefix .. 'trend:c:' .. category)
+end
+redis.call('SET', KEYS[3], ARGV[2])
+return 1
+"""
+
+_REDIS_UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisSharedState(SharedState):
+    """نفس الحالة على خادم Redis (أو متوافق: Valkey/KeyDB/Dragonfly) يشترك فيه كل الخوادم."""
+    name = "redis"
+    distributed = True
+
+    def __init__(self, url, prefix=REDIS_KEY_PREFIX):
+        self.client = RedisClient(url)
+        self.prefix = prefix
+
+    def _key(self, *parts):
+        return self.prefix + ":".join(parts)
+
+    def bump_versions(self, pairs):
+        members = [json.dumps([namespace, key], ensure_ascii=False) for namespace, key in pairs]
+        return self.client.eval(_REDIS_BUMP_SCRIPT, [self._key("bus", "seq"), self._key("bus", "versions")],
+                                members)
+
+    def versions_since(self, seen):
+        if seen is None:
+            return int(self.client.execute("GET", self._key("bus", "seq")) or 0), []
+        # GET + ZRANGEBYSCORE في رحلة واحدة: الحالة الشائعة (لا تغيير) ترجع قائمة فارغة
+        seq, members = self.client.pipeline([
+            ("GET", self._key("bus", "seq")),
+            ("ZRANGEBYSCORE", self._key("bus", "versions"), f"({seen}", "+inf"),
+        ])
+        seq = int(seq or 0)
+        if seq <= seen:
+            return seq, []
+        return seq, [tuple(json.loads(m)) for m in members]
+
+    def take_token(self, key_hash, capacity, rate, now):
+        reply = self.client.eval(_REDIS_TOKEN_SCRIPT, [self._key("rl", format(key_hash, "x"))],
+                                 [capacity, rate, now])
+        return float(reply)
+
+    def add_views(self, pending, now):
+        args = [self.prefix, now, TREND_LAMBDA, TREND_REBASE_EXPONENT]
+        for (category, filename), n in pending.items():
+            args.extend((category, filename, n))
+        self.client.eval(_REDIS_VIEWS_SCRIPT, [self._key("trend", "epoch"), self._key("trend", "boards")], args)
+
+    def get_views(self, category, filename):
+        score = self.client.execute("ZSCORE", self._key("views", "*"), f"{category}/{filename}")
+        return int(float(score)) if score is not None else 0
+
+    def all_views(self):
+        flat = self.client.execute("ZRANGE", self._key("views", "*"), 0, -1, "WITHSCORES")
+        views = {}
+        for member, score in zip(flat[::2], flat[1::2]):
+            category, _, filename = member.decode("utf-8").partition("/")
+            views[(category, filename)] = int(float(score))
+        return views
+
+    def top_posts(self, kind, category, limit):
+        board_kind = "trend" if kind == "trending" else "views"
+        board = self._key(board_kind, f"c:{category}" if category else "*")
+        flat, epoch = self.client.pipeline([
+            ("ZREVRANGE", board, 0, limit - 1, "WITHSCORES"),
+            ("GET", self._key("trend", "epoch")),
+        ])
+        items = []
+        for member, score in zip(flat[::2], flat[1::2]):
+            member = member.decode("utf-8")
+            if category:
+                items.append((category, member, float(score)))
+            else:
+                cat, _, filename = member.partition("/")
+                items.append((cat, filename, float(score)))
+        if kind != "trending":
+            return [(cat, fn, int(score), int(score)) for cat, fn, score in items if score > 0]
+
+        views = self.client.pipeline(
+            ("ZSCORE", self._key("views", "*"), f"{cat}/{fn}") for cat, fn, _score in items
+        )
+        decay = math.exp(-TREND_LAMBDA * (time.time() - float(epoch))) if epoch else 1.0
+        return [(cat, fn, int(float(v or 0)), score * decay)
+                for (cat, fn, score), v in zip(items, views) if score > 0]
+
+    def remove_posts(self, items):
+        commands = []
+        for category, filename in items:
+            for board_kind in ("views", "trend"):
+                commands.append(("ZREM", self._key(board_kind, "*"), f"{category}/{filename}"))
+                commands.append(("ZREM", self._key(board_kind, f"c:{category}"), filename))
+        self.client.pipeline(commands)
+
+    def merge_views(self, rows, epoch, force=False):
+        args = [self.prefix, epoch, TREND_LAMBDA, "1" if force else "0"]
+        for category, filename, views, trend in rows:
+            args.extend((category, filename, views or 0, trend or 0.0))
+        keys = [self._key("trend", "epoch"), self._key("trend", "boards"), self._key("views", "migrated")]
+        return bool(self.client.eval(_REDIS_MERGE_VIEWS_SCRIPT, keys, args))
+
+    def cache_get(self, namespace, key):
+        value = self.client.execute("GET", self._key("cache", namespace, key))
+        return value.decode("utf-8") if value is not None else None
+
+    def cache_set(self, namespace, key, value, ttl):
+        self.client.execute("SET", self._key("cache", namespace, key), value, "PX", int(ttl * 1000))
+
+    @contextmanager
+    def try_lock(self, name, ttl):
+        # المدة تحرر القفل إن مات حامله؛ والتوكن يمنع حذف قفل أخذه غيرنا بعد انتهائها
+        key = self._key("lock", name)
+        token = secrets.token_hex(16)
+        acquired = self.client.execute("SET", key, token, "NX", "PX", int(ttl * 1000)) is not None
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    self.client.eval(_REDIS_UNLOCK_SCRIPT, [key], [token])
+                except SharedStateError as e:
+                    print("Shared lock release error:", name, e)
+
+
+def make_shared_state(url: str) -> SharedState:
+    if url == "local":
+        return LocalSharedState(SHARED_CACHE_DIR)
+    if url.startswith("redis://"):
+        return RedisSharedState(url)
+    raise ValueError(f"Unknown shared state backend: {url}")
+
+
+shared_state = make_shared_state(SHARED_STATE_URL)
+
+
+# ==============================
+# ناقل إبطال الكاش بين العمليات (عدّادات إصدار في الحالة المشتركة)
+# ==============================
+# كل كاش داخل الذاكرة يشترك في namespace؛ الكاتب يرفع عدّاد الإصدار ذرّيًا،
+# وكل عملية تفحص العدّاد مرة واحدة لكل طلب (SELECT واحد على اتصال دائم، أو GET في Redis).
+# محليًا يمكن وضع الملف على قرص مشترك عبر CIT_CACHE_BUS_DB، والأفضل CIT_SHARED_STATE=redis://...
+CACHE_BUS_DB_PATH = os.environ.get("CIT_CACHE_BUS_DB", os.path.join(BASE_DIR, "cache_bus.db"))
+
+_bus_lock = threading.Lock()
+_bus_state = {"pid": None, "seen": None}
+_bus_subscribers = {}   # namespace -> [callback(key)]
+
+
+def init_cache_bus_db():
+    conn = db_connect(CACHE_BUS_DB_PATH)
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS bus_seq (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL
+        )
+    """)
+    c.execute("INSERT OR IGNORE INTO bus_seq (id, seq) VALUES (1, 0)")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS bus_versions (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            PRIMARY KEY (namespace, key)
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bus_versions_version ON bus_versions(version)")
+    conn.commit()
+    conn.close()
+
+
+def cache_bus_subscribe(namespace: str, callback):
+    """callback(key) يُستدعى عند الإبطال؛ key == "" تعني كل الـ namespace."""
+    _bus_subscribers.setdefault(namespace, []).append(callback)
+
+
+def _bus_dispatch(namespace: str, key: str):
+    for callback in _bus_subscribers.get(namespace, ()):
+        try:
+            callback(key)
+        except Exception as e:
+            print("Cache bus subscriber error:", namespace, key, e)
+
+
+def cache_bus_bump(namespace: str, key: str = ""):
+    """إبطال مفتاح (أو namespace كامل) في كل العمليات."""
+    cache_bus_bump_many([(namespace, key)])
+
+
+def cache_bus_bump_many(pairs):
+    """إبطال عدة (namespace, key) برفع واحد للعدّاد داخل معاملة واحدة."""
+    pairs = list(dict.fromkeys(pairs))
+    if not pairs:
+        return
+    try:
+        seq = shared_state.bump_versions(pairs)
+    except (sqlite3.Error, SharedStateError) as e:
+        print("Cache bus bump error:", e)
+        seq = None
+
+    with _bus_lock:
+        if seq is not None and _bus_state["pid"] == os.getpid() and _bus_state["seen"] == seq - 1:
+            _bus_state["seen"] = seq
+    # العملية الحالية تُبطل كاشها فورًا دون انتظار الطلب التالي
+    for namespace, key in pairs:
+        _bus_dispatch(namespace, key)
+    edge_purge_for_bus(pairs)
+
+
+def cache_bus_poll():
+    """فحص رخيص للتغييرات القادمة من العمليات الأخرى."""
+    with _bus_lock:
+        seen = _bus_state["seen"] if _bus_state["pid"] == os.getpid() else None
+    try:
+        seq, rows = shared_state.versions_since(seen)
+    except (sqlite3.Error, SharedStateError):
+        return
+
+    with _bus_lock:
+        if _bus_state["pid"] != os.getpid():
+            # عملية جديدة: كاشها فارغ أصلًا فلا حاجة لإبطال ما سبق
+            _bus_state.update(pid=os.getpid(), seen=seq)
+            return
+        if seen is None or seq <= _bus_state["seen"]:
+            return
+        _bus_state["seen"] = seq
+
+    for namespace, key in rows:
+        _bus_dispatch(namespace, key)
+
+
+@app.before_request
+def _poll_cache_bus():
+    cache_bus_poll()
+
+
+def mark_cache(hit: bool):
+    """تسجيل نتيجة الكاش للطلب الحالي (تظهر في سجل الطلبات)."""
+    if has_request_context() and g.get("cache_status") != "miss":
+        g.cache_status = "hit" if hit else "miss"
+
+
+class LocalCache:
+    """كاش LRU داخل العملية مشترك في ناقل الإبطال عبر namespace."""
+
+    def __init__(self, namespace: str, max_entries: int = 256):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        cache_bus_subscribe(namespace, self.invalidate)
+
+    def get_or_load(self, key: str, loader):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                mark_cache(True)
+                return self._data[key]
+        value = loader()
+        mark_cache(False)
+        with self._lock:
+            self._data[key] = value
+            if len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return value
+
+    def invalidate(self, key: str = ""):
+        with self._lock:
+            if key:
+                self._data.pop(key, None)
+            else:
+                self._data.clear()
+
+
+if not shared_state.distributed:
+    init_cache_bus_db()
+
+_categories_cache = LocalCache("categories", max_entries=4)
+_posts_catalog_cache = LocalCache("posts")
+
+
+def notify_post_changed(category: str, filename: str = None):
+    """يُستدعى بعد أي كتابة على مقال لإبطال الكاش المرتبط في كل العمليات."""
+    notify_posts_changed([(category, filename)])
+
+
+def notify_posts_changed(items):
+    """نسخة جماعية: items قائمة (category, filename) تُبطَل في معاملة واحدة."""
+    items = list(items)
+    cache_bus_bump_many([("posts", category) for category, _filename in items])
+    edge_purge(f"post:{category}/{filename}" for category, filename in items if filename)
+
+
+# ==============================
+# كاش HTTP أمامي (Varnish / nginx): مفاتيح بديلة + إبطال غير متزامن
+# ==============================
+# كل صفحة عامة تحمل ترويسة Surrogate-Key بمفاتيح ما تعرضه (nav، category:<القسم>،
+# post:<القسم>/<الملف>، comments:...، tag:...) وCache-Control بـ s-maxage حسب المسار،
+# ومع كل مفتاح مسبوق مفتاح عائلته (post:*، category:*...) لإبطال العائلة كلها دفعة واحدة،
+# فيحتفظ الكاش الأمامي بها طويلًا. كل كتابة تضع المفاتيح المتأثرة في طابور، وخيط خلفي
+# يرسلها دفعات عبر ناقل قابل للتبديل (أي كائن فيه purge(keys)):
+#   CIT_EDGE_PURGE=off (الافتراضي) | log | http://127.0.0.1:6081/[,http://cache2:6081/]
+# ناقل HTTP يرسل طلب PURGE واحدًا لكل دفعة والمفاتيح في ترويسة (xkey-purge لـ Varnish xkey).
+# طلبات المسجّلين أو التي تغيّر الجلسة تُعلَّم private، ويجب ألا يخزّن الكاش طلبًا فيه Cookie.
+EDGE_PURGE_URL = os.environ.get("CIT_EDGE_PURGE", "off")
+EDGE_CACHE_ENABLED = EDGE_PURGE_URL != "off"
+EDGE_PURGE_METHOD = os.environ.get("CIT_EDGE_PURGE_METHOD", "PURGE")
+EDGE_PURGE_HEADER = os.environ.get("CIT_EDGE_PURGE_HEADER", "xkey-purge")
+SURROGATE_KEY_HEADER = os.environ.get("CIT_SURROGATE_KEY_HEADER", "Surrogate-Key")
+EDGE_PURGE_BATCH_SECONDS = 0.5
+EDGE_PURGE_MAX_KEYS = 100       # مفاتيح لكل طلب إبطال
+EDGE_PURGE_RETRIES = 3
+
+# endpoint -> s-maxage بالثواني (المتصفح يعيد التحقق دائمًا؛ الإبطال يجعل المدة الطويلة آمنة)
+# الصفحات التي فيها قوائم الرواج أقصر لأن ترتيبها يتغيّر مع الوقت لا مع الكتابة
+EDGE_CACHE_POLICIES = {
+    "index": 300,
+    "projects": 300,
+    "tutorials": 300,
+    "articles": 300,
+    "dynamic_category": 300,
+    "latest": 3600,
+    "tag_page": 3600,
+    "view_post": 3600,
+    "about_page": 86400,
+    "offline_page": 86400,
+    "privacy_page": 86400,
+    "api_categories": 300,
+    "api_category_posts": 300,
+    "api_post": 3600,
+    "api_search": 300,
+    "api_comment_counts": 300,
+}
+
+# ما تعنيه كل إبطال في ناقل الكاش من مفاتيح الكاش الأمامي؛
+# المفتاح الفارغ (استعادة نسخة، نقل الخلفية...) يعني كل العائلة
+_EDGE_BUS_KEYS = {
+    "posts": lambda key: [f"category:{key}", "listing"] if key
+    else ["nav", "listing", "post:*", "category:*"],
+    "categories": lambda key: ["nav"],
+    "post_index": lambda key: ["listing"],
+    "tags": lambda key: ["tags"] if key == _TAGS_ALL_KEY else [f"tag:{key}"] if key else ["tags", "tag:*"],
+    "comments": lambda key: [f"comments:{key}"] if key else ["comments:*"],
+}
+
+
+class PurgeTransport:
+    """يرسل دفعة مفاتيح للكاش الأمامي؛ يرفع استثناء عند الفشل لتُعاد المحاولة."""
+
+    def purge(self, keys):
+        raise NotImplementedError
+
+
+class LogPurgeTransport(PurgeTransport):
+    """للتطوير: يطبع المفاتيح فقط."""
+
+    def purge(self, keys):
+        print("Edge purge:", " ".join(keys))
+
+
+class HttpPurgeTransport(PurgeTransport):
+    """طلب واحد لكل خادم كاش لكل دفعة: PURGE / مع المفاتيح مفصولة بمسافات."""
+
+    def __init__(self, urls, method=EDGE_PURGE_METHOD, header=EDGE_PURGE_HEADER, timeout=5):
+        self.urls = urls
+        self.method = method
+        self.header = header
+        self.timeout = timeout
+
+    def purge(self, keys):
+        for url in self.urls:
+            req = urllib.request.Request(url, method=self.method, headers={self.header: " ".join(keys)})
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                resp.read()
+
+
+def make_purge_transport(spec: str):
+    if spec == "off":
+        return None
+    if spec == "log":
+        return LogPurgeTransport()
+    if spec.startswith(("http://", "https://")):
+        return HttpPurgeTransport([url.strip() for url in spec.split(",") if url.strip()])
+    raise ValueError(f"Unknown edge purge transport: {spec}")
+
+
+edge_purge_transport = make_purge_transport(EDGE_PURGE_URL)
+
+_edge_pending = set()
+_edge_lock = threading.Lock()
+_edge_purger = {"pid": None, "wake": None}
+
+
+def edge_purge(keys):
+    """يضع المفاتيح في الطابور ويعود فورًا؛ الإرسال دفعات من خيط الخلفية."""
+    if edge_purge_transport is None:
+        return
+    keys = set(keys)
+    if not keys:
+        return
+    with _edge_lock:
+        if _edge_purger["pid"] != os.getpid():
+            _edge_pending.clear()
+            wake = threading.Event()
+            _edge_purger.update(pid=os.getpid(), wake=wake)
+            threading.Thread(target=_edge_purge_loop, args=(wake,), name="cit-edge-purger", daemon=True).start()
+        _edge_pending.update(keys)
+        _edge_purger["wake"].set()
+
+
+def _edge_purge_loop(wake):
+    while True:
+        wake.wait()
+        # ننتظر قليلًا لتتجمع كتابات الطلب نفسه (أو الطلبات المتقاربة) في دفعة واحدة
+        time.sleep(EDGE_PURGE_BATCH_SECONDS)
+        wake.clear()
+        flush_edge_purges()
+
+
+def flush_edge_purges():
+    with _edge_lock:
+        keys = sorted(_edge_pending)
+        _edge_pending.clear()
+    for i in range(0, len(keys), EDGE_PURGE_MAX_KEYS):
+        batch = keys[i:i + EDGE_PURGE_MAX_KEYS]
+        for attempt in range(EDGE_PURGE_RETRIES):
+            try:
+                edge_purge_transport.purge(batch)
+                break
+            except Exception as e:
+                print("Edge purge error:", e)
+                time.sleep(0.5 * 2 ** attempt)
+    return len(keys)
+
+
+atexit.register(lambda: _edge_purger["pid"] == os.getpid() and flush_edge_purges())
+
+
+def edge_purge_for_bus(pairs):
+    """ترجمة إبطالات الناقل إلى مفاتيح الكاش الأمامي (في العملية الكاتبة فقط)."""
+    keys = set()
+    for namespace, key in pairs:
+        mapper = _EDGE_BUS_KEYS.get(namespace)
+        if mapper:
+            keys.update(mapper(key))
+    edge_purge(keys)
+
+
+def add_surrogate_keys(*keys):
+    """يُستدعى داخل المسار لتعليم الصفحة بما تعرضه."""
+    if has_request_context():
+        g.setdefault("surrogate_keys", set()).update(keys)
+
+
+@app.after_request
+def _edge_cache_headers(response):
+    if not EDGE_CACHE_ENABLED:
+        return response
+    ttl = EDGE_CACHE_POLICIES.get(request.endpoint)
+    if ttl is None or request.method not in ("GET", "HEAD") or response.status_code != 200:
+        return response
+    if session.get("logged_in") or session.modified:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+
+    keys = g.get("surrogate_keys", set()) | {"nav"}
+    keys |= {key.split(":", 1)[0] + ":*" for key in keys if ":" in key}
+    response.headers[SURROGATE_KEY_HEADER] = " ".join(sorted(keys))
+    response.cache_control.public = True
+    response.cache_control.max_age = 0
+    response.cache_control.s_maxage = ttl
+    return response
+
+
+# ==============================
+# قواعد البيانات (Users + Categories + Password Resets + Email Verifications)
+# ==============================
+def init_users_db():
+    conn = db_connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT DEFAULT 'writer',
+            status TEXT DEFAULT 'active',
+            phone TEXT,
+            created_at TEXT,
+            email_verified INTEGER DEFAULT 0
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS password_resets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            token TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS email_verifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            token TEXT NOT NULL,
+            expires_at TEXT NOT NULL,
+            created_at TEXT,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    """)
+    conn.commit()
+    conn.close()
+
+
+def migrate_add_role_column():
+    conn = db_connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("PRAGMA table_info(users)")
+    cols = [r[1] for r in c.fetchall()]
+    if "role" not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN role TEXT DEFAULT 'writer'")
+    if "status" not in cols:
+        c.execute("ALTER TABLE users ADD COLUMN status TEXT DEFAULT 'active'")
+    if "phone" not in cols:
         c.execute("ALTER TABLE users ADD COLUMN phone TEXT")
     if "email_verified" not in cols:
         c.execute("ALTER TABLE users ADD COLUMN email_verified INTEGER DEFAULT 0")
@@ -200,8 +2109,19 @@ def migrate_add_role_column():
     conn.close()
 
 
+def ensure_users_indexes():
+    """فهارس ترقيم keyset على (created_at, id) مع الفلاتر الشائعة."""
+    conn = db_connect(DB_PATH)
+    c = conn.cursor()
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_created ON users(IFNULL(created_at, ''), id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_status_created ON users(status, IFNULL(created_at, ''), id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_users_role_created ON users(role, IFNULL(created_at, ''), id)")
+    conn.commit()
+    conn.close()
+
+
 def init_categories_db():
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS categories (
@@ -240,7 +2160,7 @@ def _col_exists(conn, table, col):
 
 
 def migrate_categories_schema():
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS categories (
@@ -291,7 +2211,11 @@ def ensure_category_dirs():
 
 
 def get_categories():
-    conn = sqlite3.connect(DB_PATH)
+    return [dict(cat) for cat in _categories_cache.get_or_load("active", _load_categories)]
+
+
+def _load_categories():
+    conn = db_connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     c.execute("""
@@ -307,7 +2231,7 @@ def get_categories():
 
 def get_category_by_folder(folder: str):
     """جلب بيانات قسم واحد اعتماداً على قيمة folder."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     c.execute("SELECT id, name, slug, folder FROM categories WHERE folder = ?", (folder,))
@@ -319,6 +2243,7 @@ def get_category_by_folder(folder: str):
 # استدعاءات التهيئة
 init_users_db()
 migrate_add_role_column()
+ensure_users_indexes()
 init_categories_db()
 migrate_categories_schema()
 ensure_category_dirs()
@@ -328,7 +2253,7 @@ ensure_category_dirs()
 # قاعدة بيانات إحصائيات المقالات
 # ==============================
 def init_posts_stats_db():
-    conn = sqlite3.connect(POSTS_STATS_DB_PATH)
+    conn = db_connect(POSTS_STATS_DB_PATH)
     c = conn.cursor()
     c.execute("""
         CREATE TABLE IF NOT EXISTS stats (
@@ -339,101 +2264,689 @@ def init_posts_stats_db():
             UNIQUE(category, filename)
         )
     """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS stats_meta (
+            key TEXT PRIMARY KEY,
+            value REAL
+        )
+    """)
     conn.commit()
     conn.close()
 
 
-init_posts_stats_db()
-
-
-def increment_view(category, filename):
-    conn = sqlite3.connect(POSTS_STATS_DB_PATH)
+def migrate_stats_trend_column():
+    conn = db_connect(POSTS_STATS_DB_PATH)
     c = conn.cursor()
-    c.execute("SELECT views FROM stats WHERE category=? AND filename=?", (category, filename))
-    row = c.fetchone()
-    if row:
-        c.execute(
-            "UPDATE stats SET views = views + 1 WHERE category=? AND filename=?",
-            (category, filename),
-        )
-    else:
-        c.execute(
-            "INSERT INTO stats (category, filename, views) VALUES (?, ?, 1)",
-            (category, filename),
-        )
+    c.execute("PRAGMA table_info(stats)")
+    cols = [r[1] for r in c.fetchall()]
+    if "trend" not in cols:
+        c.execute("ALTER TABLE stats ADD COLUMN trend REAL DEFAULT 0")
+    # فهارس تجعل "الأعلى K" قراءة K صف فقط بدل ترتيب الجدول كاملًا
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stats_trend ON stats(trend DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stats_cat_trend ON stats(category, trend DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stats_views ON stats(views DESC)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_stats_cat_views ON stats(category, views DESC)")
     conn.commit()
     conn.close()
 
 
-def get_views(category, filename):
-    conn = sqlite3.connect(POSTS_STATS_DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT views FROM stats WHERE category=? AND filename=?", (category, filename))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else 0
+init_posts_stats_db()
+migrate_stats_trend_column()
 
 
 # ==============================
-# شارة المدير + ضخ الأقسام للقوالب
+# المشاهدات المؤجلة + درجة الرواج المتناقصة زمنيًا
 # ==============================
-def get_pending_count():
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT COUNT(*) FROM users WHERE status = 'pending'")
-        (count,) = c.fetchone()
-        conn.close()
-        return count or 0
-    except Exception:
-        return 0
+# المشاهدات تُجمع في الذاكرة وتُكتب دفعة واحدة كل VIEWS_FLUSH_SECONDS.
+# الرواج = مجموع exp(-λ(now - t)) لكل مشاهدة (نصف عمر TREND_HALF_LIFE_HOURS).
+# نخزّن القيمة مضروبة في exp(λ(t - epoch)) بالنسبة لمرجع ثابت، فكل مشاهدة
+# إضافة فقط ولا حاجة لتحديث الصفوف الأخرى، والترتيب صحيح في أي لحظة.
+# عندما يكبر الأس نعيد المرجع (rebase) بضرب كل القيم في معامل واحد.
+VIEWS_FLUSH_SECONDS = 2.0
+TREND_HALF_LIFE_HOURS = float(os.environ.get("CIT_TREND_HALF_LIFE_HOURS", "24"))
+TREND_LAMBDA = math.log(2) / (TREND_HALF_LIFE_HOURS * 3600)
+TREND_REBASE_EXPONENT = 200.0   # exp(200) بعيد جدًا عن حدود float
+TRENDING_TOP_K = 5
+TRENDING_CACHE_SECONDS = 60
+
+_views_pending = Counter()
+_views_lock = threading.Lock()
+_views_flusher = {"pid": None}
+
+
+def _ensure_views_flusher():
+    if _views_flusher["pid"] == os.getpid():
+        return
+    with _views_lock:
+        if _views_flusher["pid"] != os.getpid():
+            # بعد fork: ما ورثناه من الأب ليس لنا
+            _views_pending.clear()
+            thread = threading.Thread(target=_views_flush_loop, name="cit-views-flusher", daemon=True)
+            _views_flusher["pid"] = os.getpid()
+            thread.start()
+
+
+def _views_flush_loop():
+    while True:
+        time.sleep(VIEWS_FLUSH_SECONDS)
+        try:
+            flush_views()
+        except Exception as e:
+            print("Views flush error:", e)
 
 
-@app.context_processor
-def inject_globals():
-    is_admin = (session.get("logged_in") and session.get("role") == "admin")
+def increment_view(category, filename):
+    """تسجيل مشاهدة في الذاكرة؛ الكتابة الفعلية دفعة واحدة في الخلفية."""
+    _ensure_views_flusher()
+    with _views_lock:
+        _views_pending[(category, filename)] += 1
+
+
+def flush_views():
+    with _views_lock:
+        if not _views_pending:
+            return 0
+        pending = dict(_views_pending)
+        _views_pending.clear()
+
     try:
-        categories = get_categories()
+        shared_state.add_views(pending, time.time())
     except Exception:
-        categories = []
-    return {
-        "is_admin": is_admin,
-        "pending_count": get_pending_count() if is_admin else 0,
-        "categories": categories,
-    }
+        # نعيد المشاهدات للطابور حتى لا تضيع
+        with _views_lock:
+            _views_pending.update(pending)
+        raise
+    return sum(pending.values())
 
 
-# ==============================
-# ديكوريتر حماية
-# ==============================
-def login_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if not session.get("logged_in"):
-            return redirect(url_for("auth_page"))
-        return f(*args, **kwargs)
+atexit.register(lambda: _views_flusher["pid"] == os.getpid() and flush_views())
 
-    return decorated
 
+def get_views(category, filename):
+    try:
+        stored = shared_state.get_views(category, filename)
+    except SharedStateError as e:
+        print("Views read error:", e)
+        stored = 0
+    with _views_lock:
+        pending = _views_pending.get((category, filename), 0)
+    return stored + pending
+
+
+@app.cli.command("shared-state-migrate")
+@click.option("--force", is_flag=True, help="النقل حتى لو سبق (الأرقام تُضاف مرة أخرى)")
+def shared_state_migrate_command(force):
+    """نقل المشاهدات والرواج من posts_stats.db إلى CIT_SHARED_STATE (مرة واحدة عند التحويل)."""
+    if not shared_state.distributed:
+        raise click.ClickException("❌ CIT_SHARED_STATE محلي أصلًا؛ اضبطه على redis://... أولًا.")
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    rows = conn.execute("""
+        SELECT category, filename, views, trend FROM stats
+        WHERE IFNULL(views, 0) > 0 OR IFNULL(trend, 0) > 0
+    """).fetchall()
+    epoch_row = conn.execute("SELECT value FROM stats_meta WHERE key = 'trend_epoch'").fetchone()
+    conn.close()
+    if not rows:
+        click.echo("لا توجد مشاهدات لنقلها.")
+        return
+    if not shared_state.merge_views(rows, epoch_row[0] if epoch_row else time.time(), force=force):
+        raise click.ClickException("❌ سبق نقل المشاهدات إلى هذا الخادم؛ استخدم --force لإضافتها مرة أخرى.")
+    notify_posts_changed([(category, None) for category in {row[0] for row in rows}])
+    click.echo(f"✅ تم نقل مشاهدات {len(rows)} مقال ({sum(r[2] or 0 for r in rows)} مشاهدة).")
 
-# ==============================
-# صفحات عامة
-# ==============================
-@app.route("/")
-def index():
-    return render_template("index.html")
 
+_trending_cache = LocalCache("trending", max_entries=64)
+# حذف/نشر/إخفاء مقال يُفرغ القوائم فورًا بدل انتظار انتهاء مدتها
+cache_bus_subscribe("posts", lambda key: _trending_cache.invalidate())
+cache_bus_subscribe("post_index", lambda key: _trending_cache.invalidate())
 
-# ==============================
-# واجهة موحدة للمستخدمين (تسجيل/دخول/استعادة)
-# ==============================
-@app.route("/auth", methods=["GET"])
-def auth_page():
-    return render_template("auth.html")
 
+def _query_top_posts(kind: str, category: str, limit: int):
+    try:
+        rows = shared_state.top_posts(kind, category, limit)
+    except SharedStateError as e:
+        print("Top posts read error:", e)
+        return []
 
-@app.route("/register_user", methods=["POST"])
-def register_user():
+    titles = {}
+    posts = []
+    for cat, fn, views, score in rows:
+        if cat not in titles:
+            titles[cat] = dict(list_posts_in_category(cat))
+        if fn not in titles[cat]:
+            continue   # محذوف أو غير منشور
+        posts.append({
+            "category": cat,
+            "filename": fn,
+            "title": titles[cat][fn],
+            "views": views,
+            "score": round(score, 2) if kind == "trending" else views,
+        })
+        if len(posts) >= TRENDING_TOP_K:
+            break
+    return posts
+
+
+def top_posts(kind: str, category: str = None):
+    """kind = trending | views؛ عام أو لقسم واحد. قراءة K صف عبر الفهرس + كاش قصير."""
+    # المفتاح يتضمن نافذة زمنية فينتهي تلقائيًا كل TRENDING_CACHE_SECONDS
+    window = int(time.time() // TRENDING_CACHE_SECONDS)
+    key = f"{kind}:{category or '*'}:{window}"
+    # نجلب ضعف K لتعويض المحذوف/غير المنشور
+    return _trending_cache.get_or_load(key, lambda: _query_top_posts(kind, category, TRENDING_TOP_K * 2))
+
+
+# ==============================
+# حالة النشر + النشر المجدول (فهرس post_index)
+# ==============================
+# لكل مقال صف: status = published | draft | scheduled، وpublish_at بتوقيت الرياض.
+# كل عملية تحتفظ بخريطة صغيرة لغير المنشور فقط، فالقوائم والبحث وview_post تفحص
+# العضوية فيها بدل أي مسح. خيط جدولة خفيف في كل عملية يقلب المستحق إلى published
+# ويُبطل الكاش عبر الناقل؛ والمقارنة بالوقت عند القراءة تُظهر المقال في موعده
+# بالضبط حتى قبل أن يستيقظ الخيط.
+POST_STATUSES = ("published", "draft", "scheduled")
+PUBLISH_TZ = pytz.timezone("Asia/Riyadh")
+PUBLISH_SCHEDULER_MAX_SLEEP = 60
+
+
+def init_post_index_db():
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    c = conn.cursor()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS post_index (
+            category TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'published',
+            publish_at TEXT,
+            created_at TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (category, filename)
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_post_index_status ON post_index(status, publish_at)")
+    # ترتيب "الأحدث" داخل القسم: وقت النشر الفعلي (المجدول) أو وقت الإنشاء
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_post_index_recent
+        ON post_index(category, IFNULL(publish_at, created_at) DESC, filename DESC)
+    """)
+    conn.commit()
+    conn.close()
+
+
+def backfill_post_index():
+    """المقالات الموجودة قبل الفهرس (أو المنسوخة يدويًا) تُسجَّل كمنشورة بتاريخ إنشائها."""
+    storage = post_storage()
+    rows = []
+    for category in storage.categories():
+        for filename, created in storage.list_created(category).items():
+            rows.append((category, filename, created, created))
+    if not rows:
+        return
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    conn.executemany("""
+        INSERT OR IGNORE INTO post_index (category, filename, status, created_at, updated_at)
+        VALUES (?, ?, 'published', ?, ?)
+    """, rows)
+    conn.commit()
+    conn.close()
+
+
+init_post_index_db()
+backfill_post_index()
+
+
+def _publish_now_str() -> str:
+    return datetime.now(PUBLISH_TZ).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _publish_epoch(value: str) -> float:
+    return PUBLISH_TZ.localize(datetime.strptime(value, "%Y-%m-%d %H:%M:%S")).timestamp()
+
+
+_unpublished = {"items": None, "lock": threading.Lock()}
+
+
+def _unpublished_invalidate(key):
+    _unpublished["items"] = None
+
+
+cache_bus_subscribe("post_index", _unpublished_invalidate)
+
+
+def unpublished_posts():
+    """{(category, filename): وقت الظهور epoch}؛ المسودة = inf. يُحمَّل مرة لكل تغيير."""
+    items = _unpublished["items"]
+    if items is None:
+        with _unpublished["lock"]:
+            items = _unpublished["items"]
+            if items is None:
+                conn = db_connect(POSTS_STATS_DB_PATH)
+                rows = conn.execute("""
+                    SELECT category, filename, status, publish_at FROM post_index
+                    WHERE status != 'published'
+                """).fetchall()
+                conn.close()
+                items = {}
+                for category, filename, status, publish_at in rows:
+                    due = float("inf")
+                    if status == "scheduled" and publish_at:
+                        due = _publish_epoch(publish_at)
+                    items[(category, filename)] = due
+                _unpublished["items"] = items
+    return items
+
+
+def is_post_visible(category: str, filename: str) -> bool:
+    items = unpublished_posts()
+    if not items:
+        return True
+    due = items.get((category, filename))
+    return due is None or due <= time.time()
+
+
+def get_publish_state(category: str, filename: str):
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    row = conn.execute("""
+        SELECT status, publish_at, created_at, updated_at FROM post_index
+        WHERE category = ? AND filename = ?
+    """, (category, filename)).fetchone()
+    conn.close()
+    if not row:
+        return {"status": "published", "publish_at": None, "created_at": None, "updated_at": None}
+    return dict(row)
+
+
+def upsert_post_index(category: str, filename: str, status: str = None, publish_at: str = None) -> bool:
+    """
+    تسجيل إنشاء/تعديل المقال في الفهرس. status=None يُبقي الحالة الحالية.
+    يعيد True إذا تغيّرت حالة النشر (يلزم إبطال خرائط غير المنشور في كل العمليات).
+    """
+    now = _publish_now_str()
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    c = conn.cursor()
+    c.execute("SELECT status, publish_at FROM post_index WHERE category = ? AND filename = ?",
+              (category, filename))
+    row = c.fetchone()
+    if status is None:
+        status, publish_at = row if row else ("published", None)
+    if status != "scheduled":
+        publish_at = None
+
+    if row is None:
+        c.execute("""
+            INSERT INTO post_index (category, filename, status, publish_at, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (category, filename, status, publish_at, now, now))
+        changed = status != "published"
+    else:
+        c.execute("""
+            UPDATE post_index SET status = ?, publish_at = ?, updated_at = ?
+            WHERE category = ? AND filename = ?
+        """, (status, publish_at, now, category, filename))
+        changed = (status, publish_at) != tuple(row)
+    conn.commit()
+    conn.close()
+    return changed
+
+
+def read_publish_form(form):
+    """(status, publish_at, خطأ) من حقول النموذج status + publish_at (datetime-local)."""
+    status = form.get("status") or "published"
+    if status not in POST_STATUSES:
+        return None, None, "❌ حالة نشر غير صالحة"
+    if status != "scheduled":
+        return status, None, None
+    raw = (form.get("publish_at") or "").strip()
+    try:
+        publish_at = datetime.strptime(raw, "%Y-%m-%dT%H:%M").strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None, None, "⚠️ حدّد وقت نشر صالح للمقال المجدول"
+    return status, publish_at, None
+
+
+def publish_due_posts():
+    """يقلب المجدول المستحق إلى published (ذرّيًا؛ عملية واحدة فقط تفوز بكل صف)."""
+    # بين عدة خوادم: خادم واحد ينشر في كل دورة والبقية يتخطّون حتى الدورة التالية
+    with shared_state.try_lock("publish-due", PUBLISH_SCHEDULER_MAX_SLEEP) as acquired:
+        if not acquired:
+            return []
+        return _publish_due_posts_locked()
+
+
+def _publish_due_posts_locked():
+    now = _publish_now_str()
+    conn = db_connect(POSTS_STATS_DB_PATH, isolation_level=None, timeout=10)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        due = conn.execute("""
+            SELECT category, filename FROM post_index
+            WHERE status = 'scheduled' AND publish_at <= ?
+        """, (now,)).fetchall()
+        if due:
+            conn.execute("""
+                UPDATE post_index SET status = 'published', updated_at = ?
+                WHERE status = 'scheduled' AND publish_at <= ?
+            """, (now, now))
+        conn.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    if due:
+        cache_bus_bump("post_index")
+        notify_posts_changed(due)
+    return due
+
+
+def _next_publish_delay() -> float:
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    row = conn.execute("SELECT MIN(publish_at) FROM post_index WHERE status = 'scheduled'").fetchone()
+    conn.close()
+    if not row or not row[0]:
+        return PUBLISH_SCHEDULER_MAX_SLEEP
+    return min(max(_publish_epoch(row[0]) - time.time(), 0.0), PUBLISH_SCHEDULER_MAX_SLEEP)
+
+
+_publish_scheduler = {"pid": None, "wake": None}
+_publish_scheduler_lock = threading.Lock()
+
+
+def _publish_scheduler_loop(wake):
+    while True:
+        try:
+            publish_due_posts()
+            delay = _next_publish_delay()
+        except Exception as e:
+            print("Publish scheduler error:", e)
+            delay = PUBLISH_SCHEDULER_MAX_SLEEP
+        wake.wait(delay)
+        wake.clear()
+
+
+def ensure_publish_scheduler(wake: bool = False):
+    """خيط واحد لكل عملية (يُعاد إنشاؤه بعد fork). wake=True لإعادة حساب الموعد فورًا."""
+    if _publish_scheduler["pid"] != os.getpid():
+        with _publish_scheduler_lock:
+            if _publish_scheduler["pid"] != os.getpid():
+                event = threading.Event()
+                thread = threading.Thread(target=_publish_scheduler_loop, args=(event,),
+                                          name="cit-publish-scheduler", daemon=True)
+                _publish_scheduler.update(pid=os.getpid(), wake=event)
+                thread.start()
+    if wake:
+        _publish_scheduler["wake"].set()
+
+
+@app.before_request
+def _start_publish_scheduler():
+    ensure_publish_scheduler()
+
+
+# ==============================
+# شارة المدير + ضخ الأقسام للقوالب
+# ==============================
+def get_pending_count():
+    try:
+        conn = db_connect(DB_PATH)
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM users WHERE status = 'pending'")
+        (count,) = c.fetchone()
+        conn.close()
+        return count or 0
+    except Exception:
+        return 0
+
+
+@app.context_processor
+def inject_globals():
+    is_admin = (session.get("logged_in") and session.get("role") == "admin")
+    try:
+        categories = get_categories()
+    except Exception:
+        categories = []
+    return {
+        "is_admin": is_admin,
+        "pending_count": get_pending_count() if is_admin else 0,
+        "categories": categories,
+    }
+
+
+# ==============================
+# ديكوريتر حماية
+# ==============================
+def login_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not session.get("logged_in"):
+            return redirect(url_for("auth_page"))
+        return f(*args, **kwargs)
+
+    return decorated
+
+
+# ==============================
+# تحديد معدل الطلبات (token bucket مشترك بين عمليات gunicorn)
+# ==============================
+# الحالة في ملف صغير معيّن في الذاكرة (mmap) يشترك فيه كل العمّال على نفس الخادم:
+# جدول تجزئة ثابت الحجم، كل خانة = (hash المفتاح، الرموز المتبقية، آخر تحديث).
+# الجدول مقسوم إلى شرائح؛ كل عملية فحص تقفل شريحة واحدة فقط (lockf على مداها
+# بين العمليات + Lock بين الخيوط)، فالكلفة بضع ميكروثوانٍ دون أي I/O فعلي.
+app.config["RATE_LIMIT_ENABLED"] = os.environ.get("CIT_RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_PATH = os.environ.get("CIT_RATE_LIMIT_FILE", os.path.join(BASE_DIR, "ratelimit.bin"))
+RATE_LIMIT_SLOTS = 8192
+RATE_LIMIT_STRIPE = 64          # خانات لكل شريحة قفل
+RATE_LIMIT_PROBES = 8           # أقصى عدد خانات نفحصها داخل الشريحة
+
+# خلف nginx: عدد البروكسيات الموثوقة حتى يصبح remote_addr هو عنوان العميل الحقيقي
+if int(os.environ.get("CIT_PROXY_COUNT", "0")) > 0:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ["CIT_PROXY_COUNT"]), x_proto=1)
+
+# اسم السياسة -> (السعة، رموز تُضاف في الثانية، المفاتيح، الطرق المحسوبة)
+RATE_LIMIT_POLICIES = {
+    "search": (30, 1.0, ("ip",), ("GET",)),
+    "api": (120, 10.0, ("ip",), ("GET",)),
+    "suggest": (60, 5.0, ("ip",), ("GET",)),
+    "comment": (5, 1 / 30, ("ip", "user"), ("POST",)),
+    "register": (5, 1 / 300, ("ip",), ("POST",)),
+    "forgot_password": (3, 1 / 600, ("ip",), ("POST",)),
+    "login": (10, 1 / 30, ("ip",), ("POST",)),
+    "view": (30, 0.5, ("ip",), ("POST",)),
+}
+
+_SLOT = struct.Struct("<Qdd")
+_RL_HEADER = struct.Struct("<8sQ")
+_RL_MAGIC = b"CITRL001"
+
+
+class TokenBucketStore:
+    """جدول الدلاء في ملف mmap؛ يُعاد فتحه بعد fork (كل عملية تحتاج mmap خاصًا بها)."""
+
+    def __init__(self, path, slots=RATE_LIMIT_SLOTS):
+        self.path = path
+        self.slots = slots
+        self._pid = None
+        self._mm = None
+        self._fd = None
+        self._locks = [threading.Lock() for _ in range(slots // RATE_LIMIT_STRIPE)]
+        self._open_lock = threading.Lock()
+
+    def _open(self):
+        with self._open_lock:
+            if self._pid == os.getpid():
+                return
+            size = _RL_HEADER.size + self.slots * _SLOT.size
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            try:
+                header = os.pread(fd, _RL_HEADER.size, 0)
+                if len(header) < _RL_HEADER.size or _RL_HEADER.unpack(header) != (_RL_MAGIC, self.slots):
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                    os.pwrite(fd, _RL_HEADER.pack(_RL_MAGIC, self.slots), 0)
+            finally:
+                fcntl.lockf(fd, fcntl.LOCK_UN)
+            self._mm = mmap.mmap(fd, size)
+            self._fd = fd
+            self._pid = os.getpid()
+
+    def take(self, key_hash: int, capacity: float, rate: float, now: float):
+        """يستهلك رمزًا واحدًا. يعيد 0 عند السماح وإلا عدد الثواني حتى يتوفر رمز."""
+        if self._pid != os.getpid():
+            self._open()
+        mm = self._mm
+        home = key_hash % self.slots
+        stripe = home // RATE_LIMIT_STRIPE
+        stripe_start = stripe * RATE_LIMIT_STRIPE
+        offset0 = _RL_HEADER.size + stripe_start * _SLOT.size
+        stripe_bytes = RATE_LIMIT_STRIPE * _SLOT.size
+
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, stripe_bytes, offset0)
+            try:
+                victim, victim_last = None, None
+                for i in range(RATE_LIMIT_PROBES):
+                    idx = stripe_start + (home - stripe_start + i) % RATE_LIMIT_STRIPE
+                    off = _RL_HEADER.size + idx * _SLOT.size
+                    h, tokens, last = _SLOT.unpack_from(mm, off)
+                    if h == key_hash:
+                        tokens = min(capacity, tokens + max(now - last, 0.0) * rate)
+                        if tokens >= 1.0:
+                            _SLOT.pack_into(mm, off, key_hash, tokens - 1.0, now)
+                            return 0.0
+                        _SLOT.pack_into(mm, off, key_hash, tokens, now)
+                        return (1.0 - tokens) / rate
+                    if h == 0:
+                        victim = off
+                        break
+                    if victim_last is None or last < victim_last:
+                        victim, victim_last = off, last
+                # مفتاح جديد (أو إزاحة أقدم خانة في مسار الفحص)
+                _SLOT.pack_into(mm, victim, key_hash, capacity - 1.0, now)
+                return 0.0
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, stripe_bytes, offset0)
+
+
+class _LocalTokenBuckets:
+    """بديل داخل العملية فقط حين لا يتوفر fcntl (ويندوز/التطوير)."""
+
+    def __init__(self, max_keys=RATE_LIMIT_SLOTS):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_keys = max_keys
+
+    def take(self, key_hash, capacity, rate, now):
+        with self._lock:
+            tokens, last = self._data.pop(key_hash, (capacity, now))
+            tokens = min(capacity, tokens + max(now - last, 0.0) * rate)
+            self._data[key_hash] = (tokens - 1.0 if tokens >= 1.0 else tokens, now)
+            if len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+            return 0.0 if tokens >= 1.0 else (1.0 - tokens) / rate
+
+
+# مع CIT_SHARED_STATE=redis تُحفظ الدلاء في Redis ولا يُفتح هذا الملف أصلًا
+_rate_buckets = TokenBucketStore(RATE_LIMIT_PATH) if fcntl is not None else _LocalTokenBuckets()
+
+
+def _rate_key_hash(policy: str, kind: str, value: str) -> int:
+    digest = hashlib.blake2b(f"{policy}|{kind}|{value}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") or 1
+
+
+def check_rate_limit(policy: str) -> float:
+    """0 إن سُمح بالطلب، وإلا الثواني المتبقية (Retry-After)."""
+    capacity, rate, kinds, _methods = RATE_LIMIT_POLICIES[policy]
+    now = time.time()
+    retry_after = 0.0
+    for kind in kinds:
+        if kind == "ip":
+            value = request.remote_addr or "-"
+        else:
+            value = session.get("username")
+            if not value:
+                continue
+        try:
+            wait = shared_state.take_token(_rate_key_hash(policy, kind, value), capacity, rate, now)
+        except (OSError, SharedStateError) as e:
+            # لا نُسقط الموقع بسبب عطل في ملف الحالة
+            print("Rate limiter error:", e)
+            return 0.0
+        retry_after = max(retry_after, wait)
+    return retry_after
+
+
+def rate_limit(policy: str):
+    """ديكوريتر: يرد 429 مع Retry-After عند تجاوز سياسة المسار."""
+    methods = RATE_LIMIT_POLICIES[policy][3]
+
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if app.config.get("RATE_LIMIT_ENABLED") and request.method in methods:
+                retry_after = check_rate_limit(policy)
+                if retry_after:
+                    seconds = max(int(retry_after + 0.999), 1)
+                    if request.accept_mimetypes.best == "application/json" or request.is_json:
+                        resp = jsonify({"error": "rate_limited", "retry_after": seconds})
+                    else:
+                        resp = Response(f"⏳ طلبات كثيرة، حاول مرة أخرى بعد {seconds} ثانية.",
+                                        mimetype="text/plain; charset=utf-8")
+                    resp.status_code = 429
+                    resp.headers["Retry-After"] = str(seconds)
+                    return resp
+            return f(*args, **kwargs)
+
+        return decorated
+
+    return decorator
+
+
+# مشاهدة واحدة لكل (IP، مقال) في النافذة: دلو سعته رمز واحد يعود بعد VIEW_DEDUPE_SECONDS،
+# في نفس جدول الدلاء فيتفق عليه كل العمّال (أو Redis مع CIT_SHARED_STATE)
+VIEW_DEDUPE_SECONDS = 30 * 60
+
+
+def count_view_once(category: str, filename: str) -> bool:
+    """increment_view إلا إن عُدّت مشاهدة من نفس العنوان لنفس المقال خلال النافذة."""
+    key = _rate_key_hash("view_once", request.remote_addr or "-", f"{category}/{filename}")
+    try:
+        if shared_state.take_token(key, 1, 1 / VIEW_DEDUPE_SECONDS, time.time()):
+            return False
+    except (OSError, SharedStateError) as e:
+        print("View dedupe error:", e)
+    increment_view(category, filename)
+    return True
+
+
+# ==============================
+# صفحات عامة
+# ==============================
+@app.route("/")
+def index():
+    add_surrogate_keys("listing")
+    return render_template("index.html",
+                           trending=top_posts("trending"),
+                           most_read=top_posts("views"),
+                           latest_html=render_latest_list())
+
+
+# ==============================
+# واجهة موحدة للمستخدمين (تسجيل/دخول/استعادة)
+# ==============================
+@app.route("/auth", methods=["GET"])
+def auth_page():
+    return render_template("auth.html")
+
+
+@app.route("/register_user", methods=["POST"])
+@rate_limit("register")
+def register_user():
     name = (request.form.get("register-name") or "").strip()
     email = (request.form.get("register-email") or "").strip().lower()
     phone = (request.form.get("register-phone") or "").strip()
@@ -448,7 +2961,7 @@ def register_user():
         flash("❌ كلمات المرور غير متطابقة", "error")
         return redirect(url_for("auth_page"))
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     c.execute("SELECT id FROM users WHERE email = ?", (email,))
@@ -471,7 +2984,7 @@ def register_user():
     expires_at = (datetime.utcnow() + timedelta(hours=24)).strftime("%Y-%m-%d %H:%M:%S")
     created_utc = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     c = conn.cursor()
     c.execute("""
         INSERT INTO email_verifications (user_id, token, expires_at, created_at)
@@ -523,7 +3036,7 @@ def register_user():
 
 @app.route("/verify/<token>")
 def verify_email(token):
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     c.execute("SELECT * FROM email_verifications WHERE token = ?", (token,))
@@ -579,6 +3092,7 @@ def verify_email(token):
 
 
 @app.route("/login", methods=["GET", "POST"])
+@rate_limit("login")
 def login():
     if request.method == "GET":
         return redirect(url_for("auth_page"))
@@ -592,7 +3106,7 @@ def login():
         flash("⚠️ الرجاء إدخال البريد/المستخدم وكلمة المرور", "error")
         return redirect(url_for("auth_page"))
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
 
@@ -640,6 +3154,7 @@ def logout():
 # استعادة كلمة المرور عبر البريد
 # ==============================
 @app.route("/forgot", methods=["POST"])
+@rate_limit("forgot_password")
 def forgot_password():
     email = (request.form.get("forgot-email") or
              request.form.get("email") or "").strip().lower()
@@ -648,7 +3163,7 @@ def forgot_password():
         flash("⚠️ أدخل بريدك الإلكتروني", "error")
         return redirect(url_for("auth_page"))
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     c.execute("SELECT id, email, username, email_verified FROM users WHERE email = ?", (email,))
@@ -668,7 +3183,7 @@ def forgot_password():
     expires_at = (datetime.utcnow() + timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
     now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     c = conn.cursor()
     c.execute("""
         INSERT INTO password_resets (user_id, token, expires_at, created_at)
@@ -720,7 +3235,7 @@ def forgot_password():
 
 @app.route("/reset/<token>", methods=["GET", "POST"])
 def reset_password(token):
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
     c.execute("SELECT * FROM password_resets WHERE token = ?", (token,))
@@ -798,7 +3313,7 @@ def admin_categories():
                 os.makedirs(os.path.join(BASE_MARKDOWN_DIR, folder), exist_ok=True)
                 os.makedirs(os.path.join(BASE_POSTS_DIR, folder), exist_ok=True)
 
-                conn = sqlite3.connect(DB_PATH)
+                conn = db_connect(DB_PATH)
                 c = conn.cursor()
                 c.execute("SELECT id FROM categories WHERE slug = ?", (slug,))
                 exists = c.fetchone()
@@ -812,6 +3327,7 @@ def admin_categories():
                     """, (name, slug, folder, sort_order, now))
                     conn.commit()
                     conn.close()
+                    cache_bus_bump("categories")
                     message = "✅ تم إنشاء القسم."
             except Exception as e:
                 error = f"❌ خطأ أثناء الإضافة: {e}"
@@ -829,7 +3345,7 @@ def delete_category(cat_id):
     PROTECTED = {"projects", "tutorials", "articles"}
 
     try:
-        conn = sqlite3.connect(DB_PATH)
+        conn = db_connect(DB_PATH)
         conn.row_factory = sqlite3.Row
         c = conn.cursor()
         c.execute("SELECT id, name, slug, folder FROM categories WHERE id = ?", (cat_id,))
@@ -838,584 +3354,2474 @@ def delete_category(cat_id):
             conn.close()
             return redirect(url_for("admin_categories"))
 
-        if row["slug"] in PROTECTED:
-            conn.close()
-            flash("⛔️ لا يمكن حذف قسم افتراضي.", "warning")
-            return redirect(url_for("admin_categories"))
+        if row["slug"] in PROTECTED:
+            conn.close()
+            flash("⛔️ لا يمكن حذف قسم افتراضي.", "warning")
+            return redirect(url_for("admin_categories"))
+
+        folder = row["folder"]
+        if post_storage().has_posts(folder):
+            conn.close()
+            flash("⚠️ احذف مقالات هذا القسم أولاً.", "warning")
+            return redirect(url_for("admin_categories"))
+
+        c.execute("DELETE FROM categories WHERE id = ?", (cat_id,))
+        conn.commit()
+        conn.close()
+        cache_bus_bump("categories")
+
+        try:
+            os.rmdir(os.path.join(BASE_MARKDOWN_DIR, folder))
+        except Exception:
+            pass
+        try:
+            os.rmdir(os.path.join(BASE_POSTS_DIR, folder))
+        except Exception:
+            pass
+
+        flash("🗑️ تم حذف القسم.", "success")
+    except Exception as e:
+        flash(f"❌ خطأ أثناء الحذف: {e}", "danger")
+
+    return redirect(url_for("admin_categories"))
+
+
+# ترقيم keyset: نتذكر (created_at, id) لآخر صف بدل OFFSET حتى يبقى كل طلب صفحة رخيصًا
+USERS_PAGE_SIZE = 50
+USER_FILTER_FIELDS = ("q", "role", "status", "email_verified")
+USER_EXPORT_COLUMNS = ("id", "username", "email", "phone", "role", "status", "email_verified", "created_at")
+
+
+def read_user_filters(args) -> dict:
+    filters = {}
+    q = (args.get("q") or "").strip()
+    if q:
+        filters["q"] = q
+    if args.get("role") in ("admin", "writer"):
+        filters["role"] = args["role"]
+    if args.get("status") in ("active", "pending", "banned"):
+        filters["status"] = args["status"]
+    if args.get("email_verified") in ("0", "1"):
+        filters["email_verified"] = args["email_verified"]
+    return filters
+
+
+def _users_where(filters: dict):
+    clauses, params = [], []
+    if "role" in filters:
+        clauses.append("role = ?")
+        params.append(filters["role"])
+    if "status" in filters:
+        clauses.append("status = ?")
+        params.append(filters["status"])
+    if "email_verified" in filters:
+        clauses.append("IFNULL(email_verified, 0) = ?")
+        params.append(int(filters["email_verified"]))
+    if "q" in filters:
+        like = "%" + re.sub(r"([\\%_])", r"\\\1", filters["q"].lower()) + "%"
+        clauses.append("(lower(username) LIKE ? ESCAPE '\\' OR email LIKE ? ESCAPE '\\')")
+        params.extend([like, like])
+    return clauses, params
+
+
+def encode_user_cursor(row) -> str:
+    raw = f"{row['created_at'] or ''}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_user_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, user_id = raw.rsplit("|", 1)
+        return created_at, int(user_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def query_users_page(filters: dict, after: str = None, limit: int = USERS_PAGE_SIZE):
+    """صفحة من المستخدمين (الأحدث أولًا) + مؤشر الصفحة التالية أو None."""
+    clauses, params = _users_where(filters)
+    position = decode_user_cursor(after) if after else None
+    if position:
+        clauses.append("(IFNULL(created_at, ''), id) < (?, ?)")
+        params.extend(position)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+
+    conn = db_connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(f"""
+        SELECT id, username, email, role, status, created_at, email_verified
+        FROM users
+        {where}
+        ORDER BY IFNULL(created_at, '') DESC, id DESC
+        LIMIT ?
+    """, (*params, limit + 1))
+    rows = c.fetchall()
+    conn.close()
+
+    next_cursor = encode_user_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def iter_users(filters: dict, batch_size: int = 500):
+    """مولّد صفوف من cursor واحد دون تحميل القائمة كاملة في الذاكرة."""
+    clauses, params = _users_where(filters)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    conn = db_connect(DB_PATH)
+    try:
+        c = conn.cursor()
+        c.execute(f"""
+            SELECT {", ".join(USER_EXPORT_COLUMNS)}
+            FROM users
+            {where}
+            ORDER BY IFNULL(created_at, '') DESC, id DESC
+        """, params)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+
+@app.route("/admin/pending-users")
+@login_required
+def pending_users():
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+
+    users, next_cursor = query_users_page({"status": "pending"}, request.args.get("after"))
+    return render_template("pending_users.html", users=users, next_cursor=next_cursor)
+
+
+@app.route("/admin/update-user/<int:user_id>/<string:action>")
+@login_required
+def update_user_status(user_id, action):
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+
+    status_map = {"approve": "active", "reject": "banned"}
+    if action not in status_map:
+        return "❌ أمر غير معروف", 400
+
+    results = apply_user_changes([user_id], "status", status_map[action], session.get("username"))
+    if results[0]["result"] == "skipped":
+        flash(results[0]["reason"], "error")
+
+    return redirect(url_for("pending_users"))
+
+
+# ==============================
+# تعديلات جماعية على المستخدمين (معاملة واحدة)
+# ==============================
+USER_ROLES = ("admin", "writer")
+USER_STATUSES = ("active", "banned", "pending")
+BULK_MAX_ITEMS = 1000
+
+
+def user_change_error(user, field, value, current_username):
+    """قواعد حماية النفس المشتركة بين التعديل الفردي والجماعي."""
+    if user["username"] == current_username:
+        if field == "role" and value != "admin":
+            return "🚫 لا يمكنك إزالة صلاحية المدير عن نفسك."
+        if field == "status" and value == "banned":
+            return "🚫 لا يمكنك حظر حسابك."
+    return None
+
+
+def apply_user_changes(user_ids, field, value, current_username):
+    """تطبيق role/status على عدة مستخدمين في معاملة واحدة مع تقرير لكل عنصر."""
+    if field not in ("role", "status"):
+        raise ValueError(field)
+
+    conn = db_connect(DB_PATH, isolation_level=None, timeout=10)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    results, to_update = [], []
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        found = {}
+        for start in range(0, len(user_ids), 500):
+            chunk = user_ids[start:start + 500]
+            c.execute(
+                f"SELECT id, username FROM users WHERE id IN ({','.join('?' * len(chunk))})",
+                chunk,
+            )
+            found.update({row["id"]: row for row in c.fetchall()})
+
+        for user_id in user_ids:
+            user = found.get(user_id)
+            if not user:
+                results.append({"id": user_id, "result": "not_found", "reason": "⚠️ المستخدم غير موجود"})
+                continue
+            error = user_change_error(user, field, value, current_username)
+            if error:
+                results.append({"id": user_id, "result": "skipped", "reason": error})
+                continue
+            to_update.append((value, user_id))
+            results.append({"id": user_id, "result": "updated"})
+
+        c.executemany(f"UPDATE users SET {field}=? WHERE id=?", to_update)
+        c.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            c.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return results
+
+
+def _bulk_ids(values):
+    ids = []
+    for v in values:
+        try:
+            ids.append(int(v))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(ids))[:BULK_MAX_ITEMS]
+
+
+def _bulk_response(results, fallback_endpoint):
+    """JSON لطلبات الـ API، أو رسالة ملخّصة مع إعادة التوجيه لطلبات النماذج."""
+    if request.is_json:
+        return jsonify({"results": results})
+
+    done = sum(1 for r in results if r["result"] in ("updated", "deleted"))
+    flash(f"✅ تم تنفيذ العملية على {done} من {len(results)} عنصر.", "success")
+    for r in results:
+        if r["result"] not in ("updated", "deleted"):
+            flash(f"{r.get('id')}: {r['reason']}", "warning")
+    return redirect(request.referrer or url_for(fallback_endpoint))
+
+
+@app.post("/admin/users/bulk")
+@login_required
+def admin_users_bulk():
+    """action بصيغة status:active أو role:admin، و ids قائمة أرقام المستخدمين."""
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+
+    data = request.get_json(silent=True) if request.is_json else None
+    if data is not None:
+        action, ids = data.get("action") or "", _bulk_ids(data.get("ids") or [])
+    else:
+        action, ids = request.form.get("action") or "", _bulk_ids(request.form.getlist("ids"))
+
+    field, _, value = action.partition(":")
+    valid = (field == "role" and value in USER_ROLES) or (field == "status" and value in USER_STATUSES)
+    if not valid or not ids:
+        if request.is_json:
+            return jsonify({"error": "invalid action or empty ids"}), 400
+        flash("⚠️ اختر مستخدمين وإجراءً صالحًا", "warning")
+        return redirect(request.referrer or url_for("admin_users"))
+
+    results = apply_user_changes(ids, field, value, session.get("username"))
+    return _bulk_response(results, "admin_users")
+
+
+@app.route("/admin/users")
+@login_required
+def admin_users():
+    """عرض المستخدمين (لوحة تحكم الأدمن) مع فلاتر وترقيم keyset."""
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+
+    filters = read_user_filters(request.args)
+    users, next_cursor = query_users_page(filters, request.args.get("after"))
+    return stream_page(
+        "admin_users.html",
+        users=users,
+        filters=filters,
+        next_cursor=next_cursor,
+        is_first_page=not request.args.get("after"),
+    )
+
+
+@app.route("/admin/users/export.<fmt>")
+@login_required
+def export_users(fmt):
+    """تصدير المستخدمين (مع نفس الفلاتر) كـ CSV أو JSONL بشكل متدفّق."""
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+    if fmt not in ("csv", "jsonl"):
+        return "❌ صيغة غير مدعومة", 404
+
+    filters = read_user_filters(request.args)
+
+    def generate():
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            buf.write("\ufeff")   # BOM حتى يفتح Excel النص العربي بشكل صحيح
+            writer.writerow(USER_EXPORT_COLUMNS)
+            for i, row in enumerate(iter_users(filters), 1):
+                writer.writerow(row)
+                if i % 500 == 0:
+                    yield buf.getvalue()
+                    buf.seek(0)
+                    buf.truncate()
+            yield buf.getvalue()
+        else:
+            for row in iter_users(filters):
+                yield json.dumps(dict(zip(USER_EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n"
+
+    stamp = datetime.now(pytz.timezone("Asia/Riyadh")).strftime("%Y%m%d-%H%M")
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=f"{mimetype}; charset=utf-8",
+        headers={"Content-Disposition": f"attachment; filename=users-{stamp}.{fmt}"},
+    )
+
+
+@app.route("/admin/users/set-role/<int:user_id>/<string:new_role>")
+@login_required
+def admin_set_user_role(user_id, new_role):
+    """تحديث دور المستخدم: writer / admin."""
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+
+    if new_role not in USER_ROLES:
+        flash("❌ دور غير صالح", "error")
+        return redirect(url_for("admin_users"))
+
+    results = apply_user_changes([user_id], "role", new_role, session.get("username"))
+    if results[0]["result"] != "updated":
+        flash(results[0]["reason"], "error" if results[0]["result"] == "skipped" else "warning")
+        return redirect(url_for("admin_users"))
+
+    flash("✅ تم تحديث دور المستخدم.", "success")
+    return redirect(url_for("admin_users"))
+
+
+@app.route("/admin/users/set-status/<int:user_id>/<string:new_status>")
+@login_required
+def admin_set_user_status(user_id, new_status):
+    """تحديث حالة المستخدم: active / banned / pending."""
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+
+    if new_status not in USER_STATUSES:
+        flash("❌ حالة غير صالحة", "error")
+        return redirect(url_for("admin_users"))
+
+    results = apply_user_changes([user_id], "status", new_status, session.get("username"))
+    if results[0]["result"] != "updated":
+        flash(results[0]["reason"], "error" if results[0]["result"] == "skipped" else "warning")
+        return redirect(url_for("admin_users"))
+
+    flash("✅ تم تحديث حالة المستخدم.", "success")
+    return redirect(url_for("admin_users"))
+
+
+# ==============================
+# “أضف مقالًا” + رفع الصور
+# ==============================
+@app.route("/form")
+@login_required
+def form():
+    if session.get("role") != "admin":
+        return "🚫 غير مسموح لك بإنشاء المقالات", 403
+    categories = get_categories()
+    return render_template("form.html", categories=categories)
+
+
+@app.route("/submit", methods=["POST"])
+@login_required
+def submit():
+    if session.get("role") != "admin":
+        return "🚫 صلاحيات غير كافية", 403
+
+    title = request.form["title"].strip()
+    filename = request.form["filename"].strip()
+    content = request.form["content"]       # HTML الناتج من Quill أو نص Markdown
+    category = request.form["category"].strip()
+    post_format = request.form.get("format", "html")
+    if post_format not in POST_FORMATS:
+        post_format = "html"
+    status, publish_at, error = read_publish_form(request.form)
+    if error:
+        flash(error, "error")
+        return redirect(url_for("form"))
+
+    # نحفظ بصيغة markdown: أول سطر عنوان بـ # ثم المحتوى
+    save_post(category, filename, f"# {title}\n\n{with_post_format(post_format, content)}",
+              author=session.get("username"), status=status, publish_at=publish_at)
+    set_post_tags(category, filename, parse_tags(request.form.get("tags", "")))
+    delete_draft(session.get("username"), "new")
+
+    # لا نولّد HTML منفصل الآن، العرض يتم من view_post + post_template.html
+    return redirect(url_for("form", success=1))
+
+
+@app.post("/upload_image")
+def upload_image():
+    if "file" not in request.files:
+        return jsonify({"error": "لم يتم إرسال ملف"}), 400
+    file = request.files["file"]
+    if file.filename == "":
+        return jsonify({"error": "لم يتم اختيار ملف"}), 400
+    if not allowed_file(file.filename):
+        return jsonify({"error": "صيغة الصورة غير مدعومة"}), 400
+
+    ext = file.filename.rsplit(".", 1)[1].lower()
+    base = secure_filename(file.filename.rsplit(".", 1)[0])[:40]
+    fname = f"{base or 'img'}_{uuid.uuid4().hex}.{ext}"
+    save_path = os.path.join(UPLOAD_FOLDER, fname)
+    file.save(save_path)
+
+    url = url_for("uploaded_file", filename=fname, _external=False)
+    return jsonify({"url": url}), 200
+
+
+# ==============================
+# تنزيل الملفات: تسليم الإرسال لـ nginx/Apache بدل بثّه من بايثون
+# ==============================
+# CIT_FILE_OFFLOAD=off (الافتراضي): Flask يرسل الملف بنفسه مع Range/If-Range/ETag/Content-Length.
+# CIT_FILE_OFFLOAD=nginx: نرد بترويسة X-Accel-Redirect فقط ويرسل nginx الملف، مثلًا:
+#     location /_cit_files/uploads/  { internal; alias /srv/cit/static/uploads/; }
+#     location /_cit_files/profiles/ { internal; alias /srv/cit/profiles/; }
+# CIT_FILE_OFFLOAD=sendfile: ترويسة X-Sendfile بالمسار الكامل (Apache mod_xsendfile / lighttpd).
+# في وضعي الإحالة يتولى الخادم الأمامي Range والطلبات الشرطية، فيتحرر العامل فورًا مهما بطؤ العميل.
+FILE_OFFLOAD = os.environ.get("CIT_FILE_OFFLOAD", "off")
+FILE_OFFLOAD_PREFIX = os.environ.get("CIT_FILE_OFFLOAD_PREFIX", "/_cit_files/")
+UPLOADS_MAX_AGE = 30 * 24 * 3600   # أسماء الصور فيها uuid فلا يتغيّر محتواها أبدًا
+
+
+def send_offloaded(root_name: str, directory: str, filename: str, as_attachment: bool = False,
+                   max_age: int = None):
+    """send_from_directory، أو ترويسة إحالة للخادم الأمامي حسب CIT_FILE_OFFLOAD."""
+    if FILE_OFFLOAD not in ("nginx", "sendfile"):
+        return send_from_directory(directory, filename, as_attachment=as_attachment, max_age=max_age)
+
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        raise NotFound()
+
+    # جسم فارغ: الخادم الأمامي يضع المحتوى وContent-Length من الملف نفسه (ويتولى 206 و304)
+    resp = Response(mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+    if as_attachment:
+        resp.headers.set("Content-Disposition", "attachment", filename=os.path.basename(filename))
+    if max_age:
+        resp.cache_control.public = True
+        resp.cache_control.max_age = max_age
+    if FILE_OFFLOAD == "nginx":
+        resp.headers["X-Accel-Redirect"] = f"{FILE_OFFLOAD_PREFIX}{root_name}/{urllib.parse.quote(filename)}"
+    else:
+        resp.headers["X-Sendfile"] = os.path.abspath(path)
+    return resp
+
+
+@app.route("/static/uploads/<path:filename>")
+def uploaded_file(filename):
+    """الصور المرفوعة بنفس روابط static القديمة، لكن مع الإحالة وكاش طويل."""
+    return send_offloaded("uploads", UPLOAD_FOLDER, filename, max_age=UPLOADS_MAX_AGE)
+
+
+# ==============================
+# الصور المضمّنة (data:image/...;base64) -> ملفات في uploads
+# ==============================
+# Quill يضمّن الصور الملصوقة/المسحوبة كـ data URI إن لم تمر عبر /upload_image، فيكبر المقال
+# بثلث حجم الصورة تقريبًا في كل قراءة وبحث ورد، ولا يخزّنها المتصفح. عند الحفظ نفك كل صورة
+# ونحفظها باسم من بصمة محتواها (التكرار = ملف واحد، والتشغيل المتكرر آمن) ونضع رابطها مكانها.
+# للمقالات الموجودة: flask --app app posts-extract-images [--dry-run]
+_INLINE_IMAGE_RE = re.compile(
+    r"""(src=["']|\]\()data:image/(png|jpe?g|gif|webp);base64,([A-Za-z0-9+/]+={0,2})(?=["')])""",
+    re.IGNORECASE,
+)
+_IMAGE_SIGNATURES = {
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "jpg": (b"\xff\xd8\xff",),
+    "gif": (b"GIF87a", b"GIF89a"),
+}
+INLINE_IMAGE_MAX_BYTES = MAX_UPLOAD_MB * 1024 * 1024   # نفس حد /upload_image
+
+
+def _inline_image_ext(data: bytes, declared: str):
+    """الامتداد إن طابق المحتوى النوع المعلن، وإلا None (لا نحفظ ما لا نعرفه)."""
+    ext = "jpg" if declared.lower() in ("jpg", "jpeg") else declared.lower()
+    if ext == "webp":
+        return ext if data[:4] == b"RIFF" and data[8:12] == b"WEBP" else None
+    return ext if data.startswith(_IMAGE_SIGNATURES[ext]) else None
+
+
+def store_inline_image(data: bytes, ext: str) -> str:
+    """يحفظ الصورة في uploads (إن لم تكن محفوظة) ويعيد اسم الملف."""
+    name = f"inline_{hashlib.sha256(data).hexdigest()[:32]}.{ext}"
+    path = os.path.join(UPLOAD_FOLDER, name)
+    if not os.path.exists(path):
+        fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return name
+
+
+def extract_inline_images(text: str):
+    """(النص بعد استبدال الصور المضمّنة بروابط، عدد الصور المستخرجة). يحتاج سياق طلب لـ url_for."""
+    if "data:image/" not in text:
+        return text, 0
+
+    extracted = 0
+
+    def replace(m):
+        nonlocal extracted
+        prefix, declared, payload = m.groups()
+        # الحجم معروف من طول base64 قبل فكّه
+        if len(payload) // 4 * 3 > INLINE_IMAGE_MAX_BYTES:
+            return m.group(0)
+        try:
+            data = base64.b64decode(payload, validate=True)
+        except ValueError:
+            return m.group(0)
+        ext = _inline_image_ext(data, declared)
+        if ext is None:
+            return m.group(0)
+        try:
+            name = store_inline_image(data, ext)
+        except OSError as e:
+            # نُبقي الصورة مضمّنة بدل إفشال الحفظ
+            print("Inline image store error:", e)
+            return m.group(0)
+        extracted += 1
+        return prefix + url_for("uploaded_file", filename=name)
+
+    return _INLINE_IMAGE_RE.sub(replace, text), extracted
+
+
+@app.cli.command("posts-extract-images")
+@click.option("--dry-run", is_flag=True, help="عدّ الصور المضمّنة فقط دون كتابة")
+def posts_extract_images_command(dry_run):
+    """نقل الصور المضمّنة في المقالات الحالية إلى uploads واستبدالها بروابط."""
+    storage = post_storage()
+    changed, total = [], 0
+    # url_for خارج الطلبات يحتاج سياق طلب صوري
+    with app.test_request_context():
+        for category in storage.categories():
+            # نجمع أولًا ثم نكتب حتى لا نعدّل ما نمرّ عليه
+            pending = [(fn, text) for fn, text in storage.iter_texts(category) if "data:image/" in text]
+            for filename, text in pending:
+                if dry_run:
+                    count = len(_INLINE_IMAGE_RE.findall(text))
+                else:
+                    new_text, count = extract_inline_images(text)
+                    if count:
+                        if not list_revisions(category, filename):
+                            record_revision(category, filename, text, author=None)
+                        storage.write(category, filename, new_text)
+                        record_revision(category, filename, new_text, author=None)
+                if count:
+                    changed.append((category, filename))
+                    total += count
+                    click.echo(f"🖼️ {category}/{filename}: {count} صورة")
+
+    if changed and not dry_run:
+        notify_posts_changed(changed)
+    verb = "ستُستخرج" if dry_run else "استُخرجت"
+    click.echo(f"✅ {verb} {total} صورة من {len(changed)} مقال.")
+
+
+# ==============================
+# مسودات الحفظ التلقائي (رقع نصية صغيرة بدل إرسال المقال كاملًا)
+# ==============================
+# المسودة مخزّنة مضغوطة لكل (مستخدم، مفتاح)؛ المفتاح "new" لمقال جديد أو "<category>/<filename>".
+# كل رقعة [start, delete_count, insert_text] بوحدات code point وتُطبَّق على نسخة محددة،
+# فإن تغيّرت النسخة في الخادم (نافذة أخرى مثلًا) نرجع 409 ليقرر المستخدم.
+DRAFT_META_FIELDS = ("title", "filename", "category")
+
+
+def get_draft(username, draft_key):
+    conn = db_connect(REVISIONS_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("SELECT * FROM drafts WHERE username = ? AND draft_key = ?", (username, draft_key))
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return None
+    draft = dict(row)
+    draft["content"] = zlib.decompress(draft["content"]).decode("utf-8")
+    return draft
+
+
+def delete_draft(username, draft_key):
+    conn = db_connect(REVISIONS_DB_PATH)
+    conn.execute("DELETE FROM drafts WHERE username = ? AND draft_key = ?", (username, draft_key))
+    conn.commit()
+    conn.close()
+
+
+def _apply_text_patches(text: str, patches) -> str:
+    for patch in patches:
+        start, delete_count, insert = patch
+        if not (isinstance(start, int) and isinstance(delete_count, int) and isinstance(insert, str)):
+            raise ValueError("bad patch")
+        if start < 0 or delete_count < 0 or start + delete_count > len(text):
+            raise ValueError("patch out of range")
+        text = text[:start] + insert + text[start + delete_count:]
+    return text
+
+
+def apply_draft_patch(username, draft_key, base_version, patches, meta):
+    """يرجع (status, payload): 200 مع النسخة الجديدة أو 409 مع نسخة الخادم."""
+    conn = db_connect(REVISIONS_DB_PATH, isolation_level=None, timeout=10)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT * FROM drafts WHERE username = ? AND draft_key = ?", (username, draft_key))
+        row = c.fetchone()
+        current_version = row["version"] if row else 0
+        if base_version != current_version:
+            c.execute("ROLLBACK")
+            return 409, {"conflict": True, "version": current_version}
+
+        text = zlib.decompress(row["content"]).decode("utf-8") if row else ""
+        text = _apply_text_patches(text, patches)
+        fields = {k: (meta[k] if k in meta else (row[k] if row else "")) for k in DRAFT_META_FIELDS}
+        now = datetime.now(pytz.timezone("Asia/Riyadh")).strftime("%Y-%m-%d %H:%M:%S")
+        c.execute("""
+            INSERT INTO drafts (username, draft_key, version, title, filename, category, content, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(username, draft_key) DO UPDATE SET
+                version = excluded.version, title = excluded.title, filename = excluded.filename,
+                category = excluded.category, content = excluded.content, updated_at = excluded.updated_at
+        """, (username, draft_key, current_version + 1, fields["title"], fields["filename"],
+              fields["category"], zlib.compress(text.encode("utf-8"), 6), now))
+        c.execute("COMMIT")
+        return 200, {"version": current_version + 1, "updated_at": now}
+    except Exception:
+        if conn.in_transaction:
+            c.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+@app.route("/drafts", methods=["GET", "DELETE"])
+@login_required
+def draft_api():
+    if session.get("role") != "admin":
+        return jsonify({"error": "forbidden"}), 403
+
+    draft_key = (request.args.get("key") or "").strip()
+    if not draft_key:
+        return jsonify({"error": "missing key"}), 400
+
+    if request.method == "DELETE":
+        delete_draft(session.get("username"), draft_key)
+        return jsonify({"deleted": True})
+
+    draft = get_draft(session.get("username"), draft_key)
+    if not draft:
+        return jsonify({"exists": False, "version": 0})
+    return jsonify({
+        "exists": True,
+        "version": draft["version"],
+        "title": draft["title"],
+        "filename": draft["filename"],
+        "category": draft["category"],
+        "content": draft["content"],
+        "updated_at": draft["updated_at"],
+    })
+
+
+@app.post("/drafts/patch")
+@login_required
+def draft_patch():
+    if session.get("role") != "admin":
+        return jsonify({"error": "forbidden"}), 403
+
+    data = request.get_json(silent=True) or {}
+    draft_key = (data.get("key") or "").strip()
+    base_version = data.get("base_version")
+    patches = data.get("patches") or []
+    if not draft_key or not isinstance(base_version, int) or not isinstance(patches, list):
+        return jsonify({"error": "bad request"}), 400
+
+    meta = {k: str(data[k]) for k in DRAFT_META_FIELDS if k in data}
+    try:
+        status, payload = apply_draft_patch(session.get("username"), draft_key, base_version, patches, meta)
+    except (ValueError, TypeError):
+        return jsonify({"error": "bad patch"}), 400
+    return jsonify(payload), status
+
+
+# ==============================
+# التعليقات (مربوطة بالقسم + اسم الملف) مع ردود متشعّبة
+# ==============================
+# كل تعليق يحمل مساره الكامل (materialized path): معرّفات أسلافه مبطّنة بأصفار ومفصولة بنقاط،
+# ومعرّف التعليق الجذر (thread_id). ترتيب path داخل النقاش = ترتيب العرض بالعمق أولًا،
+# فصفحة من النقاشات مع كل ردودها = مسح واحد لمدى من الفهرس (category, post_filename, thread_id DESC, path).
+# reply_count لكل تعليق = عدد كل الردود تحته، ويُحدَّث تزايديًا لكل الأسلاف عند الإضافة.
+COMMENT_MAX_DEPTH = 4             # الرد على تعليق في أقصى عمق يصبح أخًا له
+COMMENT_THREADS_PER_PAGE = 20
+_COMMENT_ID_WIDTH = 10
+
+
+def _comment_path_segment(comment_id: int) -> str:
+    return f"{comment_id:0{_COMMENT_ID_WIDTH}d}"
+
+
+def _ensure_comments_table():
+    """تهيئة جدول التعليقات + إضافة الأعمدة الناقصة في الجداول القديمة."""
+    conn = db_connect(COMMENTS_DB_PATH)
+    c = conn.cursor()
+
+    # إنشاء الجدول إن لم يكن موجوداً
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS comments(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT,
+            post_filename TEXT,
+            name TEXT,
+            comment TEXT,
+            timestamp TEXT,
+            parent_id INTEGER,
+            thread_id INTEGER,
+            path TEXT,
+            depth INTEGER NOT NULL DEFAULT 0,
+            reply_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    # التأكد من وجود الأعمدة في الجداول القديمة
+    c.execute("PRAGMA table_info(comments)")
+    cols = [row[1] for row in c.fetchall()]
+    if "category" not in cols:
+        c.execute("ALTER TABLE comments ADD COLUMN category TEXT")
+    if "path" not in cols:
+        c.execute("ALTER TABLE comments ADD COLUMN parent_id INTEGER")
+        c.execute("ALTER TABLE comments ADD COLUMN thread_id INTEGER")
+        c.execute("ALTER TABLE comments ADD COLUMN path TEXT")
+        c.execute("ALTER TABLE comments ADD COLUMN depth INTEGER NOT NULL DEFAULT 0")
+        c.execute("ALTER TABLE comments ADD COLUMN reply_count INTEGER NOT NULL DEFAULT 0")
+        # التعليقات القديمة كلها جذور
+        c.execute(f"""
+            UPDATE comments SET thread_id = id, path = printf('%0{_COMMENT_ID_WIDTH}d', id)
+            WHERE path IS NULL
+        """)
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_comments_thread
+        ON comments(category, post_filename, thread_id DESC, path)
+    """)
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_comments_roots
+        ON comments(category, post_filename, id) WHERE parent_id IS NULL
+    """)
+
+    conn.commit()
+    conn.close()
+
+
+_ensure_comments_table()
+
+
+def get_comments(category, filename, before: int = None, threads: int = COMMENT_THREADS_PER_PAGE):
+    """
+    صفحة من النقاشات (الأحدث أولًا): (مولّد الصفوف بالترتيب الجاهز للعرض، مؤشر الصفحة التالية).
+    before = thread_id لآخر نقاش في الصفحة السابقة. الصفوف تُقرأ من الفهرس أثناء عرض الصفحة،
+    فالذاكرة لا تكبر مع عدد الردود.
+    """
+    conn = db_connect(COMMENTS_DB_PATH)
+    # الجذور المطلوبة تحدد مدى thread_id (مع جذر إضافي فقط لنعرف هل توجد صفحة تالية)
+    root_ids = [row[0] for row in conn.execute("""
+        SELECT id FROM comments
+        WHERE category = ? AND post_filename = ? AND parent_id IS NULL AND id < ?
+        ORDER BY id DESC LIMIT ?
+    """, (category, filename, before or 2 ** 62, threads + 1))]
+    conn.close()
+
+    next_cursor = None
+    if len(root_ids) > threads:
+        root_ids = root_ids[:threads]
+        next_cursor = root_ids[-1]
+    if not root_ids:
+        return iter(()), None
+    return _iter_comment_threads(category, filename, root_ids[-1], root_ids[0]), next_cursor
+
+
+def _iter_comment_threads(category, filename, low: int, high: int):
+    """مسح واحد لمدى thread_id بترتيب الفهرس."""
+    conn = db_connect(COMMENTS_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    try:
+        yield from conn.execute("""
+            SELECT id, parent_id, thread_id, depth, reply_count, name, comment, timestamp
+            FROM comments
+            WHERE category = ? AND post_filename = ? AND thread_id BETWEEN ? AND ?
+            ORDER BY thread_id DESC, path
+        """, (category, filename, low, high))
+    finally:
+        conn.close()
+
+
+def count_comments(posts):
+    """{(category, filename): عدد التعليقات} لعدة مقالات باستعلام واحد (بادئة idx_comments_thread)."""
+    posts = list(dict.fromkeys(posts))
+    if not posts:
+        return {}
+    conn = db_connect(COMMENTS_DB_PATH)
+    clause, params = post_pairs_clause("category", "post_filename", posts)
+    rows = conn.execute(f"""
+        SELECT category, post_filename, COUNT(*) FROM comments
+        WHERE {clause}
+        GROUP BY category, post_filename
+    """, params).fetchall()
+    conn.close()
+    counts = dict.fromkeys(posts, 0)
+    counts.update({(category, filename): count for category, filename, count in rows})
+    return counts
+
+
+def add_comment_to_db(category, filename, name, comment, parent_id: int = None):
+    """
+    إضافة تعليق (أو رد على parent_id) لمقال معيّن داخل قسم معيّن.
+    يعيد معرّف التعليق، أو None إن لم يكن التعليق الأصلي تابعًا لنفس المقال.
+    """
+    tz = pytz.timezone('Asia/Riyadh')
+    timestamp = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S')
+
+    conn = db_connect(COMMENTS_DB_PATH, isolation_level=None)
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        parent = None
+        if parent_id is not None:
+            parent = c.execute("""
+                SELECT id, parent_id, thread_id, path, depth FROM comments
+                WHERE id = ? AND category = ? AND post_filename = ?
+            """, (parent_id, category, filename)).fetchone()
+            if parent is None:
+                c.execute("ROLLBACK")
+                return None
+            if parent[4] >= COMMENT_MAX_DEPTH:
+                # أقصى عمق: نعلّق الرد على جدّه فيظهر أخًا للتعليق مباشرة بعده
+                parent = c.execute(
+                    "SELECT id, parent_id, thread_id, path, depth FROM comments WHERE id = ?", (parent[1],)
+                ).fetchone()
+
+        c.execute("""
+            INSERT INTO comments (category, post_filename, name, comment, timestamp, parent_id, depth)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (category, filename, name, comment, timestamp,
+              parent[0] if parent else None, parent[4] + 1 if parent else 0))
+        comment_id = c.lastrowid
+        segment = _comment_path_segment(comment_id)
+        if parent:
+            c.execute("UPDATE comments SET thread_id = ?, path = ? WHERE id = ?",
+                      (parent[2], f"{parent[3]}.{segment}", comment_id))
+            # كل الأسلاف موجودون في مسار الأب
+            ancestors = [int(part) for part in parent[3].split(".")]
+            c.execute(f"""
+                UPDATE comments SET reply_count = reply_count + 1
+                WHERE id IN ({",".join("?" * len(ancestors))})
+            """, ancestors)
+        else:
+            c.execute("UPDATE comments SET thread_id = ?, path = ? WHERE id = ?",
+                      (comment_id, segment, comment_id))
+        c.execute("COMMIT")
+    except Exception:
+        if conn.in_transaction:
+            c.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    return comment_id
+
+
+# ==============================
+# صيغة المقال: HTML من Quill أو Markdown (مع كاش HTML المُصرَّف)
+# ==============================
+# المقال يعلن صيغته في أول سطر من المحتوى: <!-- format: markdown -->
+# بدون إعلان = HTML من Quill (السلوك القديم، يُعرض كما هو).
+# Markdown يُصرَّف ويُنقّى مرة واحدة لكل نسخة من المحتوى: كاش LRU في الذاكرة
+# ثم الكاش النصي في الحالة المشتركة (ملفات cache/markdown محليًا، أو Redis بين الخوادم)،
+# والمفتاح (المسار + mtime) فلا حاجة لإبطال.
+POST_FORMATS = ("html", "markdown")
+_FORMAT_DECL_RE = re.compile(r"\A\s*<!--\s*format:\s*([a-z]+)\s*-->[ \t]*\n?", re.IGNORECASE)
+
+MARKDOWN_RENDER_VERSION = 1   # ارفعه عند تغيير الإضافات أو قواعد التنقية
+MARKDOWN_MEMORY_CACHE_MAX = 256
+MARKDOWN_SHARED_CACHE_TTL = 7 * 24 * 3600
+
+if markdown_lib is None:
+    # مرة عند الإقلاع حتى لا يمر نشرٌ ناقص دون أن يلاحظه أحد
+    print("⚠️ مكتبة Markdown غير مثبتة (pip install -r requirements.txt): "
+          "مقالات Markdown ستُعرض نصًا خامًا.")
+
+
+def split_post_format(body: str):
+    """(الصيغة، المحتوى بدون سطر الإعلان)."""
+    m = _FORMAT_DECL_RE.match(body)
+    if m and m.group(1).lower() in POST_FORMATS:
+        return m.group(1).lower(), body[m.end():]
+    return "html", body
+
+
+def with_post_format(post_format: str, body: str) -> str:
+    if post_format == "markdown":
+        return f"<!-- format: markdown -->\n{body}"
+    return body
+
+
+class _HtmlSanitizer(HTMLParser):
+    """تنقية بقائمة سماح: وسوم وخصائص محددة وروابط http/https/mailto/نسبية فقط."""
+
+    ALLOWED_TAGS = {
+        "p", "br", "hr", "h1", "h2", "h3", "h4", "h5", "h6", "strong", "em", "b", "i", "u",
+        "s", "del", "ins", "sup", "sub", "code", "pre", "kbd", "blockquote", "ul", "ol", "li",
+        "a", "img", "table", "thead", "tbody", "tr", "th", "td", "span", "div", "dl", "dt", "dd",
+    }
+    VOID_TAGS = {"br", "hr", "img"}
+    DROP_CONTENT_TAGS = {"script", "style", "iframe", "object", "embed", "template", "noscript"}
+    ALLOWED_ATTRS = {
+        "a": {"href", "title", "class"},
+        "img": {"src", "alt", "title", "width", "height"},
+        "th": {"style", "align"},
+        "td": {"style", "align"},
+        "code": {"class"},
+        "pre": {"class"},
+        "div": {"class"},
+        "span": {"class"},
+        "ol": {"start"},
+        **{f"h{n}": {"id"} for n in range(1, 7)},
+    }
+    URL_ATTRS = {"href", "src"}
+    _SAFE_URL_RE = re.compile(r"^(?:https?:|mailto:|/|#|\.{0,2}/|[^:/?#]*(?:[/?#]|$))", re.IGNORECASE)
+    _SAFE_STYLE_RE = re.compile(r"^\s*text-align:\s*(left|right|center)\s*;?\s*$", re.IGNORECASE)
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self._drop_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.DROP_CONTENT_TAGS:
+            self._drop_depth += 1
+            return
+        if self._drop_depth or tag not in self.ALLOWED_TAGS:
+            return
+        allowed = self.ALLOWED_ATTRS.get(tag, ())
+        parts = [tag]
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in self.URL_ATTRS and not self._SAFE_URL_RE.match(value.strip()):
+                continue
+            if name == "style" and not self._SAFE_STYLE_RE.match(value):
+                continue
+            parts.append(f'{name}="{html_lib.escape(value, quote=True)}"')
+        if tag == "a":
+            parts.append('rel="nofollow noopener"')
+        self.out.append("<" + " ".join(parts) + ">")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag in self.DROP_CONTENT_TAGS:
+            self._drop_depth -= 1
+
+    def handle_endtag(self, tag):
+        if tag in self.DROP_CONTENT_TAGS:
+            self._drop_depth = max(self._drop_depth - 1, 0)
+            return
+        if self._drop_depth or tag not in self.ALLOWED_TAGS or tag in self.VOID_TAGS:
+            return
+        self.out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if not self._drop_depth:
+            self.out.append(html_lib.escape(data, quote=False))
+
+
+def sanitize_html(fragment: str) -> str:
+    parser = _HtmlSanitizer()
+    parser.feed(fragment)
+    parser.close()
+    return "".join(parser.out)
+
+
+def render_markdown(text: str) -> str:
+    """Markdown -> HTML منقّى (كتل كود مسوّرة + جداول + روابط للعناوين)."""
+    if markdown_lib is None:
+        # المكتبة غير مثبتة: نعرض النص كما هو بدل تعطيل الصفحة
+        return f'<pre class="markdown-raw">{html_lib.escape(text)}</pre>'
+    from markdown.extensions.toc import slugify_unicode
+    md = markdown_lib.Markdown(
+        extensions=["fenced_code", "tables", "toc", "sane_lists"],
+        extension_configs={"toc": {"slugify": slugify_unicode, "permalink": True}},
+    )
+    return sanitize_html(md.convert(text))
+
+
+_markdown_html_cache = LocalCache("markdown_html", max_entries=MARKDOWN_MEMORY_CACHE_MAX)
+
+
+def _load_markdown_html(cache_key: str, text: str) -> str:
+    try:
+        cached = shared_state.cache_get("markdown", cache_key)
+        if cached is not None:
+            return cached
+    except (OSError, SharedStateError) as e:
+        print("Markdown cache read error:", e)
+
+    with timed("markdown"):
+        rendered = render_markdown(text)
+    try:
+        shared_state.cache_set("markdown", cache_key, rendered, MARKDOWN_SHARED_CACHE_TTL)
+    except (OSError, SharedStateError) as e:
+        print("Markdown cache write error:", e)
+    return rendered
+
+
+def render_post_body(body: str, version: str = None) -> str:
+    """
+    HTML جاهز للقالب. version (من post_storage().read_versioned) يحدد مفتاح الكاش؛
+    بدونه (مثل المعاينة) نصرّف مباشرة.
+    """
+    post_format, content = split_post_format(body)
+    if post_format != "markdown":
+        return content
+    if version is None:
+        return render_markdown(content)
+    cache_key = f"v{MARKDOWN_RENDER_VERSION}:{version}"
+    return _markdown_html_cache.get_or_load(cache_key, lambda: _load_markdown_html(cache_key, content))
+
+
+# ==============================
+# عرض مقال واحد + مقالات مشابهة
+# ==============================
+@app.route("/post/<category>/<filename>")
+def view_post(category, filename):
+    # غير المنشور يظهر للمدير فقط (معاينة)
+    publish_state = None
+    if not is_post_visible(category, filename):
+        if session.get("role") != "admin":
+            return "❌ المقال غير موجود", 404
+        publish_state = get_publish_state(category, filename)
+
+    add_surrogate_keys(f"post:{category}/{filename}", f"comments:{category}/{filename}",
+                       f"category:{category}")
+
+    # قراءة المقال من المخزن
+    raw, version = post_storage().read_versioned(category, filename)
+    if raw is None:
+        return "❌ المقال غير موجود", 404
+
+    # زيادة عدد المشاهدات (لا تُعدّ معاينة المدير لمقال غير منشور)؛
+    # خلف الكاش الأمامي قد لا يصلنا الطلب أصلًا فيعدّها المتصفح بطلب منفصل
+    if not EDGE_CACHE_ENABLED and publish_state is None:
+        count_view_once(category, filename)
+    views = get_views(category, filename)
+
+    # استخراج العنوان من أول سطر يبدأ بـ # ثم تحويل المحتوى حسب صيغته
+    page_title, body = split_post_text(raw, filename)
+    body_html = render_post_body(body, version)
+
+    # محاولة استخراج تاريخ من النص (اختياري)
+    date_match = re.search(r"(\d{4}-\d{2}-\d{2})", raw)
+    # إذا لم نجد تاريخ، نخليها None بدلاً من "غير محدد"
+    date_value = date_match.group(1) if date_match else None
+
+    # جلب صفحة من نقاشات التعليقات لهذا المقال (مربوطة بالقسم + اسم الملف)
+    comments, comments_next = get_comments(category, filename,
+                                           before=request.args.get("comments_before", type=int))
+
+    # معلومات القسم (للبريدكرمب + زر العودة)
+    conn = db_connect(DB_PATH)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute(
+        "SELECT name, slug, folder FROM categories WHERE folder = ? AND is_active = 1",
+        (category,),
+    )
+    cat_row = c.fetchone()
+    conn.close()
+
+    if cat_row:
+        category_name = cat_row["name"]
+        category_slug = cat_row["slug"]
+    else:
+        category_name = category
+        category_slug = category
+
+    # مقالات مشابهة من نفس القسم: مولّد قواميس فيها رابط جاهز يُستهلك أثناء إرسال الصفحة
+    has_related, related_posts = peek_iter(
+        {"filename": fn, "title": t, "url": url_for("view_post", category=category, filename=fn)}
+        for fn, t in list_posts_in_category(category)
+        if fn != filename
+    )
+    has_comments, comments = peek_iter(comments)
+
+    return stream_page(
+        "post_template.html",
+        title=page_title,
+        content=body_html,
+        filename=filename,
+        comments=comments,
+        has_comments=has_comments,
+        comments_next=comments_next,
+        comment_max_depth=COMMENT_MAX_DEPTH,
+        date=date_value,
+        views=views,
+        category_name=category_name,
+        category_slug=category_slug,
+        related_posts=related_posts,
+        has_related=has_related,
+        publish_state=publish_state,
+        tags=get_post_tags(category, filename),
+        view_beacon_url=url_for("count_view", category=category, filename=filename) if EDGE_CACHE_ENABLED else None,
+    )
+
+
+@app.post("/post/<category>/<filename>/view")
+@rate_limit("view")
+def count_view(category, filename):
+    """عدّ المشاهدة من المتصفح حين تُخدم الصفحة من الكاش الأمامي."""
+    if is_post_visible(category, filename) and post_storage().exists(category, filename):
+        count_view_once(category, filename)
+    return "", 204
+
+
+# إضافة تعليق من النموذج
+@app.route("/add_comment/<category>/<filename>", methods=["POST"])
+@rate_limit("comment")
+def add_comment(category, filename):
+    if not session.get("logged_in"):
+        return "🚫 يجب تسجيل الدخول للتعليق", 403
+
+    name = session.get("username")
+    comment = request.form.get("comment", "").strip()
+    if not comment:
+        # لا نسمح بتعليق فارغ
+        return redirect(request.referrer or "/")
+
+    parent_id = request.form.get("parent_id", type=int)
+    if add_comment_to_db(category, filename, name, comment, parent_id=parent_id) is None:
+        flash("❌ التعليق الذي ترد عليه غير موجود", "error")
+        return redirect(request.referrer or "/")
+    cache_bus_bump("comments", f"{category}/{filename}")
+    return redirect(request.referrer or "/")
+
+
+# ==============================
+# البحث
+# ==============================
+def iter_search_results(query: str):
+    """مولّد النتائج قسمًا بقسم؛ تُرسل كل نتيجة للمتصفح فور العثور عليها."""
+    try:
+        cats = get_categories()
+    except Exception:
+        cats = [
+            {"folder": "projects"},
+            {"folder": "tutorials"},
+            {"folder": "articles"},
+        ]
+
+    storage = post_storage()
+    for cat in cats:
+        folder = cat["folder"]
+        for filename, title, snippet in storage.search(folder, query):
+            if not is_post_visible(folder, filename):
+                continue
+            yield {
+                "category": folder,
+                "filename": filename,
+                "title": title,
+                "snippet": snippet,
+            }
+
+
+@app.route("/search")
+@rate_limit("search")
+def search():
+    query = request.args.get("q", "").strip()
+    results = iter_search_results(query) if query else iter(())
+    return stream_page("search_results.html", query=query, results=results)
+
+
+# ==============================
+# اقتراحات البحث الفورية (شجرة بادئات بأفضل K في كل عقدة)
+# ==============================
+_AR_DIACRITICS_RE = re.compile(r"[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+_AR_NORMALIZE_TABLE = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ة": "ه", "ى": "ي", "ؤ": "و", "ئ": "ي"})
+_NON_WORD_RE = re.compile(r"[^\w\s]+")
+
+
+def normalize_ar(text: str) -> str:
+    """توحيد النص العربي للمطابقة: حذف التشكيل والتطويل وتوحيد الألف/التاء/الياء."""
+    text = _AR_DIACRITICS_RE.sub("", text or "").translate(_AR_NORMALIZE_TABLE).lower()
+    return " ".join(_NON_WORD_RE.sub(" ", text).split())
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids", "top")
+
+    def __init__(self):
+        self.children = {}
+        self.ids = set()
+        self.top = []
+
+
+class SuggestIndex:
+    """شجرة بادئات؛ كل عقدة تحفظ أفضل K مدخلات (حسب المشاهدات) تحتها.
+
+    الاستعلام = مشي على حروف البادئة فقط، والتحديث يعيد حساب العقد على مسار المفتاح.
+    العمق محدود (MAX_DEPTH) وكذلك عدد بدايات الكلمات المفهرسة لكل عنوان.
+    """
+
+    MAX_DEPTH = 16
+    MAX_WORD_STARTS = 4
+    TOP_K = 8
+
+    def __init__(self):
+        self.root = _TrieNode()
+        self.entries = {}   # entry_id -> dict(title, type, category, filename, slug, weight, norm)
+        self.lock = threading.Lock()
+
+    def _keys(self, norm: str):
+        words = norm.split(" ")
+        keys = set()
+        for i in range(min(len(words), self.MAX_WORD_STARTS)):
+            key = " ".join(words[i:])[:self.MAX_DEPTH]
+            if key:
+                keys.add(key)
+        return keys
+
+    def _rank(self, entry_id):
+        entry = self.entries[entry_id]
+        return (-entry["weight"], entry["title"])
+
+    def _recompute(self, node: _TrieNode):
+        candidates = set(node.ids)
+        for child in node.children.values():
+            candidates.update(child.top)
+        node.top = sorted(candidates, key=self._rank)[:self.TOP_K]
+
+    def _offer(self, node: _TrieNode, entry_id):
+        # الإضافة لا تُخرج إلا عنصرًا واحدًا من أفضل K، فلا حاجة لإعادة الحساب الكاملة
+        top = node.top
+        if entry_id in top:
+            return
+        if len(top) >= self.TOP_K and self._rank(entry_id) >= self._rank(top[-1]):
+            return
+        top.append(entry_id)
+        top.sort(key=self._rank)
+        del top[self.TOP_K:]
+
+    def _insert(self, entry_id):
+        for key in self._keys(self.entries[entry_id]["norm"]):
+            node = self.root
+            self._offer(node, entry_id)
+            for ch in key:
+                node = node.children.setdefault(ch, _TrieNode())
+                self._offer(node, entry_id)
+            node.ids.add(entry_id)
+
+    def _remove(self, entry_id):
+        entry = self.entries.get(entry_id)
+        if entry is None:
+            return
+        for key in self._keys(entry["norm"]):
+            path = [(None, self.root)]
+            node = self.root
+            for ch in key:
+                node = node.children.get(ch)
+                if node is None:
+                    break
+                path.append((ch, node))
+            else:
+                node.ids.discard(entry_id)
+            for depth in range(len(path) - 1, -1, -1):
+                ch, n = path[depth]
+                if depth and not n.ids and not n.children:
+                    del path[depth - 1][1].children[ch]
+                elif entry_id in n.top:
+                    n.top.remove(entry_id)
+                    self._recompute(n)
+        del self.entries[entry_id]
+
+    def upsert(self, entry_id, title, weight=0, **info):
+        with self.lock:
+            old = self.entries.get(entry_id)
+            if old and old["title"] == title and old["weight"] == weight:
+                return
+            self._remove(entry_id)
+            self.entries[entry_id] = dict(info, title=title, weight=weight, norm=normalize_ar(title))
+            self._insert(entry_id)
+
+    def remove(self, entry_id):
+        with self.lock:
+            self._remove(entry_id)
+
+    def ids_where(self, predicate):
+        with self.lock:
+            return [i for i, e in self.entries.items() if predicate(e)]
+
+    def match(self, text: str, entry_type: str = None, limit: int = 50):
+        """المدخلات التي يحتوي عنوانها الموحّد على النص في أي موضع (للبحث الكامل في العناوين)."""
+        norm = normalize_ar(text)
+        if not norm:
+            return []
+        with self.lock:
+            ids = [i for i, e in self.entries.items()
+                   if norm in e["norm"] and (entry_type is None or e["type"] == entry_type)]
+            ids.sort(key=self._rank)
+            return [dict(self.entries[i]) for i in ids[:limit]]
+
+    def query(self, prefix: str, limit: int = 8):
+        norm = normalize_ar(prefix)
+        if not norm:
+            return []
+        with self.lock:
+            node = self.root
+            for ch in norm[:self.MAX_DEPTH]:
+                node = node.children.get(ch)
+                if node is None:
+                    return []
+            ids = node.top
+            if len(norm) > self.MAX_DEPTH:
+                ids = [i for i in ids if any(k.startswith(norm) for k in
+                                             (" ".join(self.entries[i]["norm"].split(" ")[w:])
+                                              for w in range(self.MAX_WORD_STARTS)))]
+            return [dict(self.entries[i]) for i in ids[:limit]]
+
+
+_suggest_index = SuggestIndex()
+_suggest_state = {"built": False, "dirty_folders": set(), "categories_dirty": False,
+                  "weights_at": 0.0, "lock": threading.Lock()}
+SUGGEST_WEIGHTS_REFRESH_SECONDS = 60
+
+
+def _suggest_mark_folder(key):
+    if key:
+        _suggest_state["dirty_folders"].add(key)
+    else:
+        _suggest_state["built"] = False
+
+
+def _suggest_mark_categories(key):
+    _suggest_state["categories_dirty"] = True
+
+
+cache_bus_subscribe("posts", _suggest_mark_folder)
+cache_bus_subscribe("categories", _suggest_mark_categories)
+
+
+def _load_view_weights():
+    try:
+        return shared_state.all_views()
+    except SharedStateError as e:
+        print("Suggest weights error:", e)
+        return {}
+
+
+def _suggest_index_folder(folder, weights):
+    listed = dict(list_posts_in_category(folder))
+    stale = _suggest_index.ids_where(lambda e: e["type"] == "post" and e["category"] == folder)
+    for entry_id in stale:
+        if entry_id[2] not in listed:
+            _suggest_index.remove(entry_id)
+    for fn, title in listed.items():
+        _suggest_index.upsert(("post", folder, fn), title, weights.get((folder, fn), 0),
+                              type="post", category=folder, filename=fn)
+
+
+def _suggest_index_categories():
+    cats = get_categories()
+    live = {("category", cat["slug"]) for cat in cats}
+    for entry_id in _suggest_index.ids_where(lambda e: e["type"] == "category"):
+        if entry_id not in live:
+            _suggest_index.remove(entry_id)
+    for cat in cats:
+        # الأقسام تظهر قبل المقالات عند تساوي البادئة
+        _suggest_index.upsert(("category", cat["slug"]), cat["name"], float("inf"),
+                              type="category", category=cat["folder"], slug=cat["slug"])
+    return cats
+
+
+def ensure_suggest_index():
+    """بناء الفهرس أول مرة ثم تحديث الأقسام/المجلدات المتغيّرة فقط."""
+    state = _suggest_state
+    with state["lock"]:
+        now = time.monotonic()
+        if not state["built"]:
+            weights = _load_view_weights()
+            cats = _suggest_index_categories()
+            for cat in cats:
+                _suggest_index_folder(cat["folder"], weights)
+            state.update(built=True, categories_dirty=False, weights_at=now)
+            state["dirty_folders"].clear()
+            return
+
+        if state["categories_dirty"]:
+            state["categories_dirty"] = False
+            _suggest_index_categories()
+        if state["dirty_folders"]:
+            folders, state["dirty_folders"] = state["dirty_folders"], set()
+            weights = _load_view_weights()
+            for folder in folders:
+                _suggest_index_folder(folder, weights)
+        if now - state["weights_at"] > SUGGEST_WEIGHTS_REFRESH_SECONDS:
+            state["weights_at"] = now
+            for (cat, fn), views in _load_view_weights().items():
+                entry = _suggest_index.entries.get(("post", cat, fn))
+                if entry and entry["weight"] != views:
+                    _suggest_index.upsert(("post", cat, fn), entry["title"], views,
+                                          type="post", category=cat, filename=fn)
+
+
+@app.route("/search/suggest")
+@rate_limit("suggest")
+def search_suggest():
+    query = request.args.get("q", "").strip()
+    limit = min(max(request.args.get("limit", 8, type=int), 1), SuggestIndex.TOP_K)
+    if not query:
+        return jsonify({"q": query, "suggestions": []})
+
+    ensure_suggest_index()
+    suggestions = []
+    for entry in _suggest_index.query(query, limit):
+        if entry["type"] == "category":
+            url = url_for("dynamic_category", slug=entry["slug"])
+        else:
+            url = url_for("view_post", category=entry["category"], filename=entry["filename"])
+        suggestions.append({
+            "title": entry["title"],
+            "type": entry["type"],
+            "category": entry["category"],
+            "url": url,
+        })
+    return jsonify({"q": query, "suggestions": suggestions})
+
+
+# ==============================
+# إدارة المقالات (تعديل / حذف) - لوحة الأدمن
+# ==============================
+def iter_all_posts_with_category():
+    """
+    مولّد لكل المقالات في كل الأقسام، مرتبة حسب اسم القسم ثم العنوان (قسم واحد في الذاكرة كل مرة):
+    كل عنصر: {category_folder, category_name, category_slug, filename, title, status, publish_at}
+    """
+    states = {}
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    for category, filename, status, publish_at in conn.execute(
+        "SELECT category, filename, status, publish_at FROM post_index WHERE status != 'published'"
+    ):
+        states[(category, filename)] = (status, publish_at)
+    conn.close()
+
+    try:
+        cats = get_categories()
+    except Exception:
+        cats = []
+
+    for cat in sorted(cats, key=lambda c: c["name"]):
+        folder = cat["folder"]
+        posts = sorted(list_posts_in_category(folder, include_unpublished=True), key=lambda p: p[1])
+        for filename, title in posts:
+            status, publish_at = states.get((folder, filename), ("published", None))
+            if status == "scheduled" and is_post_visible(folder, filename):
+                status = "published"   # حلّ موعده والجدولة لم تمر بعد
+            yield {
+                "category_folder": folder,
+                "category_name": cat["name"],
+                "category_slug": cat["slug"],
+                "filename": filename,
+                "title": title,
+                "status": status,
+                "publish_at": publish_at,
+            }
+
+
+@app.route("/admin/posts")
+@login_required
+def admin_posts():
+    """قائمة جميع المقالات للأدمن فقط."""
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح", 403
+
+    has_posts, posts = peek_iter(iter_all_posts_with_category())
+    return stream_page("admin_posts.html", posts=posts, has_posts=has_posts)
+
+
+@app.route("/admin/posts/edit/<category>/<filename>", methods=["GET", "POST"])
+@login_required
+def edit_post(category, filename):
+    """تعديل مقال موجود (العنوان + المحتوى) داخل نفس القسم / نفس الملف."""
+    if session.get("role") != "admin":
+        return "🚫 صلاحيات غير كافية", 403
+
+    raw = post_storage().read(category, filename)
+    if raw is None:
+        return "❌ المقال غير موجود", 404
+
+    if request.method == "POST":
+        new_title = (request.form.get("title") or "").strip()
+        new_content = request.form.get("content") or ""
+        post_format = request.form.get("format", "html")
+        if post_format not in POST_FORMATS:
+            post_format = "html"
+
+        if not new_title:
+            flash("⚠️ يجب إدخال عنوان للمقال", "error")
+            return redirect(request.url)
+        status, publish_at, error = read_publish_form(request.form)
+        if error:
+            flash(error, "error")
+            return redirect(request.url)
+
+        # نكتب أول سطر كـ H1 ثم المحتوى (HTML من Quill)
+        save_post(category, filename, f"# {new_title}\n\n{with_post_format(post_format, new_content)}",
+                  author=session.get("username"), status=status, publish_at=publish_at)
+        set_post_tags(category, filename, parse_tags(request.form.get("tags", "")))
+        delete_draft(session.get("username"), f"{category}/{filename}")
+
+        flash("✅ تم حفظ تعديلات المقال بنجاح", "success")
+        return redirect(url_for("view_post", category=category, filename=filename))
+
+    # GET: تحميل المقال الحالي لملئ النموذج
+    title, body = split_post_text(raw, filename)
+    post_format, body_html = split_post_format(body)
+
+    cat_obj = get_category_by_folder(category)
+    category_name = cat_obj["name"] if cat_obj else category
+
+    return render_template(
+        "edit_post.html",
+        category=category,
+        category_name=category_name,
+        filename=filename,
+        title=title,
+        content=body_html,
+        post_format=post_format,
+        publish_state=get_publish_state(category, filename),
+        tags=get_post_tags(category, filename),
+    )
+
 
-        folder = row["folder"]
-        md_dir = os.path.join(BASE_MARKDOWN_DIR, folder)
-        has_files = any(glob.glob(os.path.join(md_dir, "*.md")))
-        if has_files:
-            conn.close()
-            flash("⚠️ احذف مقالات هذا القسم أولاً.", "warning")
-            return redirect(url_for("admin_categories"))
+def delete_posts(items):
+    """حذف عدة مقالات: المحتوى ثم الإحصائيات والتعليقات والنسخ والمسودات في معاملة واحدة لكل قاعدة."""
+    items = list(items)
+    removed = post_storage().delete_many(items)
+    results = []
+    for category, filename in items:
+        if (category, filename) in removed:
+            results.append({"id": f"{category}/{filename}", "result": "deleted"})
+        else:
+            results.append({"id": f"{category}/{filename}", "result": "not_found",
+                            "reason": "⚠️ الملف غير موجود"})
+    # نحذف البيانات المرتبطة حتى لو كان المقال محذوفًا مسبقًا
+    if items:
+        shared_state.remove_posts(items)
+        conn_stats = db_connect(POSTS_STATS_DB_PATH)
+        conn_stats.executemany("DELETE FROM post_index WHERE category=? AND filename=?", items)
+        changed_tags = remove_posts_tags(conn_stats.cursor(), items)
+        conn_stats.commit()
+        conn_stats.close()
+        cache_bus_bump_many([("post_index", "")] + [("tags", name) for name in set(changed_tags)]
+                            + ([("tags", _TAGS_ALL_KEY)] if changed_tags else []))
 
-        c.execute("DELETE FROM categories WHERE id = ?", (cat_id,))
-        conn.commit()
-        conn.close()
+        conn_comm = db_connect(COMMENTS_DB_PATH)
+        conn_comm.executemany("DELETE FROM comments WHERE category=? AND post_filename=?", items)
+        conn_comm.commit()
+        conn_comm.close()
 
-        try:
-            os.rmdir(os.path.join(BASE_MARKDOWN_DIR, folder))
-        except Exception:
-            pass
-        try:
-            os.rmdir(os.path.join(BASE_POSTS_DIR, folder))
-        except Exception:
-            pass
+        # سجل النسخ ومسودات الحفظ التلقائي (لكل المستخدمين) لم يعد لها مقال
+        conn_rev = db_connect(REVISIONS_DB_PATH)
+        conn_rev.executemany("DELETE FROM post_revisions WHERE category=? AND filename=?", items)
+        conn_rev.executemany("DELETE FROM drafts WHERE draft_key=?",
+                             [(f"{category}/{filename}",) for category, filename in items])
+        conn_rev.commit()
+        conn_rev.close()
 
-        flash("🗑️ تم حذف القسم.", "success")
-    except Exception as e:
-        flash(f"❌ خطأ أثناء الحذف: {e}", "danger")
+        # بعد الحذف فعلًا، وإلا قد يعيد طلب متزامن تخزين العدد القديم
+        cache_bus_bump_many([("comments", f"{category}/{filename}") for category, filename in items])
+        notify_posts_changed(items)
+    return results
 
-    return redirect(url_for("admin_categories"))
 
+def _parse_post_item(value: str):
+    """"category/filename" -> (category, filename) مع رفض المسارات غير الآمنة."""
+    category, _, filename = (value or "").partition("/")
+    if not category or not filename or "/" in filename or "\\" in value or ".." in (category, filename):
+        return None
+    return category, filename
 
-@app.route("/admin/pending-users")
+
+@app.post("/admin/posts/delete/<category>/<filename>")
 @login_required
-def pending_users():
+def delete_post(category, filename):
+    """حذف مقال + تنظيف الإحصائيات + التعليقات."""
     if session.get("role") != "admin":
-        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+        return "🚫 صلاحيات غير كافية", 403
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT id, username, email, role, status FROM users WHERE status = 'pending'")
-    users = c.fetchall()
-    conn.close()
+    try:
+        delete_posts([(category, filename)])
+        flash("🗑️ تم حذف المقال بنجاح", "success")
+    except Exception as e:
+        flash(f"❌ حدث خطأ أثناء حذف المقال: {e}", "error")
 
-    return render_template("pending_users.html", users=users)
+    return redirect(url_for("admin_posts"))
 
 
-@app.route("/admin/update-user/<int:user_id>/<string:action>")
+@app.post("/admin/posts/bulk-delete")
 @login_required
-def update_user_status(user_id, action):
+def bulk_delete_posts():
+    """حذف جماعي: items قائمة بصيغة category/filename."""
     if session.get("role") != "admin":
-        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+        return "🚫 صلاحيات غير كافية", 403
 
-    status_map = {"approve": "active", "reject": "banned"}
-    if action not in status_map:
-        return "❌ أمر غير معروف", 400
+    data = request.get_json(silent=True) if request.is_json else None
+    raw_items = (data.get("items") or []) if data is not None else request.form.getlist("items")
 
-    new_status = status_map[action]
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("UPDATE users SET status=? WHERE id=?", (new_status, user_id))
-    conn.commit()
-    conn.close()
+    items, results = [], []
+    for value in list(dict.fromkeys(raw_items))[:BULK_MAX_ITEMS]:
+        parsed = _parse_post_item(value) if isinstance(value, str) else None
+        if parsed is None:
+            results.append({"id": value, "result": "invalid", "reason": "❌ معرّف غير صالح"})
+        else:
+            items.append(parsed)
 
-    return redirect(url_for("pending_users"))
+    if not items and not results:
+        if request.is_json:
+            return jsonify({"error": "empty items"}), 400
+        flash("⚠️ لم تختر أي مقال", "warning")
+        return redirect(url_for("admin_posts"))
 
+    results.extend(delete_posts(items))
+    return _bulk_response(results, "admin_posts")
 
-@app.route("/admin/users")
-@login_required
-def admin_users():
-    """عرض جميع المستخدمين (لوحة تحكم الأدمن)."""
-    if session.get("role") != "admin":
-        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# ==============================
+# حفظ ذرّي + سجل مراجعات مضغوط (دلتا zlib)
+# ==============================
+# كل نسخة تُخزَّن كدلتا مقابل السابقة، مع لقطة كاملة كل REVISION_SNAPSHOT_EVERY نسخ
+# حتى تبقى إعادة البناء قصيرة، ونحتفظ بآخر REVISION_MAX_PER_POST نسخة فقط.
+REVISION_SNAPSHOT_EVERY = 10
+REVISION_MAX_PER_POST = 50
+
+
+def init_revisions_db():
+    conn = db_connect(REVISIONS_DB_PATH)
     c = conn.cursor()
     c.execute("""
-        SELECT id, username, email, role, status, created_at
-        FROM users
-        ORDER BY created_at DESC, id DESC
+        CREATE TABLE IF NOT EXISTS drafts (
+            username TEXT NOT NULL,
+            draft_key TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            title TEXT,
+            filename TEXT,
+            category TEXT,
+            content BLOB NOT NULL,
+            updated_at TEXT,
+            PRIMARY KEY (username, draft_key)
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS post_revisions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            rev INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            data BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            checksum TEXT NOT NULL,
+            author TEXT,
+            created_at TEXT,
+            UNIQUE(category, filename, rev)
+        )
     """)
-    users = c.fetchall()
+    conn.commit()
     conn.close()
 
-    return render_template("admin_users.html", users=users)
 
+init_revisions_db()
 
-@app.route("/admin/users/set-role/<int:user_id>/<string:new_role>")
-@login_required
-def admin_set_user_role(user_id, new_role):
-    """تحديث دور المستخدم: writer / admin."""
-    if session.get("role") != "admin":
-        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
 
-    if new_role not in ("admin", "writer"):
-        flash("❌ دور غير صالح", "error")
-        return redirect(url_for("admin_users"))
+def atomic_write_text(path: str, text: str):
+    """كتابة ملف مؤقت ثم rename: القارئ يرى النسخة القديمة أو الجديدة كاملة فقط."""
+    folder = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("SELECT id, username, role FROM users WHERE id = ?", (user_id,))
-    user = c.fetchone()
 
-    if not user:
-        conn.close()
-        flash("⚠️ المستخدم غير موجود", "warning")
-        return redirect(url_for("admin_users"))
+def _revision_tokens(text: str):
+    # التقسيم عند نهاية الوسوم والأسطر يناسب HTML الناتج من Quill (غالبًا سطر واحد طويل)
+    return [t for t in re.split(r"(?<=[>\n])", text) if t]
 
-    current_username = session.get("username")
 
-    # منع إنزال نفسك من admin إلى writer
-    if user["username"] == current_username and new_role != "admin":
-        conn.close()
-        flash("🚫 لا يمكنك إزالة صلاحية المدير عن نفسك.", "error")
-        return redirect(url_for("admin_users"))
+def _make_delta(old: str, new: str) -> list:
+    a, b = _revision_tokens(old), _revision_tokens(new)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, a, b).get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i1, i2])
+        elif j2 > j1:
+            ops.append(["i", "".join(b[j1:j2])])
+    return ops
 
-    c.execute("UPDATE users SET role=? WHERE id=?", (new_role, user_id))
-    conn.commit()
-    conn.close()
 
-    flash("✅ تم تحديث دور المستخدم.", "success")
-    return redirect(url_for("admin_users"))
+def _apply_delta(old: str, ops: list) -> str:
+    a = _revision_tokens(old)
+    out = []
+    for op in ops:
+        if op[0] == "c":
+            out.extend(a[op[1]:op[2]])
+        else:
+            out.append(op[1])
+    return "".join(out)
 
 
-@app.route("/admin/users/set-status/<int:user_id>/<string:new_status>")
-@login_required
-def admin_set_user_status(user_id, new_status):
-    """تحديث حالة المستخدم: active / banned / pending."""
-    if session.get("role") != "admin":
-        return "🚫 غير مصرح لك بدخول لوحة المدير", 403
+def _text_checksum(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
-    if new_status not in ("active", "banned", "pending"):
-        flash("❌ حالة غير صالحة", "error")
-        return redirect(url_for("admin_users"))
 
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+def _load_revision_text(conn, category, filename, rev):
     c = conn.cursor()
-    c.execute("SELECT id, username, status FROM users WHERE id = ?", (user_id,))
-    user = c.fetchone()
+    c.execute("""
+        SELECT rev, data FROM post_revisions
+        WHERE category = ? AND filename = ? AND kind = 'snapshot' AND rev <= ?
+        ORDER BY rev DESC LIMIT 1
+    """, (category, filename, rev))
+    snap = c.fetchone()
+    if not snap:
+        return None
+    text = zlib.decompress(snap[1]).decode("utf-8")
+    c.execute("""
+        SELECT data FROM post_revisions
+        WHERE category = ? AND filename = ? AND rev > ? AND rev <= ?
+        ORDER BY rev ASC
+    """, (category, filename, snap[0], rev))
+    for (data,) in c.fetchall():
+        text = _apply_delta(text, json.loads(zlib.decompress(data)))
+    return text
 
-    if not user:
+
+def get_revision_text(category, filename, rev):
+    conn = db_connect(REVISIONS_DB_PATH)
+    try:
+        return _load_revision_text(conn, category, filename, rev)
+    finally:
         conn.close()
-        flash("⚠️ المستخدم غير موجود", "warning")
-        return redirect(url_for("admin_users"))
 
-    current_username = session.get("username")
 
-    # منع حظر نفسك
-    if user["username"] == current_username and new_status == "banned":
+def list_revisions(category, filename):
+    conn = db_connect(REVISIONS_DB_PATH)
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    c.execute("""
+        SELECT rev, kind, size, length(data) AS stored, author, created_at
+        FROM post_revisions
+        WHERE category = ? AND filename = ?
+        ORDER BY rev DESC
+    """, (category, filename))
+    rows = [dict(r) for r in c.fetchall()]
+    conn.close()
+    return rows
+
+
+def record_revision(category, filename, text, author=None):
+    """إضافة نسخة جديدة (تُتجاهل إن كانت مطابقة لآخر نسخة)."""
+    checksum = _text_checksum(text)
+    now = datetime.now(pytz.timezone("Asia/Riyadh")).strftime("%Y-%m-%d %H:%M:%S")
+    conn = db_connect(REVISIONS_DB_PATH, isolation_level=None, timeout=10)
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""
+            SELECT rev, checksum FROM post_revisions
+            WHERE category = ? AND filename = ? ORDER BY rev DESC LIMIT 1
+        """, (category, filename))
+        last = c.fetchone()
+        if last and last[1] == checksum:
+            c.execute("COMMIT")
+            return last[0]
+
+        new_rev = last[0] + 1 if last else 1
+        c.execute("""
+            SELECT MAX(rev) FROM post_revisions
+            WHERE category = ? AND filename = ? AND kind = 'snapshot'
+        """, (category, filename))
+        (last_snapshot,) = c.fetchone()
+        if last is None or last_snapshot is None or new_rev - last_snapshot >= REVISION_SNAPSHOT_EVERY:
+            kind, payload = "snapshot", text.encode("utf-8")
+        else:
+            previous = _load_revision_text(conn, category, filename, last[0])
+            kind = "delta"
+            payload = json.dumps(_make_delta(previous, text), ensure_ascii=False).encode("utf-8")
+
+        c.execute("""
+            INSERT INTO post_revisions
+                (category, filename, rev, kind, data, size, checksum, author, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (category, filename, new_rev, kind, zlib.compress(payload, 9),
+              len(text), checksum, author, now))
+
+        # تقليم النسخ القديمة: أقدم نسخة متبقية تتحوّل إلى لقطة كاملة
+        oldest_kept = new_rev - REVISION_MAX_PER_POST + 1
+        if oldest_kept > 1:
+            c.execute("""
+                SELECT kind FROM post_revisions WHERE category = ? AND filename = ? AND rev = ?
+            """, (category, filename, oldest_kept))
+            row = c.fetchone()
+            if row and row[0] != "snapshot":
+                base_text = _load_revision_text(conn, category, filename, oldest_kept)
+                c.execute("""
+                    UPDATE post_revisions SET kind = 'snapshot', data = ?
+                    WHERE category = ? AND filename = ? AND rev = ?
+                """, (zlib.compress(base_text.encode("utf-8"), 9), category, filename, oldest_kept))
+            c.execute("""
+                DELETE FROM post_revisions WHERE category = ? AND filename = ? AND rev < ?
+            """, (category, filename, oldest_kept))
+        c.execute("COMMIT")
+        return new_rev
+    except Exception:
+        if conn.in_transaction:
+            c.execute("ROLLBACK")
+        raise
+    finally:
         conn.close()
-        flash("🚫 لا يمكنك حظر حسابك.", "error")
-        return redirect(url_for("admin_users"))
 
-    c.execute("UPDATE users SET status=? WHERE id=?", (new_status, user_id))
-    conn.commit()
-    conn.close()
 
-    flash("✅ تم تحديث حالة المستخدم.", "success")
-    return redirect(url_for("admin_users"))
+def save_post(category, filename, text, author=None, status=None, publish_at=None):
+    """حفظ ذرّي للمقال في المخزن + تسجيل نسخة + حالة النشر + إبطال الكاش."""
+    storage = post_storage()
+    text, _extracted = extract_inline_images(text)
 
+    # الحالة تُسجَّل قبل المحتوى حتى لا تظهر مسودة جديدة ولو للحظة
+    if upsert_post_index(category, filename, status, publish_at):
+        cache_bus_bump("post_index")
+        if status == "scheduled":
+            ensure_publish_scheduler(wake=True)
 
-# ==============================
-# “أضف مقالًا” + رفع الصور
-# ==============================
-@app.route("/form")
-@login_required
-def form():
-    if session.get("role") != "admin":
-        return "🚫 غير مسموح لك بإنشاء المقالات", 403
-    categories = get_categories()
-    return render_template("form.html", categories=categories)
+    # مقال قديم بلا سجل: نحفظ محتواه الحالي كنسخة أولى قبل الكتابة فوقه
+    if not list_revisions(category, filename):
+        current = storage.read(category, filename)
+        if current is not None:
+            record_revision(category, filename, current, author=None)
+
+    storage.write(category, filename, text)
+    try:
+        record_revision(category, filename, text, author=author)
+    except sqlite3.Error as e:
+        print("Revision store error:", e)
+    notify_post_changed(category, filename)
 
 
-@app.route("/submit", methods=["POST"])
+@app.route("/admin/posts/history/<category>/<filename>")
 @login_required
-def submit():
+def post_history(category, filename):
+    """سجل نسخ مقال مع عرض الفروقات."""
     if session.get("role") != "admin":
         return "🚫 صلاحيات غير كافية", 403
 
-    title = request.form["title"].strip()
-    filename = request.form["filename"].strip()
-    content = request.form["content"]       # HTML الناتج من Quill
-    category = request.form["category"].strip()
-
-    # مجلدات القسم
-    md_dir = os.path.join(BASE_MARKDOWN_DIR, category)
-    os.makedirs(md_dir, exist_ok=True)
-
-    # نحفظ في ملف markdown: أول سطر عنوان بـ # ثم المحتوى
-    md_path = os.path.join(md_dir, f"{filename}.md")
-    with open(md_path, "w", encoding="utf-8") as f:
-        f.write(f"# {title}\n\n{content}")
-
-    # لا نولّد HTML منفصل الآن، العرض يتم من view_post + post_template.html
-    return redirect(url_for("form", success=1))
+    revisions = list_revisions(category, filename)
+    diff_lines = None
+    selected = request.args.get("rev", type=int)
+    if selected:
+        new_text = get_revision_text(category, filename, selected)
+        if new_text is None:
+            return "❌ النسخة غير موجودة", 404
+        old_text = get_revision_text(category, filename, selected - 1) or ""
+        diff_lines = list(difflib.unified_diff(
+            _revision_tokens(old_text), _revision_tokens(new_text),
+            fromfile=f"rev {selected - 1}", tofile=f"rev {selected}", lineterm="", n=2,
+        ))
 
+    return render_template(
+        "post_history.html",
+        category=category,
+        filename=filename,
+        revisions=revisions,
+        selected=selected,
+        diff_lines=diff_lines,
+    )
 
-@app.post("/upload_image")
-def upload_image():
-    if "file" not in request.files:
-        return jsonify({"error": "لم يتم إرسال ملف"}), 400
-    file = request.files["file"]
-    if file.filename == "":
-        return jsonify({"error": "لم يتم اختيار ملف"}), 400
-    if not allowed_file(file.filename):
-        return jsonify({"error": "صيغة الصورة غير مدعومة"}), 400
 
-    ext = file.filename.rsplit(".", 1)[1].lower()
-    base = secure_filename(file.filename.rsplit(".", 1)[0])[:40]
-    fname = f"{base or 'img'}_{uuid.uuid4().hex}.{ext}"
-    save_path = os.path.join(UPLOAD_FOLDER, fname)
-    file.save(save_path)
+@app.post("/admin/posts/history/<category>/<filename>/restore/<int:rev>")
+@login_required
+def restore_revision(category, filename, rev):
+    if session.get("role") != "admin":
+        return "🚫 صلاحيات غير كافية", 403
 
-    url = url_for("static", filename=f"uploads/{fname}", _external=False)
-    return jsonify({"url": url}), 200
+    text = get_revision_text(category, filename, rev)
+    if text is None:
+        flash("⚠️ النسخة غير موجودة", "warning")
+    else:
+        save_post(category, filename, text, author=session.get("username"))
+        flash(f"✅ تمت استعادة النسخة رقم {rev}", "success")
+    return redirect(url_for("post_history", category=category, filename=filename))
 
 
 # ==============================
-# التعليقات (مربوطة بالقسم + اسم الملف)
+# أحدث المقالات (دمج k-way لقوائم الأقسام المرتبة)
 # ==============================
-def _ensure_comments_table():
-    """تهيئة جدول التعليقات + إضافة عمود category إن لم يكن موجوداً."""
-    conn = sqlite3.connect(COMMENTS_DB_PATH)
-    c = conn.cursor()
-
-    # إنشاء الجدول إن لم يكن موجوداً
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS comments(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            category TEXT,
-            post_filename TEXT,
-            name TEXT,
-            comment TEXT,
-            timestamp TEXT
-        )
-    """)
-
-    # التأكد من وجود العمود category في الجداول القديمة
-    c.execute("PRAGMA table_info(comments)")
-    cols = [row[1] for row in c.fetchall()]
-    if "category" not in cols:
-        c.execute("ALTER TABLE comments ADD COLUMN category TEXT")
-
-    conn.commit()
+# كل قسم له قائمة مرتبة تنازليًا من post_index (عبر الفهرس) في كاش "posts"،
+# فتُبطل قائمة القسم وحدها عند submit/edit/delete. الصفحة تُبنى بـ heapq.merge
+# الذي يقرأ من كل قائمة بقدر الحاجة فقط، والصفحة الأولى المعروضة (HTML) محفوظة
+# حتى أول كتابة تالية.
+LATEST_PAGE_SIZE = 10
+
+_latest_by_category = LocalCache("posts")
+_latest_first_page = LocalCache("latest_page", max_entries=4)
+cache_bus_subscribe("posts", lambda key: _latest_first_page.invalidate())
+cache_bus_subscribe("post_index", lambda key: _latest_first_page.invalidate())
+
+
+def _load_latest_in_category(category: str):
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    rows = conn.execute("""
+        SELECT IFNULL(publish_at, created_at) AS published, filename FROM post_index
+        WHERE category = ?
+        ORDER BY IFNULL(publish_at, created_at) DESC, filename DESC
+    """, (category,)).fetchall()
     conn.close()
+    return [(published or "", category, filename) for published, filename in rows]
 
 
-def get_comments(category, filename):
-    """إرجاع التعليقات الخاصة بمقال معيّن داخل قسم محدّد."""
-    _ensure_comments_table()
-    conn = sqlite3.connect(COMMENTS_DB_PATH)
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
-    c.execute("""
-        SELECT name, comment, timestamp
-        FROM comments
-        WHERE category = ? AND post_filename = ?
-        ORDER BY timestamp DESC
-    """, (category, filename))
-    comments = c.fetchall()
-    conn.close()
-    return comments
-
+def iter_latest_posts():
+    """مولّد لكل المقالات المنشورة من الأحدث للأقدم عبر كل الأقسام."""
+    streams, titles = [], {}
+    for cat in get_categories():
+        folder = cat["folder"]
+        streams.append(_latest_by_category.get_or_load(folder, lambda: _load_latest_in_category(folder)))
+        titles[folder] = (cat, dict(list_posts_in_category(folder)))
 
-def add_comment_to_db(category, filename, name, comment):
-    """إضافة تعليق لمقال معيّن داخل قسم معيّن."""
-    _ensure_comments_table()
-    tz = pytz.timezone('Asia/Riyadh')
-    timestamp = datetime.now(tz).strftime('%Y-%m-%d %H:%M:%S')
+    for published, folder, filename in heapq.merge(*streams, reverse=True):
+        cat, cat_titles = titles[folder]
+        # غير المنشور لا يظهر في list_posts_in_category، والمحذوف من المخزن كذلك
+        if filename not in cat_titles:
+            continue
+        yield {
+            "category": folder,
+            "category_name": cat["name"],
+            "filename": filename,
+            "title": cat_titles[filename],
+            "published": published[:10],
+        }
 
-    conn = sqlite3.connect(COMMENTS_DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO comments (category, post_filename, name, comment, timestamp)
-        VALUES (?, ?, ?, ?, ?)
-    """, (category, filename, name, comment, timestamp))
-    conn.commit()
-    conn.close()
 
+def latest_posts_page(page: int, per_page: int = LATEST_PAGE_SIZE):
+    """(عناصر الصفحة، هل توجد صفحة تالية)."""
+    items = list(islice(iter_latest_posts(), (page - 1) * per_page, page * per_page + 1))
+    return items[:per_page], len(items) > per_page
 
-# ==============================
-# عرض مقال واحد + مقالات مشابهة
-# ==============================
-@app.route("/post/<category>/<filename>")
-def view_post(category, filename):
-    # زيادة عدد المشاهدات
-    increment_view(category, filename)
-    views = get_views(category, filename)
 
-    # قراءة ملف markdown
-    md_path = os.path.join(BASE_MARKDOWN_DIR, category, f"{filename}.md")
-    if not os.path.exists(md_path):
-        return "❌ المقال غير موجود", 404
+def render_latest_list(page: int = 1) -> str:
+    """HTML لقائمة الأحدث؛ الصفحة الأولى (الرئيسية + /latest) تُحفظ حتى الكتابة التالية."""
+    def build():
+        posts, has_next = latest_posts_page(page)
+        return render_template("latest_list.html", posts=posts, page=page, has_next=has_next)
 
-    with open(md_path, "r", encoding="utf-8") as f:
-        raw = f.read()
+    if page != 1:
+        return build()
+    return _latest_first_page.get_or_load("page1", build)
 
-    # استخراج العنوان من أول سطر يبدأ بـ #
-    lines = raw.splitlines()
-    if lines and lines[0].lstrip().startswith("#"):
-        page_title = lines[0].lstrip("#").strip()
-        body_html = "\n".join(lines[1:]).strip()
-    else:
-        page_title = filename
-        body_html = raw
 
-    # محاولة استخراج تاريخ من النص (اختياري)
-    date_match = re.search(r"(\d{4}-\d{2}-\d{2})", raw)
-    # إذا لم نجد تاريخ، نخليها None بدلاً من "غير محدد"
-    date_value = date_match.group(1) if date_match else None
+@app.route("/latest")
+def latest():
+    page = max(request.args.get("page", 1, type=int), 1)
+    add_surrogate_keys("listing")
+    return render_template("latest.html", latest_html=render_latest_list(page), page=page)
 
-    # جلب التعليقات لهذا المقال (مربوطة بالقسم + اسم الملف)
-    comments = get_comments(category, filename)
 
-    # معلومات القسم (للبريدكرمب + زر العودة)
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+# ==============================
+# الوسوم (فهرس معكوس: وسم -> مقالات، مع عدّاد لكل وسم)
+# ==============================
+# الجداول في posts_stats.db بجانب post_index وتُحدَّث تزايديًا عند الحفظ/الحذف.
+# قائمة مقالات كل وسم تُحمَّل مرة في كاش "tags" (تُبطل لذلك الوسم فقط)،
+# والتقاطع لعدة وسوم يبدأ من أصغر مجموعة.
+TAGS_MAX_PER_POST = 10
+TAG_MAX_LENGTH = 40
+TAGS_POPULAR_LIMIT = 30
+_TAG_CLEAN_RE = re.compile(r"[^\w\-\+\.#]+")
+_TAGS_ALL_KEY = "*"
+
+
+def init_tags_db():
+    conn = db_connect(POSTS_STATS_DB_PATH)
     c = conn.cursor()
-    c.execute(
-        "SELECT name, slug, folder FROM categories WHERE folder = ? AND is_active = 1",
-        (category,),
-    )
-    cat_row = c.fetchone()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            post_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS post_tags (
+            tag_id INTEGER NOT NULL,
+            category TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            PRIMARY KEY (tag_id, category, filename)
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_post_tags_post ON post_tags(category, filename)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tags_count ON tags(post_count DESC)")
+    conn.commit()
     conn.close()
 
-    if cat_row:
-        category_name = cat_row["name"]
-        category_slug = cat_row["slug"]
-    else:
-        category_name = category
-        category_slug = category
-
-    # مقالات مشابهة من نفس القسم (قائمة قواميس فيها رابط جاهز)
-    related_posts = []
-    for fn, t in list_posts_in_category(category):
-        if fn == filename:
-            continue
 
-        related_posts.append({
-            "filename": fn,
-            "title": t,
-            "url": url_for("view_post", category=category, filename=fn),
-        })
+init_tags_db()
 
-    return render_template(
-        "post_template.html",
-        title=page_title,
-        content=body_html,
-        filename=filename,
-        comments=comments,
-        date=date_value,
-        views=views,
-        category_name=category_name,
-        category_slug=category_slug,
-        related_posts=related_posts,
-    )
 
+def normalize_tag(raw: str) -> str:
+    tag = (raw or "").strip().lstrip("#").lower()
+    tag = re.sub(r"\s+", "-", tag)
+    tag = _TAG_CLEAN_RE.sub("", tag).strip("-.")
+    return tag[:TAG_MAX_LENGTH]
 
-# إضافة تعليق من النموذج
-@app.route("/add_comment/<category>/<filename>", methods=["POST"])
-def add_comment(category, filename):
-    if not session.get("logged_in"):
-        return "🚫 يجب تسجيل الدخول للتعليق", 403
 
-    name = session.get("username")
-    comment = request.form.get("comment", "").strip()
-    if not comment:
-        # لا نسمح بتعليق فارغ
-        return redirect(request.referrer or "/")
+def parse_tags(raw: str):
+    """نص الحقل ("python، flask, ويب") -> قائمة وسوم موحّدة بلا تكرار."""
+    tags = []
+    for part in re.split(r"[,،;\n]+", raw or ""):
+        tag = normalize_tag(part)
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags[:TAGS_MAX_PER_POST]
 
-    add_comment_to_db(category, filename, name, comment)
-    return redirect(request.referrer or "/")
 
+def get_post_tags(category: str, filename: str):
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    rows = conn.execute("""
+        SELECT t.name FROM post_tags pt JOIN tags t ON t.id = pt.tag_id
+        WHERE pt.category = ? AND pt.filename = ?
+        ORDER BY t.name
+    """, (category, filename)).fetchall()
+    conn.close()
+    return [r[0] for r in rows]
+
+
+def tags_for_posts(posts):
+    """{(category, filename): [الوسوم]} لعدة مقالات باستعلام واحد."""
+    posts = list(dict.fromkeys(posts))
+    if not posts:
+        return {}
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    clause, params = post_pairs_clause("pt.category", "pt.filename", posts)
+    rows = conn.execute(f"""
+        SELECT pt.category, pt.filename, t.name FROM post_tags pt JOIN tags t ON t.id = pt.tag_id
+        WHERE {clause}
+        ORDER BY t.name
+    """, params).fetchall()
+    conn.close()
+    result = {post: [] for post in posts}
+    for category, filename, name in rows:
+        result[(category, filename)].append(name)
+    return result
 
-# ==============================
-# البحث
-# ==============================
-@app.route("/search")
-def search():
-    query = request.args.get("q", "").strip()
-    results = []
-    if not query:
-        return render_template("search_results.html", query=query, results=[])
 
+def _detach_post_tags(c, category: str, filename: str, keep=()):
+    """إزالة وسوم مقال (عدا keep) مع إنقاص العدّادات؛ يعيد أسماء الوسوم المتأثرة."""
+    c.execute("""
+        SELECT t.id, t.name FROM post_tags pt JOIN tags t ON t.id = pt.tag_id
+        WHERE pt.category = ? AND pt.filename = ?
+    """, (category, filename))
+    removed = [(tag_id, name) for tag_id, name in c.fetchall() if name not in keep]
+    for tag_id, _name in removed:
+        c.execute("DELETE FROM post_tags WHERE tag_id = ? AND category = ? AND filename = ?",
+                  (tag_id, category, filename))
+        c.execute("UPDATE tags SET post_count = post_count - 1 WHERE id = ?", (tag_id,))
+    if removed:
+        c.execute("DELETE FROM tags WHERE post_count <= 0")
+    return [name for _tag_id, name in removed]
+
+
+def set_post_tags(category: str, filename: str, tags):
+    """تحديث تزايدي: نضيف الجديد وننزع المحذوف فقط، في معاملة واحدة."""
+    tags = list(dict.fromkeys(tags))[:TAGS_MAX_PER_POST]
+    conn = db_connect(POSTS_STATS_DB_PATH, isolation_level=None, timeout=10)
+    c = conn.cursor()
     try:
-        cats = get_categories()
+        c.execute("BEGIN IMMEDIATE")
+        changed = _detach_post_tags(c, category, filename, keep=set(tags))
+        for name in tags:
+            c.execute("INSERT OR IGNORE INTO tags (name, post_count) VALUES (?, 0)", (name,))
+            (tag_id,) = c.execute("SELECT id FROM tags WHERE name = ?", (name,)).fetchone()
+            c.execute("INSERT OR IGNORE INTO post_tags (tag_id, category, filename) VALUES (?, ?, ?)",
+                      (tag_id, category, filename))
+            if c.rowcount:
+                c.execute("UPDATE tags SET post_count = post_count + 1 WHERE id = ?", (tag_id,))
+                changed.append(name)
+        c.execute("COMMIT")
     except Exception:
-        cats = [
-            {"folder": "projects"},
-            {"folder": "tutorials"},
-            {"folder": "articles"},
-        ]
+        if conn.in_transaction:
+            c.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
 
-    for cat in cats:
-        folder = cat["folder"]
-        folder_path = os.path.join(BASE_MARKDOWN_DIR, folder)
-        if not os.path.exists(folder_path):
-            continue
+    if changed:
+        cache_bus_bump_many([("tags", name) for name in changed] + [("tags", _TAGS_ALL_KEY)])
+    return changed
 
-        for path in glob.glob(os.path.join(folder_path, "*.md")):
-            filename = os.path.splitext(os.path.basename(path))[0]
-            title = filename
-            snippet = ""
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    lines = content.splitlines()
-                    if lines and lines[0].startswith("#"):
-                        title = lines[0].replace("#", "").strip()
-                    idx = content.lower().find(query.lower())
-                    if idx != -1:
-                        start = max(idx - 50, 0)
-                        snippet = content[start:start + 150].replace("\n", " ")
-            except Exception:
-                continue
 
-            if (query.lower() in title.lower()) or snippet:
-                results.append({
-                    "category": folder,
-                    "filename": filename,
-                    "title": title,
-                    "snippet": snippet,
-                })
+def remove_posts_tags(c, items):
+    """للحذف: تُستدعى داخل معاملة قاعدة الإحصائيات."""
+    changed = []
+    for category, filename in items:
+        changed.extend(_detach_post_tags(c, category, filename))
+    return changed
 
-    return render_template("search_results.html", query=query, results=results)
 
+_tag_postings = LocalCache("tags", max_entries=512)
+_tag_pages = LocalCache("tag_pages", max_entries=128)
+for _ns in ("tags", "posts", "post_index"):
+    cache_bus_subscribe(_ns, lambda key: _tag_pages.invalidate())
 
-# ==============================
-# إدارة المقالات (تعديل / حذف) - لوحة الأدمن
-# ==============================
-def list_all_posts_with_category():
-    """
-    ترجع قائمة بكل المقالات في كل الأقسام:
-    كل عنصر: {category_folder, category_name, category_slug, filename, title}
-    """
-    posts = []
-    try:
-        cats = get_categories()
-    except Exception:
-        cats = []
 
-    for cat in cats:
-        folder = cat["folder"]
-        cat_name = cat["name"]
-        cat_slug = cat["slug"]
-        md_dir = os.path.join(BASE_MARKDOWN_DIR, folder)
+def _load_tag_postings(name: str):
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    rows = conn.execute("""
+        SELECT pt.category, pt.filename FROM post_tags pt JOIN tags t ON t.id = pt.tag_id
+        WHERE t.name = ?
+    """, (name,)).fetchall()
+    conn.close()
+    return frozenset((category, filename) for category, filename in rows)
+
+
+def posts_with_tags(names):
+    """تقاطع مجموعات المقالات لكل الوسوم (الأصغر أولًا)."""
+    postings = sorted((_tag_postings.get_or_load(n, lambda: _load_tag_postings(n)) for n in names), key=len)
+    if not postings:
+        return set()
+    result = set(postings[0])
+    for other in postings[1:]:
+        if not result:
+            break
+        result &= other
+    return result
+
+
+def popular_tags():
+    def load():
+        conn = db_connect(POSTS_STATS_DB_PATH)
+        rows = conn.execute(
+            "SELECT name, post_count FROM tags WHERE post_count > 0 ORDER BY post_count DESC LIMIT ?",
+            (TAGS_POPULAR_LIMIT,),
+        ).fetchall()
+        conn.close()
+        return [{"name": name, "count": count} for name, count in rows]
+    return _tag_postings.get_or_load(_TAGS_ALL_KEY, load)
 
-        if not os.path.exists(md_dir):
-            continue
 
-        for path in glob.glob(os.path.join(md_dir, "*.md")):
-            filename = os.path.splitext(os.path.basename(path))[0]
-            title = filename
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    first_line = f.readline()
-                    if first_line.lstrip().startswith("#"):
-                        title = first_line.replace("#", "").strip()
-            except Exception:
-                pass
+def tag_listing(names):
+    """المقالات المنشورة التي تحمل كل الوسوم، مرتبة حسب القسم ثم العنوان (مع كاش)."""
+    key = "+".join(sorted(names))
 
+    def build():
+        cats = {cat["folder"]: cat for cat in get_categories()}
+        titles = {}
+        posts = []
+        for category, filename in posts_with_tags(names):
+            if category not in cats:
+                continue
+            if category not in titles:
+                titles[category] = dict(list_posts_in_category(category))
+            if filename not in titles[category]:
+                continue   # غير منشور أو محذوف
             posts.append({
-                "category_folder": folder,
-                "category_name": cat_name,
-                "category_slug": cat_slug,
+                "category": category,
+                "category_name": cats[category]["name"],
                 "filename": filename,
-                "title": title,
+                "title": titles[category][filename],
             })
+        posts.sort(key=lambda p: (p["category_name"], p["title"]))
+        return posts
 
-    # ترتيب بسيط: حسب اسم القسم ثم العنوان
-    posts.sort(key=lambda p: (p["category_name"], p["title"]))
-    return posts
+    return _tag_pages.get_or_load(key, build)
 
 
-@app.route("/admin/posts")
-@login_required
-def admin_posts():
-    """قائمة جميع المقالات للأدمن فقط."""
-    if session.get("role") != "admin":
-        return "🚫 غير مصرح", 403
+@app.route("/tag/<name>")
+def tag_page(name):
+    """/tag/python و /tag/python?with=flask&with=web لتقاطع عدة وسوم."""
+    names = [normalize_tag(name)] + [normalize_tag(n) for n in request.args.getlist("with")]
+    names = [n for n in dict.fromkeys(names) if n][:5]
+    if not names:
+        return redirect(url_for("index"))
 
-    posts = list_all_posts_with_category()
-    return render_template("admin_posts.html", posts=posts)
+    posts = tag_listing(names)
+    add_surrogate_keys("tags", "listing", *(f"tag:{n}" for n in names))
+    return render_template("tag.html", names=names, posts=posts, popular=popular_tags())
 
 
-@app.route("/admin/posts/edit/<category>/<filename>", methods=["GET", "POST"])
-@login_required
-def edit_post(category, filename):
-    """تعديل مقال موجود (العنوان + المحتوى) داخل نفس القسم / نفس الملف."""
-    if session.get("role") != "admin":
-        return "🚫 صلاحيات غير كافية", 403
+# ==============================
+# واجهة JSON للقراءة فقط (/api/v1) للتطبيق والمواقع الشريكة
+# ==============================
+# بدل كشط صفحات HTML (عرض قالب كامل لكل طلب). كل شيء من الفهارس والكاش، لا مسح للمجلدات:
+#   /api/v1/categories                                 الأقسام (+ عدد المقالات)
+#   /api/v1/categories/<folder>/posts?limit=&cursor=   مقالات القسم، الأحدث أولًا (مؤشر keyset)
+#   /api/v1/posts/<category>/<filename>?include=body   مقال واحد؛ المحتوى عند طلبه فقط
+#   /api/v1/search?q=                                  بحث في العناوين عبر فهرس الاقتراحات
+#   /api/v1/comments/counts?post=<cat>/<fn>&post=...   عدد التعليقات
+# ?fields=a,b يختار الحقول، والحقول المكلفة (views, tags, comment_count, body) لا تُحسب إلا إن طُلبت.
+# الجسم الجاهز محفوظ في كاش يُبطل مع أي كتابة (ونافذة API_CACHE_SECONDS لأن المشاهدات تتغيّر)،
+# وETag قوي = sha256 للجسم، فطلب If-None-Match المطابق يُرد بـ 304 بلا جسم.
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+API_SEARCH_LIMIT = 50
+API_CACHE_SECONDS = 60
 
-    md_path = os.path.join(BASE_MARKDOWN_DIR, category, f"{filename}.md")
-    if not os.path.exists(md_path):
-        return "❌ المقال غير موجود", 404
+API_CATEGORY_FIELDS = ("name", "slug", "folder", "url", "post_count")
+API_POST_FIELDS = ("category", "filename", "title", "published", "url", "views", "tags", "comment_count")
+API_POST_DEFAULT_FIELDS = ("category", "filename", "title", "published", "url")
+API_POST_DETAIL_FIELDS = API_POST_FIELDS + ("updated_at", "format", "body")
+API_POST_DETAIL_DEFAULT_FIELDS = API_POST_FIELDS + ("updated_at",)
 
-    if request.method == "POST":
-        new_title = (request.form.get("title") or "").strip()
-        new_content = request.form.get("content") or ""
+_api_responses = LocalCache("api_responses", max_entries=512)
+for _ns in ("posts", "categories", "post_index", "tags", "comments"):
+    cache_bus_subscribe(_ns, lambda key: _api_responses.invalidate())
 
-        if not new_title:
-            flash("⚠️ يجب إدخال عنوان للمقال", "error")
-            return redirect(request.url)
 
-        # نكتب أول سطر كـ H1 ثم المحتوى (HTML من Quill)
-        with open(md_path, "w", encoding="utf-8") as f:
-            f.write(f"# {new_title}\n\n{new_content}")
+class ApiError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
 
-        flash("✅ تم حفظ تعديلات المقال بنجاح", "success")
-        return redirect(url_for("view_post", category=category, filename=filename))
 
-    # GET: تحميل المقال الحالي لملئ النموذج
-    with open(md_path, "r", encoding="utf-8") as f:
-        raw = f.read()
+@app.errorhandler(ApiError)
+def _api_error(e):
+    return jsonify({"error": str(e)}), e.status
 
-    lines = raw.splitlines()
-    if lines and lines[0].lstrip().startswith("#"):
-        title = lines[0].lstrip("#").strip()
-        body_html = "\n".join(lines[1:]).strip()
-    else:
-        title = filename
-        body_html = raw
 
-    cat_obj = get_category_by_folder(category)
-    category_name = cat_obj["name"] if cat_obj else category
+def api_fields(allowed, default):
+    """?fields=a,b تستبدل الافتراضي و?include=c تضيف إليه؛ الترتيب ثابت حسب allowed."""
+    raw = request.args.get("fields")
+    fields = [f.strip() for f in raw.split(",")] if raw else list(default)
+    fields += [f.strip() for f in request.args.get("include", "").split(",")]
+    fields = {f for f in fields if f}
+    unknown = sorted(fields.difference(allowed))
+    if unknown:
+        raise ApiError(f"unknown fields: {', '.join(unknown)}")
+    return [f for f in allowed if f in fields]
 
-    return render_template(
-        "edit_post.html",
-        category=category,
-        category_name=category_name,
-        filename=filename,
-        title=title,
-        content=body_html,
-    )
 
+def api_limit(default: int = API_PAGE_SIZE, maximum: int = API_MAX_PAGE_SIZE) -> int:
+    return min(max(request.args.get("limit", default, type=int), 1), maximum)
 
-@app.post("/admin/posts/delete/<category>/<filename>")
-@login_required
-def delete_post(category, filename):
-    """حذف مقال + تنظيف الإحصائيات + التعليقات."""
-    if session.get("role") != "admin":
-        return "🚫 صلاحيات غير كافية", 403
 
-    md_path = os.path.join(BASE_MARKDOWN_DIR, category, f"{filename}.md")
+def encode_api_cursor(published: str, filename: str) -> str:
+    raw = json.dumps([published, filename], ensure_ascii=False, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
 
+def decode_api_cursor(cursor: str):
     try:
-        # حذف ملف الـ markdown إن وجد
-        if os.path.exists(md_path):
-            os.remove(md_path)
-
-        # حذف الإحصائيات من posts_stats.db
-        conn_stats = sqlite3.connect(POSTS_STATS_DB_PATH)
-        c_stats = conn_stats.cursor()
-        c_stats.execute("DELETE FROM stats WHERE category=? AND filename=?", (category, filename))
-        conn_stats.commit()
-        conn_stats.close()
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ApiError("bad cursor")
+    if not (isinstance(values, list) and len(values) == 2 and all(isinstance(v, str) for v in values)):
+        raise ApiError("bad cursor")
+    return values
+
+
+def api_response(build, *surrogate_keys):
+    """الجسم من الكاش (أو build() مرة لكل نافذة/كتابة) + ETag قوي و304."""
+    key = f"{int(time.time() // API_CACHE_SECONDS)}:{request.full_path}"
+
+    def load():
+        body = json.dumps(build(), ensure_ascii=False, separators=(",", ":")).encode()
+        return body, hashlib.sha256(body).hexdigest()[:32]
+
+    body, etag = _api_responses.get_or_load(key, load)
+    add_surrogate_keys(*surrogate_keys)
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = API_CACHE_SECONDS
+    resp.headers["Access-Control-Allow-Origin"] = "*"
+    return resp.make_conditional(request)
+
+
+def _published_at(posts):
+    """{(category, filename): وقت النشر} من post_index باستعلام واحد."""
+    if not posts:
+        return {}
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    clause, params = post_pairs_clause("category", "filename", posts)
+    rows = conn.execute(f"""
+        SELECT category, filename, IFNULL(publish_at, created_at) FROM post_index
+        WHERE {clause}
+    """, params).fetchall()
+    conn.close()
+    return {(category, filename): published for category, filename, published in rows}
+
+
+def api_posts(posts, fields):
+    """posts: قواميس فيها category/filename/title -> الحقول المطلوبة فقط، باستعلام واحد لكل حقل مكلف."""
+    keys = [(post["category"], post["filename"]) for post in posts]
+    published = {}
+    if "published" in fields:
+        published = _published_at([key for post, key in zip(posts, keys) if "published" not in post])
+    tags = tags_for_posts(keys) if "tags" in fields else {}
+    comments = count_comments(keys) if "comment_count" in fields else {}
+
+    items = []
+    for post, key in zip(posts, keys):
+        values = dict(post)
+        values.setdefault("published", published.get(key))
+        if "url" in fields:
+            values["url"] = url_for("view_post", category=key[0], filename=key[1])
+        if "views" in fields:
+            values["views"] = get_views(*key)
+        values["tags"] = tags.get(key)
+        values["comment_count"] = comments.get(key)
+        items.append({f: values[f] for f in fields})
+    return items
+
+
+def _api_category_page(folder: str, cursor, limit: int):
+    """صفحة keyset من idx_post_index_recent: نقرأ من الفهرس بقدر الحاجة فقط."""
+    titles = dict(list_posts_in_category(folder))
+    sql = """
+        SELECT IFNULL(publish_at, created_at), filename FROM post_index
+        WHERE category = ?
+    """
+    params = [folder]
+    if cursor:
+        sql += " AND (IFNULL(publish_at, created_at), filename) < (?, ?)"
+        params += cursor
+    sql += " ORDER BY IFNULL(publish_at, created_at) DESC, filename DESC"
 
-        # حذف التعليقات من comments.db
-        _ensure_comments_table()
-        conn_comm = sqlite3.connect(COMMENTS_DB_PATH)
-        c_comm = conn_comm.cursor()
-        c_comm.execute(
-            "DELETE FROM comments WHERE category=? AND post_filename=?",
-            (category, filename),
-        )
-        conn_comm.commit()
-        conn_comm.close()
+    posts = []
+    conn = db_connect(POSTS_STATS_DB_PATH)
+    for published, filename in conn.execute(sql, params):
+        # غير المنشور والمحذوف من المخزن ليسا في titles
+        if filename not in titles:
+            continue
+        posts.append({"category": folder, "filename": filename,
+                      "title": titles[filename], "published": published or ""})
+        if len(posts) > limit:
+            break
+    conn.close()
 
-        flash("🗑️ تم حذف المقال بنجاح", "success")
-    except Exception as e:
-        flash(f"❌ حدث خطأ أثناء حذف المقال: {e}", "error")
+    if len(posts) <= limit:
+        return posts, None
+    posts = posts[:limit]
+    return posts, encode_api_cursor(posts[-1]["published"], posts[-1]["filename"])
+
+
+@app.route("/api/v1/categories")
+@rate_limit("api")
+def api_categories():
+    fields = api_fields(API_CATEGORY_FIELDS, API_CATEGORY_FIELDS)
+
+    def build():
+        items = []
+        for cat in get_categories():
+            values = dict(cat, url=url_for("dynamic_category", slug=cat["slug"]))
+            if "post_count" in fields:
+                values["post_count"] = len(list_posts_in_category(cat["folder"]))
+            items.append({f: values[f] for f in fields})
+        return {"categories": items}
+
+    return api_response(build, "listing")
+
+
+@app.route("/api/v1/categories/<folder>/posts")
+@rate_limit("api")
+def api_category_posts(folder):
+    fields = api_fields(API_POST_FIELDS, API_POST_DEFAULT_FIELDS)
+    limit = api_limit()
+    cursor = request.args.get("cursor")
+    cursor = decode_api_cursor(cursor) if cursor else None
+    if folder not in {cat["folder"] for cat in get_categories()}:
+        raise ApiError("category not found", 404)
+
+    def build():
+        posts, next_cursor = _api_category_page(folder, cursor, limit)
+        return {"category": folder, "posts": api_posts(posts, fields), "next_cursor": next_cursor}
+
+    return api_response(build, f"category:{folder}", "listing")
+
+
+@app.route("/api/v1/posts/<category>/<filename>")
+@rate_limit("api")
+def api_post(category, filename):
+    fields = api_fields(API_POST_DETAIL_FIELDS, API_POST_DETAIL_DEFAULT_FIELDS)
+
+    def build():
+        title = dict(list_posts_in_category(category)).get(filename)
+        if title is None:
+            raise ApiError("post not found", 404)
+        state = get_publish_state(category, filename)
+        post = {"category": category, "filename": filename, "title": title,
+                "published": state["publish_at"] or state["created_at"]}
+        [values] = api_posts([post], [f for f in API_POST_FIELDS if f in fields])
+        values["updated_at"] = state["updated_at"]
+        # المحتوى وحده يحتاج قراءة المخزن
+        if "format" in fields or "body" in fields:
+            raw, version = post_storage().read_versioned(category, filename)
+            if raw is None:
+                raise ApiError("post not found", 404)
+            _title, body = split_post_text(raw, filename)
+            values["format"] = split_post_format(body)[0]
+            values["body"] = render_post_body(body, version) if "body" in fields else None
+        return {"post": {f: values[f] for f in fields}}
+
+    return api_response(build, f"post:{category}/{filename}", f"comments:{category}/{filename}")
+
+
+@app.route("/api/v1/search")
+@rate_limit("search")
+def api_search():
+    query = request.args.get("q", "").strip()
+    fields = api_fields(API_POST_FIELDS, API_POST_DEFAULT_FIELDS)
+    limit = api_limit(API_PAGE_SIZE, API_SEARCH_LIMIT)
+
+    def build():
+        if not query:
+            return {"q": query, "posts": []}
+        ensure_suggest_index()
+        posts = [
+            {"category": entry["category"], "filename": entry["filename"], "title": entry["title"]}
+            for entry in _suggest_index.match(query, "post", limit)
+            if is_post_visible(entry["category"], entry["filename"])
+        ]
+        return {"q": query, "posts": api_posts(posts, fields)}
 
-    return redirect(url_for("admin_posts"))
+    return api_response(build, "listing")
+
+
+@app.route("/api/v1/comments/counts")
+@rate_limit("api")
+def api_comment_counts():
+    posts = []
+    for value in request.args.getlist("post")[:API_MAX_PAGE_SIZE]:
+        category, _sep, filename = value.partition("/")
+        if not category or not filename:
+            raise ApiError(f"bad post: {value}")
+        posts.append((category, filename))
+    if not posts:
+        raise ApiError("missing post")
+
+    def build():
+        counts = count_comments(posts)
+        return {"counts": {f"{category}/{filename}": count for (category, filename), count in counts.items()}}
+
+    return api_response(build, *(f"comments:{category}/{filename}" for category, filename in posts))
 
 
 # ==============================
@@ -1423,29 +5829,38 @@ def delete_post(category, filename):
 # ==============================
 @app.route("/projects")
 def projects():
+    add_surrogate_keys("category:projects")
     posts = list_posts_in_category("projects")
     return render_template("category.html",
                            title="🛠️ برمجتي",
                            posts=posts,
-                           category="projects")
+                           category="projects",
+                           trending=top_posts("trending", "projects"),
+                           most_read=top_posts("views", "projects"))
 
 
 @app.route("/tutorials")
 def tutorials():
+    add_surrogate_keys("category:tutorials")
     posts = list_posts_in_category("tutorials")
     return render_template("category.html",
                            title="📚 شروحاتي",
                            posts=posts,
-                           category="tutorials")
+                           category="tutorials",
+                           trending=top_posts("trending", "tutorials"),
+                           most_read=top_posts("views", "tutorials"))
 
 
 @app.route("/articles")
 def articles():
+    add_surrogate_keys("category:articles")
     posts = list_posts_in_category("articles")
     return render_template("category.html",
                            title="🧠 مقالاتي",
                            posts=posts,
-                           category="articles")
+                           category="articles",
+                           trending=top_posts("trending", "articles"),
+                           most_read=top_posts("views", "articles"))
 
 
 # ==============================
@@ -1459,14 +5874,12 @@ def check_filename():
     if not category or not filename:
         return jsonify({"exists": False})
 
-    md_path = os.path.join(BASE_MARKDOWN_DIR, category, f"{filename}.md")
-    exists = os.path.exists(md_path)
-    return jsonify({"exists": exists})
+    return jsonify({"exists": post_storage().exists(category, filename)})
 
 
 @app.route("/<slug>")
 def dynamic_category(slug):
-    conn = sqlite3.connect(DB_PATH)
+    conn = db_connect(DB_PATH)
     conn.row_factory = sqlite3.Row
     c = conn.cursor()
 
@@ -1483,16 +5896,300 @@ def dynamic_category(slug):
 
     folder = row["folder"]
     title = f"📂 {row['name']}"
+    add_surrogate_keys(f"category:{folder}")
     posts = list_posts_in_category(folder)
 
     return render_template(
         "category.html",
         title=title,
         posts=posts,
-        category=folder
+        category=folder,
+        trending=top_posts("trending", folder),
+        most_read=top_posts("views", folder),
+    )
+
+
+# ==============================
+# التنميط عند الطلب (cProfile + عيّنات المكدس + tracemalloc)
+# ==============================
+# الإعدادات تُحفظ في ملف داخل مجلد اللقطات حتى تشترك فيها كل عمليات gunicorn
+PROFILE_DIR = os.environ.get("CIT_PROFILE_DIR", os.path.join(BASE_DIR, "profiles"))
+PROFILE_MAX_CAPTURES = int(os.environ.get("CIT_PROFILE_MAX_CAPTURES", "50"))
+PROFILE_SETTINGS_PATH = os.path.join(PROFILE_DIR, "settings.json")
+PROFILE_DEFAULTS = {"enabled": False, "sample_rate": 0.0, "slow_ms": 0, "interval_ms": 5}
+# لا ننمّط صفحات التنميط نفسها ولا الملفات الثابتة
+PROFILE_SKIP_ENDPOINTS = {"static", "admin_profiles", "download_profile"}
+
+_profile_settings_cache = {"checked": 0.0, "mtime": None, "value": dict(PROFILE_DEFAULTS)}
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False   # لا نوقف تتبعًا بدأه غيرنا (PYTHONTRACEMALLOC مثلًا)
+_sampler_lock = threading.Lock()
+_sampler_targets = {}   # thread id -> Counter(collapsed stack -> samples)
+_sampler_state = {"pid": None, "thread": None}
+
+
+def get_profile_settings() -> dict:
+    """قراءة إعدادات التنميط مع فحص mtime مرة كل ثانية على الأكثر."""
+    cache = _profile_settings_cache
+    now = time.monotonic()
+    if now - cache["checked"] < 1.0:
+        return cache["value"]
+    cache["checked"] = now
+    try:
+        mtime = os.stat(PROFILE_SETTINGS_PATH).st_mtime
+    except OSError:
+        cache["mtime"], cache["value"] = None, dict(PROFILE_DEFAULTS)
+        return cache["value"]
+    if mtime != cache["mtime"]:
+        try:
+            with open(PROFILE_SETTINGS_PATH, "r", encoding="utf-8") as f:
+                cache["value"] = {**PROFILE_DEFAULTS, **json.load(f)}
+            cache["mtime"] = mtime
+        except (OSError, ValueError):
+            pass
+    return cache["value"]
+
+
+def save_profile_settings(settings: dict):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    tmp_path = f"{PROFILE_SETTINGS_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(settings, f)
+    os.replace(tmp_path, PROFILE_SETTINGS_PATH)
+    _profile_settings_cache["checked"] = 0.0
+
+
+def _collapse_stack(frame) -> str:
+    """تحويل إطار إلى سطر مكدس مطوي (الجذر أولاً) متوافق مع flamegraph.pl."""
+    parts = []
+    while frame is not None:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+
+def _sampler_loop():
+    while True:
+        interval = max(get_profile_settings().get("interval_ms", 5), 1) / 1000.0
+        time.sleep(interval)
+        with _sampler_lock:
+            if not _sampler_targets:
+                continue
+            frames = sys._current_frames()
+            for tid, counts in _sampler_targets.items():
+                frame = frames.get(tid)
+                if frame is not None:
+                    counts[_collapse_stack(frame)] += 1
+
+
+def _ensure_sampler():
+    # الخيط يُنشأ بعد fork داخل كل عملية عاملة
+    if _sampler_state["pid"] == os.getpid():
+        return
+    with _sampler_lock:
+        if _sampler_state["pid"] == os.getpid():
+            return
+        thread = threading.Thread(target=_sampler_loop, name="cit-stack-sampler", daemon=True)
+        thread.start()
+        _sampler_state.update(pid=os.getpid(), thread=thread)
+
+
+def _tracemalloc_acquire():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            _tracemalloc_owned = True
+        _tracemalloc_users += 1
+    return tracemalloc.take_snapshot()
+
+
+def _tracemalloc_release(start_snapshot, limit=25):
+    global _tracemalloc_users, _tracemalloc_owned
+    stats = tracemalloc.take_snapshot().compare_to(start_snapshot, "lineno")[:limit]
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+    return [
+        {"where": str(st.traceback[0]), "size_diff": st.size_diff, "count_diff": st.count_diff}
+        for st in stats
+    ]
+
+
+def _trim_profile_ring():
+    metas = sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")))
+    metas = [m for m in metas if os.path.basename(m) != "settings.json"]
+    excess = len(metas) - PROFILE_MAX_CAPTURES
+    for meta_path in metas[:max(excess, 0)]:
+        base = meta_path[:-len(".json")]
+        for ext in (".json", ".prof", ".folded"):
+            try:
+                os.remove(base + ext)
+            except OSError:
+                pass
+
+
+def list_profile_captures():
+    captures = []
+    for meta_path in sorted(glob.glob(os.path.join(PROFILE_DIR, "*.json")), reverse=True):
+        if os.path.basename(meta_path) == "settings.json":
+            continue
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                captures.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return captures
+
+
+@app.before_request
+def _profile_start():
+    settings = get_profile_settings()
+    if not settings.get("enabled") or request.endpoint in PROFILE_SKIP_ENDPOINTS:
+        return
+
+    g._prof_start = time.perf_counter()
+    if settings.get("slow_ms"):
+        _ensure_sampler()
+        with _sampler_lock:
+            _sampler_targets[threading.get_ident()] = Counter()
+
+    if random.random() < float(settings.get("sample_rate") or 0):
+        _ensure_sampler()
+        with _sampler_lock:
+            _sampler_targets.setdefault(threading.get_ident(), Counter())
+        g._prof_malloc = _tracemalloc_acquire()
+        g._prof_cprofile = cProfile.Profile()
+        g._prof_cprofile.enable()
+
+
+@app.after_request
+def _profile_finish(response):
+    start = g.pop("_prof_start", None)
+    if start is None:
+        return response
+
+    profiler = g.pop("_prof_cprofile", None)
+    malloc_start = g.pop("_prof_malloc", None)
+    info = {
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+    }
+    # الرد المتدفّق يعرض الجسم (القالب والمولّدات) بعد هذا الخطاف: نغلق اللقطة عند إغلاقه
+    on_response_done(response, lambda _sent_bytes: _finish_profile(start, profiler, malloc_start, info))
+    return response
+
+
+def _finish_profile(start, profiler, malloc_start, info):
+    """يُستدعى في خيط الطلب نفسه بعد آخر بايت (cProfile والعيّنات مربوطة بالخيط)."""
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if profiler is not None:
+        profiler.disable()
+    malloc_top = _tracemalloc_release(malloc_start) if malloc_start is not None else None
+    with _sampler_lock:
+        samples = _sampler_targets.pop(threading.get_ident(), None)
+
+    slow_ms = get_profile_settings().get("slow_ms") or 0
+    is_slow = bool(slow_ms) and elapsed_ms >= slow_ms
+    if profiler is None and not is_slow:
+        return
+
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        capture_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:6]}"
+        base = os.path.join(PROFILE_DIR, capture_id)
+        files = []
+        if profiler is not None:
+            profiler.dump_stats(base + ".prof")
+            files.append("prof")
+        if samples:
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                for stack, count in samples.most_common():
+                    f.write(f"{stack} {count}\n")
+            files.append("folded")
+        meta = {
+            "id": capture_id,
+            "created_at": datetime.now(pytz.timezone("Asia/Riyadh")).strftime("%Y-%m-%d %H:%M:%S"),
+            **info,
+            "duration_ms": round(elapsed_ms, 2),
+            "reason": "sampled" if profiler is not None else "slow",
+            "samples": sum(samples.values()) if samples else 0,
+            "tracemalloc_top": malloc_top,
+            "files": files + ["json"],
+        }
+        with open(base + ".json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        _trim_profile_ring()
+    except OSError as e:
+        print("Profiler capture error:", e)
+
+
+@app.route("/admin/profiles", methods=["GET", "POST"])
+@login_required
+def admin_profiles():
+    """تفعيل/إيقاف التنميط وعرض اللقطات المحفوظة."""
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح", 403
+
+    if request.method == "POST":
+        try:
+            sample_rate = min(max(float(request.form.get("sample_rate") or 0), 0.0), 1.0)
+            slow_ms = max(int(request.form.get("slow_ms") or 0), 0)
+            interval_ms = min(max(int(request.form.get("interval_ms") or 5), 1), 1000)
+        except ValueError:
+            flash("❌ قيم غير صالحة", "error")
+            return redirect(url_for("admin_profiles"))
+
+        save_profile_settings({
+            "enabled": request.form.get("enabled") == "1",
+            "sample_rate": sample_rate,
+            "slow_ms": slow_ms,
+            "interval_ms": interval_ms,
+        })
+        flash("✅ تم حفظ إعدادات التنميط.", "success")
+        return redirect(url_for("admin_profiles"))
+
+    return render_template(
+        "admin_profiles.html",
+        settings=get_profile_settings(),
+        captures=list_profile_captures(),
+        max_captures=PROFILE_MAX_CAPTURES,
     )
 
 
+@app.route("/admin/profiles/<capture_id>.<kind>")
+@login_required
+def download_profile(capture_id, kind):
+    if session.get("role") != "admin":
+        return "🚫 غير مصرح", 403
+    if kind not in ("prof", "folded", "json") or not re.fullmatch(r"[0-9]+-[0-9a-f]+", capture_id):
+        return "❌ ملف غير معروف", 404
+
+    return send_offloaded("profiles", PROFILE_DIR, f"{capture_id}.{kind}", as_attachment=True)
+
+
+# ==============================
+# مقاييس Prometheus (للمدير أو بتوكن)
+# ==============================
+@app.route("/metrics")
+def metrics():
+    token = app.config.get("METRICS_TOKEN")
+    auth = request.headers.get("Authorization", "")
+    token_ok = bool(token) and secrets.compare_digest(auth, f"Bearer {token}")
+    if not token_ok and not (session.get("logged_in") and session.get("role") == "admin"):
+        return "🚫 غير مصرح", 403
+
+    # content_type لا mimetype: Werkzeug يضيف charset ثانيًا لأي mimetype نصي
+    return Response(render_prometheus_metrics(),
+                    content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # ==============================
 # صفحات ثابتة: عن المدونة / تواصل / سياسة الخصوصية
 # ==============================
@@ -1553,6 +6250,350 @@ def contact_page():
     return render_template("contact.html")
 
 
+# ==============================
+# عامل الخدمة (Service Worker): قراءة بلا اتصال + تنقّل فوري
+# ==============================
+# /sw.js يُولَّد من القالب مع قائمة الواجهة وبصمات محتوى ملفاتها (sha256)، فأي تعديل على
+# ملف منها يغيّر بايتات العامل => يثبّت المتصفح عاملًا جديدًا بكاش جديد ويحذف القديم.
+# الملفات الثابتة تُطلب بروابط ?v=<البصمة> (asset_url) فتُخدم من الكاش دون سؤال الخادم،
+# والمقالات المزارة stale-while-revalidate، وبقية الصفحات من الشبكة أولًا مع الرجوع للكاش
+# ثم صفحة /offline. كاش الصفحات والصور محدود العدد.
+# صفحات المسجّلين (أو التي فيها رسالة فلاش) تحمل SW_PERSONAL_HEADER فلا تُحفظ، ويتذكر العامل
+# آخر حالة ليتجاوز الكاش تمامًا أثناء الدخول. CIT_SERVICE_WORKER=0 يقدّم عاملًا يلغي نفسه.
+SERVICE_WORKER_ENABLED = os.environ.get("CIT_SERVICE_WORKER", "1") == "1"
+SW_PRECACHE_ASSETS = ("styles.css", "assets/logo/logo.png")
+SW_SHELL_TEMPLATES = ("base.html", "offline.html")
+SW_PAGES_MAX = 50
+SW_RUNTIME_MAX = 60
+SW_PERSONAL_HEADER = "X-Cit-Personal"
+SW_BYPASS_PREFIXES = ("/api/", "/drafts", "/metrics", "/search/suggest")
+
+_file_hashes = {}
+
+
+def file_hash(path: str) -> str:
+    """أول 12 حرفًا من sha256 للمحتوى، يُعاد حسابها فقط عند تغيّر mtime/الحجم."""
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = _file_hashes.get(path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    _file_hashes[path] = (stamp, digest)
+    return digest
+
+
+@app.template_global()
+def asset_url(filename: str) -> str:
+    """رابط ملف ثابت مع بصمته (?v=) ليُخزَّن بلا إعادة تحقق ويتغيّر مع المحتوى."""
+    try:
+        return url_for("static", filename=filename, v=file_hash(os.path.join(app.static_folder, filename)))
+    except OSError:
+        return url_for("static", filename=filename)
+
+
+def service_worker_manifest():
+    assets = [asset_url(name) for name in SW_PRECACHE_ASSETS]
+    # template_folder نسبي (بخلاف static_folder)، فنثبّته بجذر التطبيق لا بمجلد التشغيل
+    stamps = [file_hash(os.path.join(app.root_path, app.template_folder, name)) for name in SW_SHELL_TEMPLATES]
+    return {
+        "version": hashlib.sha256("|".join(assets + stamps).encode()).hexdigest()[:12],
+        "precache": assets + [url_for("offline_page")],
+        "offline": url_for("offline_page"),
+        "uploads_prefix": url_for("uploaded_file", filename=""),
+        "articles_prefix": "/post/",
+        "bypass": list(SW_BYPASS_PREFIXES) + [url_for("service_worker")],
+        "personal_header": SW_PERSONAL_HEADER,
+        "pages_max": SW_PAGES_MAX,
+        "runtime_max": SW_RUNTIME_MAX,
+    }
+
+
+@app.context_processor
+def inject_service_worker():
+    return {"service_worker_enabled": SERVICE_WORKER_ENABLED}
+
+
+@app.after_request
+def _mark_personal_pages(response):
+    if response.mimetype == "text/html" and (session.get("logged_in") or session.modified):
+        response.headers[SW_PERSONAL_HEADER] = "1"
+    return response
+
+
+@app.route("/sw.js")
+def service_worker():
+    # من الجذر حتى يشمل نطاقه كل الموقع؛ no-cache حتى يرى المتصفح كل تحديث للقائمة
+    body = render_template("sw.js", manifest=service_worker_manifest(), enabled=SERVICE_WORKER_ENABLED)
+    resp = Response(body, mimetype="text/javascript")
+    resp.cache_control.no_cache = True
+    return resp
+
+
+@app.route("/offline")
+def offline_page():
+    return render_template("offline.html")
+
+
+# ==============================
+# النسخ الاحتياطي والاستعادة (أوامر CLI)
+# ==============================
+# flask --app app backup-create -o cit-backup.tar.gz     (أو -o - للبث إلى stdout عبر ssh)
+# flask --app app backup-restore cit-backup.tar.gz       (أو - للقراءة من stdin)
+#
+# الأرشيف tar مضغوط يُكتب ويُقرأ كتيار (mode "w|gz" / "r|*") فلا يُحمَّل المحتوى في الذاكرة:
+#   markdown/...        ملفات المقالات
+#   uploads/...         الصور المرفوعة
+#   db/<name>.db        لقطات متسقة بواجهة SQLite backup على دفعات صغيرة من الصفحات
+#   manifest.json       آخر عضو: الحجم وsha256 لكل ملف (يُتحقق منه قبل أي استبدال)
+BACKUP_FORMAT_VERSION = 1
+BACKUP_PAGES_PER_STEP = int(os.environ.get("CIT_BACKUP_PAGES_PER_STEP", "256"))
+BACKUP_STEP_SLEEP = float(os.environ.get("CIT_BACKUP_STEP_SLEEP", "0.005"))
+BACKUP_CHUNK = 1024 * 1024
+
+# (اسم العضو في الأرشيف, المسار المحلي)
+BACKUP_DATABASES = [
+    ("db/users.db", DB_PATH),
+    ("db/comments.db", COMMENTS_DB_PATH),
+    ("db/posts_stats.db", POSTS_STATS_DB_PATH),
+    ("db/revisions.db", REVISIONS_DB_PATH),
+    ("db/posts.db", POSTS_DB_PATH),
+]
+BACKUP_TREES = [
+    ("markdown", BASE_MARKDOWN_DIR),
+    ("uploads", UPLOAD_FOLDER),
+]
+
+
+class BackupError(Exception):
+    pass
+
+
+class _HashingReader:
+    """يقرأ من ملف ويحسب sha256 أثناء مرور البيانات إلى tarfile."""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, n=-1):
+        data = self.fileobj.read(n)
+        self.sha256.update(data)
+        self.size += len(data)
+        return data
+
+
+def snapshot_sqlite(src_path, dest_path):
+    """
+    لقطة متسقة من قاعدة تعمل: نسخ على دفعات من الصفحات مع استراحة قصيرة
+    بينها كي لا يُحجب الكتّاب طويلًا (SQLite تعيد النسخ تلقائيًا إن تغيّرت المصدر).
+    """
+    src = db_connect(src_path)
+    dest = sqlite3.connect(dest_path)
+    try:
+        src.backup(dest, pages=BACKUP_PAGES_PER_STEP,
+                   progress=lambda status, remaining, total: time.sleep(BACKUP_STEP_SLEEP))
+    finally:
+        dest.close()
+        src.close()
+
+
+def _add_stream_member(tar, name, fileobj, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    reader = _HashingReader(fileobj)
+    tar.addfile(info, reader)
+    if reader.size != size:
+        raise BackupError(f"تغيّر حجم {name} أثناء النسخ")
+    return {"size": size, "sha256": reader.sha256.hexdigest()}
+
+
+def write_backup(out_stream, log=print):
+    """يبث أرشيف النسخة الاحتياطية إلى out_stream ويعيد الـ manifest."""
+    manifest = {
+        "format": BACKUP_FORMAT_VERSION,
+        "created_at": datetime.now(pytz.timezone("Asia/Riyadh")).strftime("%Y-%m-%d %H:%M:%S"),
+        "files": {},
+    }
+
+    with tarfile.open(fileobj=out_stream, mode="w|gz") as tar:
+        for prefix, root in BACKUP_TREES:
+            if not os.path.isdir(root):
+                continue
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                for fname in sorted(filenames):
+                    path = os.path.join(dirpath, fname)
+                    rel = os.path.relpath(path, root).replace(os.sep, "/")
+                    name = f"{prefix}/{rel}"
+                    with open(path, "rb") as f:
+                        st = os.fstat(f.fileno())
+                        manifest["files"][name] = _add_stream_member(tar, name, f, st.st_size, st.st_mtime)
+
+        with tempfile.TemporaryDirectory(prefix=".backup-", dir=BASE_DIR) as tmp:
+            for name, path in BACKUP_DATABASES:
+                if not os.path.exists(path):
+                    continue
+                snap = os.path.join(tmp, os.path.basename(name))
+                snapshot_sqlite(path, snap)
+                with open(snap, "rb") as f:
+                    st = os.fstat(f.fileno())
+                    manifest["files"][name] = _add_stream_member(tar, name, f, st.st_size, time.time())
+                os.remove(snap)
+                log(f"🗄️ {name}: {st.st_size} B")
+
+        data = json.dumps(manifest, ensure_ascii=False, indent=1).encode("utf-8")
+        _add_stream_member(tar, "manifest.json", io.BytesIO(data), len(data), time.time())
+
+    return manifest
+
+
+def _restore_target(name):
+    """يحوّل اسم عضو في الأرشيف إلى مسار داخل مجلد التجهيز، أو None إن كان غير مسموح."""
+    parts = name.split("/")
+    if any(p in ("", ".", "..") for p in parts) or "\\" in name:
+        return None
+    if parts[0] in ("markdown", "uploads") and len(parts) >= 2:
+        return name
+    if len(parts) == 2 and name in dict(BACKUP_DATABASES):
+        return name
+    return None
+
+
+def read_backup(in_stream, staging_dir):
+    """
+    يفك الأرشيف كتيار إلى staging_dir مع حساب sha256 لكل عضو،
+    ثم يطابق النتائج مع manifest.json (آخر عضو). يرفع BackupError عند أي خلل.
+    """
+    seen = {}
+    manifest = None
+
+    with tarfile.open(fileobj=in_stream, mode="r|*") as tar:
+        for member in tar:
+            if member.name == "manifest.json" and member.isfile():
+                manifest = json.loads(tar.extractfile(member).read().decode("utf-8"))
+                continue
+            if not member.isfile():
+                continue
+            rel = _restore_target(member.name)
+            if rel is None:
+                raise BackupError(f"عضو غير مسموح في الأرشيف: {member.name}")
+
+            dest = os.path.join(staging_dir, *rel.split("/"))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            src = tar.extractfile(member)
+            digest = hashlib.sha256()
+            size = 0
+            with open(dest, "wb") as out:
+                while True:
+                    chunk = src.read(BACKUP_CHUNK)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            seen[member.name] = {"size": size, "sha256": digest.hexdigest()}
+
+    if manifest is None:
+        raise BackupError("الأرشيف لا يحتوي manifest.json (ربما مقطوع)")
+    if manifest.get("format") != BACKUP_FORMAT_VERSION:
+        raise BackupError(f"إصدار أرشيف غير مدعوم: {manifest.get('format')}")
+
+    expected = manifest.get("files") or {}
+    missing = sorted(set(expected) - set(seen))
+    extra = sorted(set(seen) - set(expected))
+    bad = sorted(n for n in expected if n in seen and seen[n] != expected[n])
+    if missing or extra or bad:
+        raise BackupError(f"فشل التحقق: ناقص={missing[:5]} زائد={extra[:5]} تالف={bad[:5]}")
+
+    for name, _path in BACKUP_DATABASES:
+        staged = os.path.join(staging_dir, *name.split("/"))
+        if not os.path.exists(staged):
+            continue
+        conn = sqlite3.connect(staged)
+        try:
+            (result,) = conn.execute("PRAGMA integrity_check").fetchone()
+        finally:
+            conn.close()
+        if result != "ok":
+            raise BackupError(f"{name}: integrity_check = {result}")
+
+    return manifest
+
+
+def install_backup(staging_dir):
+    """
+    ينقل الملفات المُتحقق منها إلى أماكنها: المجلدات تُبدّل بإعادة تسمية،
+    وقواعد البيانات بـ os.replace (ذري لكل ملف). ثم ننبّه بقية العمّال لإفراغ كاشاتهم.
+    """
+    for prefix, root in BACKUP_TREES:
+        staged = os.path.join(staging_dir, prefix)
+        if not os.path.isdir(staged):
+            os.makedirs(staged)
+        old = f"{root}.restore-old"
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        if os.path.exists(root):
+            os.replace(root, old)
+        shutil.move(staged, root)
+        if os.path.exists(old):
+            shutil.rmtree(old)
+
+    for name, path in BACKUP_DATABASES:
+        staged = os.path.join(staging_dir, *name.split("/"))
+        if os.path.exists(staged):
+            os.replace(staged, path)
+    # نسخة من إصدار أقدم: ترقية جدول التعليقات مرة هنا بدل كل قراءة
+    _ensure_comments_table()
+
+    # كل ما يُشتق من القواعد المستعادة: الفهرس (ومعه قائمة غير المنشور)، الوسوم، والتعليقات
+    cache_bus_bump_many([
+        ("categories", ""), ("posts", ""), ("post_index", ""),
+        ("tags", ""), ("tags", _TAGS_ALL_KEY), ("comments", ""),
+    ])
+
+
+@app.cli.command("backup-create")
+@click.option("-o", "--output", default="-", help="ملف الأرشيف (.tar.gz) أو - لـ stdout")
+def backup_create_command(output):
+    """إنشاء نسخة احتياطية كاملة (مقالات + صور + قواعد البيانات) كتيار tar.gz."""
+    log = (lambda msg: click.echo(msg, err=True))
+    if output == "-":
+        manifest = write_backup(click.get_binary_stream("stdout"), log=log)
+    else:
+        tmp = f"{output}.partial"
+        with open(tmp, "wb") as f:
+            manifest = write_backup(f, log=log)
+        os.replace(tmp, output)
+    log(f"✅ تم إنشاء النسخة الاحتياطية: {len(manifest['files'])} ملف.")
+
+
+@app.cli.command("backup-restore")
+@click.argument("archive")
+@click.option("--yes", is_flag=True, help="تنفيذ دون سؤال تأكيد")
+def backup_restore_command(archive, yes):
+    """استعادة نسخة احتياطية (يُفضّل إيقاف التطبيق أثناءها). تُستبدل البيانات الحالية."""
+    if not yes and archive != "-":
+        click.confirm("⚠️ ستُستبدل المقالات والصور وقواعد البيانات الحالية. متابعة؟", abort=True)
+
+    with tempfile.TemporaryDirectory(prefix=".restore-", dir=BASE_DIR) as staging:
+        try:
+            if archive == "-":
+                manifest = read_backup(click.get_binary_stream("stdin"), staging)
+            else:
+                with open(archive, "rb") as f:
+                    manifest = read_backup(f, staging)
+        except (BackupError, tarfile.TarError, zlib.error, EOFError, OSError, ValueError) as e:
+            raise click.ClickException(f"❌ فشلت الاستعادة، لم يُغيَّر شيء: {e}")
+        install_backup(staging)
+
+    click.echo(f"✅ تمت الاستعادة: {len(manifest['files'])} ملف (نسخة {manifest.get('created_at')}).")
+
+
 # ==============================
 # Run (للاستخدام المحلي فقط)
 # ==============================
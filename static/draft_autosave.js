@@ -0,0 +1,189 @@
+/* ==========================================================
+   حفظ تلقائي للمسودات في الخادم (form.html + edit_post.html)
+   نرسل فقط الجزء المتغيّر: [start, delete_count, insert] بوحدات code point
+   ========================================================== */
+(function () {
+  "use strict";
+
+  const META_FIELDS = ["title", "filename", "category"];
+
+  // مقارنة بادئة/لاحقة مشتركة => رقعة واحدة صغيرة لأغلب التعديلات
+  function makePatch(oldText, newText) {
+    const a = Array.from(oldText);
+    const b = Array.from(newText);
+    let start = 0;
+    while (start < a.length && start < b.length && a[start] === b[start]) start++;
+    let endA = a.length;
+    let endB = b.length;
+    while (endA > start && endB > start && a[endA - 1] === b[endB - 1]) {
+      endA--;
+      endB--;
+    }
+    return [start, endA - start, b.slice(start, endB).join("")];
+  }
+
+  function codePointLength(text) {
+    return Array.from(text).length;
+  }
+
+  window.CitDraftAutosave = function (options) {
+    const key = options.key;
+    const getState = options.getState;
+    const applyState = options.applyState;
+    const banner = options.banner;
+    const intervalMs = options.intervalMs || 3000;
+
+    let version = 0;
+    let synced = { content: "" };
+    let inFlight = false;
+    let paused = true;
+    let dirty = false;
+
+    function setStatus(text) {
+      if (options.statusEl) options.statusEl.textContent = text;
+    }
+
+    function showBanner(message, actions) {
+      if (!banner) return;
+      banner.innerHTML = "";
+      const span = document.createElement("span");
+      span.textContent = message;
+      banner.appendChild(span);
+      actions.forEach(function (action) {
+        const btn = document.createElement("button");
+        btn.type = "button";
+        btn.className = "btn-link btn-small";
+        btn.textContent = action.label;
+        btn.addEventListener("click", function () {
+          banner.style.display = "none";
+          action.run();
+        });
+        banner.appendChild(btn);
+      });
+      banner.style.display = "flex";
+    }
+
+    function metaChanges(state) {
+      const changes = {};
+      META_FIELDS.forEach(function (field) {
+        if (state[field] !== undefined && state[field] !== synced[field]) changes[field] = state[field];
+      });
+      return changes;
+    }
+
+    async function send(patches, state, meta) {
+      const body = Object.assign({ key: key, base_version: version, patches: patches }, meta);
+      const res = await fetch("/drafts/patch", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(body)
+      });
+      const data = await res.json().catch(function () { return {}; });
+      return { status: res.status, data: data };
+    }
+
+    async function loadServerDraft() {
+      const res = await fetch("/drafts?key=" + encodeURIComponent(key));
+      return res.json();
+    }
+
+    function adopt(draft) {
+      version = draft.version || 0;
+      synced = { content: draft.content || "" };
+      META_FIELDS.forEach(function (f) { synced[f] = draft[f] || ""; });
+    }
+
+    async function save() {
+      if (paused || inFlight) return;
+      const state = getState();
+      const meta = metaChanges(state);
+      if (state.content === synced.content && Object.keys(meta).length === 0) {
+        dirty = false;
+        return;
+      }
+
+      inFlight = true;
+      try {
+        const patches = state.content === synced.content ? [] : [makePatch(synced.content, state.content)];
+        let result = await send(patches, state, meta);
+        if (result.status === 400) {
+          // الخادم لم يقبل الرقعة: نستبدل النص كاملًا
+          result = await send([[0, codePointLength(synced.content), state.content]], state, meta);
+        }
+
+        if (result.status === 200) {
+          version = result.data.version;
+          synced = Object.assign({}, synced, meta, { content: state.content });
+          dirty = false;
+          setStatus("💾 حُفظت المسودة " + (result.data.updated_at || ""));
+        } else if (result.status === 409) {
+          paused = true;
+          setStatus("⚠️ تعارض في المسودة");
+          showBanner("⚠️ تم تعديل هذه المسودة من نافذة أخرى.", [
+            {
+              label: "تحميل نسخة الخادم",
+              run: async function () {
+                const draft = await loadServerDraft();
+                adopt(draft);
+                if (draft.exists) applyState(draft);
+                paused = false;
+              }
+            },
+            {
+              label: "الإبقاء على نسختي",
+              run: async function () {
+                const draft = await loadServerDraft();
+                version = draft.version || 0;
+                synced = { content: draft.content || "" };
+                paused = false;
+                save();
+              }
+            }
+          ]);
+        } else {
+          setStatus("⚠️ تعذّر حفظ المسودة");
+        }
+      } catch (e) {
+        console.warn("Draft autosave failed:", e);
+        setStatus("⚠️ تعذّر حفظ المسودة (غير متصل؟)");
+      } finally {
+        inFlight = false;
+      }
+    }
+
+    async function start() {
+      try {
+        const draft = await loadServerDraft();
+        if (draft.exists) {
+          const current = getState();
+          adopt(draft);
+          if (draft.content !== current.content || (draft.title || "") !== (current.title || "")) {
+            showBanner("📝 توجد مسودة محفوظة (" + (draft.updated_at || "") + ").", [
+              { label: "استئناف المسودة", run: function () { applyState(draft); paused = false; } },
+              {
+                label: "تجاهلها",
+                run: async function () {
+                  await fetch("/drafts?key=" + encodeURIComponent(key), { method: "DELETE" });
+                  adopt({ version: 0, content: "" });
+                  paused = false;
+                }
+              }
+            ]);
+            return;
+          }
+        }
+      } catch (e) {
+        console.warn("Draft load failed:", e);
+      }
+      paused = false;
+    }
+
+    setInterval(function () { if (dirty) save(); }, intervalMs);
+    start();
+
+    return {
+      markDirty: function () { dirty = true; },
+      flush: save
+    };
+  };
+})();
@@ -0,0 +1,62 @@
+/* ==========================================================
+   اختيار صيغة المقال: محرر Quill (HTML) أو Markdown (نص خام)
+   صيغة Markdown تُعلن بسطر <!-- format: markdown --> في بداية المحتوى
+   ========================================================== */
+(function () {
+  "use strict";
+
+  const DECL = "<!-- format: markdown -->\n";
+  const DECL_RE = /^\s*<!--\s*format:\s*markdown\s*-->[ \t]*\n?/i;
+
+  window.CitPostFormat = function (options) {
+    const select = options.select;
+    const quill = options.quill;
+    const textarea = options.textarea;
+    const quillCard = options.quillCard;
+
+    function current() {
+      return select.value === "markdown" ? "markdown" : "html";
+    }
+
+    function show(format) {
+      const md = format === "markdown";
+      quillCard.style.display = md ? "none" : "";
+      textarea.style.display = md ? "" : "none";
+    }
+
+    select.addEventListener("change", function () {
+      // عند أول تحويل إلى Markdown نبدأ بنص المحرر حتى لا يضيع المحتوى
+      if (current() === "markdown" && !textarea.value.trim() && quill.getText().trim()) {
+        textarea.value = quill.getText();
+      }
+      show(current());
+      if (options.onChange) options.onChange();
+    });
+    textarea.addEventListener("input", function () {
+      if (options.onChange) options.onChange();
+    });
+    show(current());
+
+    return {
+      // المحتوى الذي يُرسل للخادم (الحقل content)
+      content: function () {
+        return current() === "markdown" ? textarea.value : quill.root.innerHTML;
+      },
+      // نسخة المسودة: تحمل سطر الإعلان حتى تُستعاد الصيغة معها
+      draftContent: function () {
+        return current() === "markdown" ? DECL + textarea.value : quill.root.innerHTML;
+      },
+      applyDraftContent: function (content) {
+        content = content || "";
+        if (DECL_RE.test(content)) {
+          select.value = "markdown";
+          textarea.value = content.replace(DECL_RE, "");
+        } else {
+          select.value = "html";
+          quill.root.innerHTML = content;
+        }
+        show(current());
+      }
+    };
+  };
+})();
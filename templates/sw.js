@@ -0,0 +1,135 @@
+/* ==========================================================
+   عامل الخدمة (يولّده /sw.js مع قائمة الواجهة وبصماتها)
+   الواجهة من الكاش، المقالات stale-while-revalidate، وبقية الصفحات من الشبكة أولًا
+   ========================================================== */
+"use strict";
+
+const MANIFEST = {{ manifest|tojson }};
+const SHELL_CACHE = "cit-shell-" + MANIFEST.version;
+const PAGES_CACHE = "cit-pages";
+const RUNTIME_CACHE = "cit-runtime";
+const META_CACHE = "cit-meta";
+const SESSION_KEY = "/__cit_session";
+{% if not enabled %}
+
+// العامل معطّل من الخادم: نحذف الكاش ونلغي التسجيل
+self.addEventListener("install", function () { self.skipWaiting(); });
+self.addEventListener("activate", function (event) {
+  event.waitUntil(
+    caches.keys()
+      .then(function (names) {
+        return Promise.all(names.filter(function (n) { return n.startsWith("cit-"); })
+          .map(function (n) { return caches.delete(n); }));
+      })
+      .then(function () { return self.registration.unregister(); })
+  );
+});
+{% else %}
+
+self.addEventListener("install", function (event) {
+  // بدون كوكيز: نسخة الزائر من صفحة offline وليست نسخة المسجّل
+  const requests = MANIFEST.precache.map(function (url) { return new Request(url, { credentials: "omit" }); });
+  event.waitUntil(
+    caches.open(SHELL_CACHE)
+      .then(function (cache) { return cache.addAll(requests); })
+      .then(function () { return self.skipWaiting(); })
+  );
+});
+
+self.addEventListener("activate", function (event) {
+  const keep = [SHELL_CACHE, PAGES_CACHE, RUNTIME_CACHE, META_CACHE];
+  event.waitUntil(
+    caches.keys()
+      .then(function (names) {
+        return Promise.all(names.filter(function (n) { return n.startsWith("cit-") && keep.indexOf(n) === -1; })
+          .map(function (n) { return caches.delete(n); }));
+      })
+      .then(function () { return self.clients.claim(); })
+  );
+});
+
+// cache.keys() بترتيب الإضافة، وput لمفتاح موجود ينقله للآخر => نحذف الأقدم
+async function trimCache(name, max) {
+  const cache = await caches.open(name);
+  const keys = await cache.keys();
+  for (let i = 0; i < keys.length - max; i++) {
+    await cache.delete(keys[i]);
+  }
+}
+
+async function isPersonal() {
+  const meta = await caches.open(META_CACHE);
+  return Boolean(await meta.match(SESSION_KEY));
+}
+
+async function rememberSession(response) {
+  const meta = await caches.open(META_CACHE);
+  if (response.headers.get(MANIFEST.personal_header)) {
+    await meta.put(SESSION_KEY, new Response("1"));
+  } else {
+    await meta.delete(SESSION_KEY);
+  }
+}
+
+async function fetchPage(request) {
+  const response = await fetch(request);
+  // التحويلات (opaqueredirect) لا نقرأ ترويساتها ولا نحفظها
+  if (response.type !== "basic") return response;
+  await rememberSession(response);
+  if (response.ok && !response.headers.get(MANIFEST.personal_header)) {
+    const cache = await caches.open(PAGES_CACHE);
+    await cache.put(request, response.clone());
+    await trimCache(PAGES_CACHE, MANIFEST.pages_max);
+  }
+  return response;
+}
+
+async function offlineFallback(request) {
+  const cached = await caches.match(request, { cacheName: PAGES_CACHE });
+  return cached || caches.match(MANIFEST.offline, { cacheName: SHELL_CACHE });
+}
+
+async function handlePage(event, url) {
+  const request = event.request;
+  if (url.pathname.startsWith(MANIFEST.articles_prefix) && !(await isPersonal())) {
+    const cached = await caches.match(request, { cacheName: PAGES_CACHE });
+    if (cached) {
+      event.waitUntil(fetchPage(request).catch(function () {}));
+      return cached;
+    }
+  }
+  try {
+    return await fetchPage(request);
+  } catch (err) {
+    return offlineFallback(request);
+  }
+}
+
+async function cacheFirst(request, name, max) {
+  const cached = await caches.match(request, { cacheName: name });
+  if (cached) return cached;
+  const response = await fetch(request);
+  if (response.ok && response.type === "basic") {
+    const cache = await caches.open(name);
+    await cache.put(request, response.clone());
+    if (max) await trimCache(name, max);
+  }
+  return response;
+}
+
+self.addEventListener("fetch", function (event) {
+  const request = event.request;
+  if (request.method !== "GET") return;
+  const url = new URL(request.url);
+  if (url.origin !== self.location.origin) return;
+  if (MANIFEST.bypass.some(function (prefix) { return url.pathname.startsWith(prefix); })) return;
+
+  if (MANIFEST.precache.indexOf(url.pathname + url.search) !== -1) {
+    event.respondWith(cacheFirst(request, SHELL_CACHE));
+  } else if (request.mode === "navigate") {
+    event.respondWith(handlePage(event, url));
+  } else if (url.pathname.startsWith(MANIFEST.uploads_prefix)) {
+    event.respondWith(cacheFirst(request, RUNTIME_CACHE, MANIFEST.runtime_max));
+  }
+});
+{% endif %}
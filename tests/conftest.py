@@ -0,0 +1,67 @@
+"""
+كل ملف اختبار يحمّل نسخة مستقلة من app.py داخل مجلد مؤقت، فقواعد SQLite والملفات
+(uploads، cache، logs) تُنشأ هناك لا في المستودع.
+"""
+import importlib.util
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_ENV = {
+    "CIT_RATE_LIMIT_ENABLED": "0",
+    "CIT_ACCESS_LOG_ENABLED": "0",
+    "CIT_SHARED_STATE": "local",
+    "CIT_EDGE_PURGE": "off",
+    "CIT_FILE_OFFLOAD": "off",
+}
+
+
+def load_app(directory, **env):
+    """استيراد app.py من نسخة في directory مع متغيرات بيئة خاصة بها."""
+    directory = str(directory)
+    shutil.copy(os.path.join(ROOT, "app.py"), directory)
+    shutil.copytree(os.path.join(ROOT, "templates"), os.path.join(directory, "templates"))
+    shutil.copytree(os.path.join(ROOT, "static"), os.path.join(directory, "static"),
+                    ignore=shutil.ignore_patterns("uploads"))
+
+    values = dict(DEFAULT_ENV, **env)
+    saved = {key: os.environ.get(key) for key in values}
+    os.environ.update(values)
+    name = f"cit_app_{os.path.basename(directory)}"
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(directory, "app.py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module   # Flask يحدد root_path من الوحدة المسجّلة
+        spec.loader.exec_module(module)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    module.app.config["TESTING"] = True
+    return module
+
+
+@pytest.fixture(scope="module")
+def cit(tmp_path_factory):
+    return load_app(tmp_path_factory.mktemp("cit"))
+
+
+def make_client(module, role=None, username="admin"):
+    client = module.app.test_client()
+    if role:
+        with client.session_transaction() as sess:
+            sess["logged_in"] = True
+            sess["username"] = username
+            sess["role"] = role
+    return client
+
+
+@pytest.fixture
+def client(cit):
+    return lambda role=None, username="admin": make_client(cit, role, username)
@@ -0,0 +1,50 @@
+import flask
+import pytest
+
+from conftest import load_app
+
+
+@pytest.fixture(scope="module")
+def cit(tmp_path_factory):
+    module = load_app(tmp_path_factory.mktemp("cit"))
+    module.stream_progress = []
+
+    @module.app.route("/_test/stream")
+    def _test_stream():
+        def rows():
+            for i in range(5000):
+                module.stream_progress.append(i)
+                yield f"{i}\n"
+        return flask.Response(rows(), mimetype="text/plain")
+
+    return module
+
+
+def test_streamed_body_is_not_read_in_after_request(cit, client, monkeypatch):
+    records = []
+    monkeypatch.setitem(cit.app.config, "ACCESS_LOG_ENABLED", True)
+    monkeypatch.setattr(cit, "log_access", records.append)
+
+    resp = client().get("/_test/stream", buffered=False)
+    assert resp.is_streamed
+    # عميل الاختبار يقرأ أول دفعة فقط ليعرف الحالة؛ بقية الصفوف لم تُقرأ بعد
+    assert len(cit.stream_progress) <= 1
+    assert records == []       # السجل يُكتب عند الإغلاق
+
+    body = b"".join(resp.response)
+    resp.close()
+    assert len(cit.stream_progress) == 5000
+    [record] = records
+    assert record["bytes"] == len(body)
+    assert record["status"] == 200 and record["endpoint"] == "_test_stream"
+
+
+def test_plain_response_logs_content_length(cit, client, monkeypatch):
+    records = []
+    monkeypatch.setitem(cit.app.config, "ACCESS_LOG_ENABLED", True)
+    monkeypatch.setattr(cit, "log_access", records.append)
+
+    resp = client().get("/about")
+    [record] = records
+    assert record["bytes"] == len(resp.data)
+    assert record["latency_ms"] >= 0
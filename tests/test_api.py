@@ -0,0 +1,114 @@
+import pytest
+
+
+@pytest.fixture(scope="module")
+def api(cit):
+    """سبعة مقالات منشورة في tutorials (أوقات نشر متساوية مرتين) + مسودة ومجدول."""
+    published = ["2026-01-05 10:00:00", "2026-01-04 10:00:00", "2026-01-04 10:00:00",
+                 "2026-01-03 10:00:00", "2026-01-02 10:00:00", "2026-01-02 10:00:00",
+                 "2026-01-01 10:00:00"]
+    for i in range(len(published)):
+        cit.save_post("tutorials", f"p{i}.md", f"# مقال {i}\nنص")
+    # وقت النشر للمنشور مباشرة هو created_at؛ نثبّته لترتيب محدد
+    conn = cit.db_connect(cit.POSTS_STATS_DB_PATH)
+    for i, when in enumerate(published):
+        conn.execute("UPDATE post_index SET created_at = ? WHERE category = 'tutorials' AND filename = ?",
+                     (when, f"p{i}.md"))
+    conn.commit()
+    conn.close()
+    cit.save_post("tutorials", "draft.md", "# مسودة\nسر", status="draft")
+    cit.save_post("tutorials", "later.md", "# لاحقًا\nسر", status="scheduled",
+                  publish_at="2999-01-01 00:00:00")
+    return cit
+
+
+def expected_order(cit):
+    rows = [(cit.get_publish_state("tutorials", f"p{i}.md")["created_at"], f"p{i}.md") for i in range(7)]
+    return [filename for _published, filename in sorted(rows, reverse=True)]
+
+
+def test_unknown_fields_are_rejected(api, client):
+    c = client()
+    for query in ("fields=title,nope", "include=secret"):
+        resp = c.get(f"/api/v1/categories/tutorials/posts?{query}")
+        assert resp.status_code == 400
+    assert c.get("/api/v1/categories/tutorials/posts?fields=title,nope").get_json() == {
+        "error": "unknown fields: nope"}
+    assert c.get("/api/v1/posts/tutorials/p0.md?include=password").status_code == 400
+    assert c.get("/api/v1/categories?fields=secret").status_code == 400
+
+
+def test_fields_and_include_shape_the_items(api, client):
+    c = client()
+    [item, *_] = c.get("/api/v1/categories/tutorials/posts?fields=filename&include=title,views").get_json()["posts"]
+    assert list(item) == ["filename", "title", "views"]
+    post = c.get("/api/v1/posts/tutorials/p0.md?include=body").get_json()["post"]
+    assert post["title"] == "مقال 0" and "نص" in post["body"]
+
+
+def test_cursor_pages_across_ties_without_gaps(api, client):
+    c = client()
+    seen, cursor, pages = [], None, 0
+    while True:
+        url = "/api/v1/categories/tutorials/posts?limit=2&fields=filename"
+        resp = c.get(url + (f"&cursor={cursor}" if cursor else ""))
+        assert resp.status_code == 200
+        data = resp.get_json()
+        assert len(data["posts"]) <= 2
+        seen += [post["filename"] for post in data["posts"]]
+        pages += 1
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == expected_order(api)
+    assert seen == ["p0.md", "p2.md", "p1.md", "p3.md", "p5.md", "p4.md", "p6.md"]
+    assert pages == 4
+
+
+@pytest.mark.parametrize("cursor", ["garbage!", "e30", "WyJhIl0"])   # ليس base64 JSON / {} / ["a"]
+def test_bad_cursor(api, client, cursor):
+    resp = client().get(f"/api/v1/categories/tutorials/posts?cursor={cursor}")
+    assert resp.status_code == 400
+    assert resp.get_json() == {"error": "bad cursor"}
+
+
+def test_strong_etag_and_304(api, client):
+    c = client()
+    first = c.get("/api/v1/categories/tutorials/posts")
+    etag, weak = first.get_etag()
+    assert etag and not weak
+    again = c.get("/api/v1/categories/tutorials/posts", headers={"If-None-Match": f'"{etag}"'})
+    assert again.status_code == 304
+    assert again.get_data() == b""
+    other = c.get("/api/v1/categories/tutorials/posts", headers={"If-None-Match": '"stale"'})
+    assert other.status_code == 200 and other.get_data() == first.get_data()
+
+
+def test_unpublished_posts_stay_hidden(api, client):
+    c = client()
+    listed = [post["filename"] for post in c.get("/api/v1/categories/tutorials/posts?limit=100").get_json()["posts"]]
+    assert "draft.md" not in listed and "later.md" not in listed
+    for filename in ("draft.md", "later.md", "missing.md"):
+        resp = c.get(f"/api/v1/posts/tutorials/{filename}?include=body")
+        assert resp.status_code == 404
+        assert resp.get_json() == {"error": "post not found"}
+    counts = {cat["folder"]: cat["post_count"] for cat in c.get("/api/v1/categories").get_json()["categories"]}
+    assert counts["tutorials"] == 7
+
+
+def test_unknown_category(api, client):
+    resp = client().get("/api/v1/categories/nope/posts")
+    assert resp.status_code == 404
+    assert resp.get_json() == {"error": "category not found"}
+
+
+def test_comment_counts_validation(api, client):
+    c = client()
+    assert c.get("/api/v1/comments/counts").get_json() == {"error": "missing post"}
+    for bad in ("p0.md", "tutorials/", "/p0.md"):
+        resp = c.get("/api/v1/comments/counts", query_string={"post": ["tutorials/p0.md", bad]})
+        assert resp.status_code == 400
+        assert resp.get_json() == {"error": f"bad post: {bad}"}
+    api.add_comment_to_db("tutorials", "p1.md", "admin", "تعليق")
+    resp = c.get("/api/v1/comments/counts?post=tutorials/p0.md&post=tutorials/p1.md")
+    assert resp.get_json() == {"counts": {"tutorials/p0.md": 0, "tutorials/p1.md": 1}}
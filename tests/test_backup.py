@@ -0,0 +1,96 @@
+import os
+
+import pytest
+from conftest import load_app, make_client
+
+
+def test_install_backup_drops_every_derived_cache(cit, tmp_path, monkeypatch):
+    bumped = []
+    real_bump_many = cit.cache_bus_bump_many
+    monkeypatch.setattr(cit, "cache_bus_bump_many", lambda pairs: (bumped.extend(pairs), real_bump_many(pairs)))
+
+    cit._unpublished["items"] = {("old", "draft.md"): float("inf")}
+    cit._tag_postings.get_or_load("python", lambda: [("old", "a.md")])
+    cit._tag_postings.get_or_load(cit._TAGS_ALL_KEY, lambda: [("python", 1)])
+
+    cit.install_backup(str(tmp_path))
+
+    for pair in [("categories", ""), ("posts", ""), ("post_index", ""),
+                 ("tags", ""), ("tags", cit._TAGS_ALL_KEY), ("comments", "")]:
+        assert pair in bumped
+    assert cit._unpublished["items"] is None
+    assert cit._tag_postings.get_or_load("python", lambda: "fresh") == "fresh"
+    assert cit._tag_postings.get_or_load(cit._TAGS_ALL_KEY, lambda: "fresh") == "fresh"
+
+
+@pytest.fixture(params=["fs", "sqlite"])
+def site(request, tmp_path):
+    directory = tmp_path / f"site-{request.param}"
+    directory.mkdir()
+    module = load_app(directory, CIT_POST_STORAGE=request.param)
+    assert module.post_storage().name == request.param
+    return module
+
+
+def snapshot(cit):
+    posts = {(cat, fn): cit.post_storage().read(cat, fn)
+             for cat in ("articles", "projects")
+             for fn, _title in cit.list_posts_in_category(cat, include_unpublished=True)}
+    comments = [(row["name"], row["comment"]) for row in cit.get_comments("articles", "one.md")[0]]
+    uploads = {}
+    for name in sorted(os.listdir(cit.UPLOAD_FOLDER)):
+        with open(os.path.join(cit.UPLOAD_FOLDER, name), "rb") as f:
+            uploads[name] = f.read()
+    return posts, comments, uploads, cit.get_publish_state("articles", "draft.md")["status"]
+
+
+def test_backup_create_then_restore_round_trip(site, tmp_path):
+    cit = site
+    cit.save_post("articles", "one.md", "# الأول\nنص عربي ✨")
+    cit.save_post("projects", "two.md", "# الثاني\n" + "سطر\n" * 500)
+    cit.save_post("articles", "draft.md", "# مسودة\nسر", status="draft")
+    cit.add_comment_to_db("articles", "one.md", "ali", "تعليق محفوظ")
+    os.makedirs(cit.UPLOAD_FOLDER, exist_ok=True)
+    with open(os.path.join(cit.UPLOAD_FOLDER, "pic.png"), "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" + bytes(range(256)))
+    before = snapshot(cit)
+    assert before[0][("articles", "one.md")] == "# الأول\nنص عربي ✨"
+
+    runner = cit.app.test_cli_runner()
+    archive = str(tmp_path / "site.tar.gz")
+    result = runner.invoke(args=["backup-create", "-o", archive])
+    assert result.exit_code == 0, result.output
+
+    # تغييرات بعد النسخة يجب أن تختفي بالاستعادة
+    cit.save_post("articles", "one.md", "# معدّل\nنص آخر")
+    cit.save_post("articles", "later.md", "# بعد النسخة\n")
+    cit.delete_posts([("projects", "two.md")])
+    cit.add_comment_to_db("articles", "one.md", "sara", "تعليق لاحق")
+    os.remove(os.path.join(cit.UPLOAD_FOLDER, "pic.png"))
+    assert snapshot(cit) != before
+
+    result = runner.invoke(args=["backup-restore", archive, "--yes"])
+    assert result.exit_code == 0, result.output
+    assert snapshot(cit) == before
+    c = make_client(cit)
+    assert c.get("/post/articles/later.md").status_code == 404
+    assert "نص عربي ✨" in c.get("/post/articles/one.md").get_data(as_text=True)
+
+
+def test_corrupt_archive_changes_nothing(site, tmp_path):
+    cit = site
+    cit.save_post("articles", "one.md", "# الأول\nنص")
+    archive = str(tmp_path / "site.tar.gz")
+    runner = cit.app.test_cli_runner()
+    assert runner.invoke(args=["backup-create", "-o", archive]).exit_code == 0
+    with open(archive, "rb") as f:
+        data = bytearray(f.read())
+    data[len(data) // 2] ^= 0xFF
+    with open(archive, "wb") as f:
+        f.write(data)
+
+    cit.save_post("articles", "one.md", "# بعد النسخة\nنص")
+    result = runner.invoke(args=["backup-restore", archive, "--yes"])
+    assert result.exit_code != 0
+    assert "لم يُغيَّر شيء" in result.output
+    assert cit.post_storage().read("articles", "one.md") == "# بعد النسخة\nنص"
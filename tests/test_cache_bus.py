@@ -0,0 +1,96 @@
+import os
+
+import pytest
+from conftest import load_app
+
+
+@pytest.fixture
+def pair(tmp_path):
+    """عاملان (نسختان من التطبيق) يتشاركان cache_bus.db فقط."""
+    bus = str(tmp_path / "cache_bus.db")
+    apps = []
+    for name in ("bus_a", "bus_b"):
+        directory = tmp_path / name
+        directory.mkdir()
+        apps.append(load_app(directory, CIT_CACHE_BUS_DB=bus))
+    return apps
+
+
+class Loads:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return self.count
+
+
+def test_bump_in_one_instance_invalidates_the_other(pair):
+    a, b = pair
+    cache = b.LocalCache("demo")
+    b.cache_bus_poll()
+    k1, k2 = Loads(), Loads()
+    assert cache.get_or_load("k1", k1) == 1 and cache.get_or_load("k2", k2) == 1
+
+    a.cache_bus_bump("demo", "k1")
+    assert cache.get_or_load("k1", k1) == 1          # قبل الفحص التالي ما زال مخزنًا
+    b.app.test_client().get("/search")                # كل طلب يفحص الناقل أولًا
+    assert cache.get_or_load("k1", k1) == 2
+    assert cache.get_or_load("k2", k2) == 1           # مفتاح آخر لا يُمس
+
+    a.cache_bus_bump("other", "k2")
+    b.cache_bus_poll()
+    assert cache.get_or_load("k2", k2) == 1           # namespace آخر
+
+    a.cache_bus_bump_many([("demo", ""), ("other", "x")])
+    b.cache_bus_poll()
+    assert (cache.get_or_load("k1", k1), cache.get_or_load("k2", k2)) == (3, 2)
+
+    # ولا يُعاد الإبطال نفسه في الفحص التالي
+    b.cache_bus_poll()
+    assert (cache.get_or_load("k1", k1), cache.get_or_load("k2", k2)) == (3, 2)
+
+
+def test_own_bumps_do_not_replay_on_poll(pair):
+    a, _b = pair
+    cache = a.LocalCache("demo")
+    a.cache_bus_poll()
+    loads = Loads()
+    cache.get_or_load("k", loads)
+    a.cache_bus_bump("demo", "k")                     # يُبطل فورًا في نفس العملية
+    assert cache.get_or_load("k", loads) == 2
+    a.cache_bus_poll()
+    assert cache.get_or_load("k", loads) == 2
+
+
+def test_subscriber_keeps_working_after_fork(pair, monkeypatch):
+    a, b = pair
+    cache = b.LocalCache("demo")
+    b.cache_bus_poll()
+    loads = Loads()
+    cache.get_or_load("k", loads)
+    a.cache_bus_bump("demo", "unrelated")
+
+    # عملية جديدة (fork بعد الاستيراد): pid آخر، اتصال جديد وعدّاد يبدأ من الحالي
+    real_pid = os.getpid()
+    monkeypatch.setattr(os, "getpid", lambda: real_pid + 100_000)
+    b.cache_bus_poll()
+    assert b._bus_state["pid"] == real_pid + 100_000
+    assert cache.get_or_load("k", loads) == 1
+
+    a.cache_bus_bump("demo", "k")
+    b.cache_bus_poll()
+    assert cache.get_or_load("k", loads) == 2
+    assert b.shared_state._bus_local.pid == real_pid + 100_000
+
+
+def test_post_listing_cache_follows_the_other_worker(pair):
+    a, b = pair
+    b.cache_bus_poll()
+    assert b.list_posts_in_category("articles") == []
+    # الكاتب الآخر يكتب في نفس مخزن b ثم يرفع الإصدار من عمليته هو
+    b.post_storage().write("articles", "shared.md", "# مشترك\n")
+    assert b.list_posts_in_category("articles") == []
+    a.cache_bus_bump("posts", "articles")
+    b.app.test_client().get("/search")
+    assert b.list_posts_in_category("articles") == [("shared.md", "مشترك")]
@@ -0,0 +1,66 @@
+import pytest
+
+
+def rows(cit, category, filename):
+    page, _cursor = cit.get_comments(category, filename)
+    return [dict(row) for row in page]
+
+
+def test_reply_at_max_depth_becomes_a_sibling(cit):
+    chain = [cit.add_comment_to_db("articles", "deep.md", "u", "0")]
+    for depth in range(1, cit.COMMENT_MAX_DEPTH + 1):
+        chain.append(cit.add_comment_to_db("articles", "deep.md", "u", str(depth), parent_id=chain[-1]))
+    deepest = chain[-1]
+    clamped = cit.add_comment_to_db("articles", "deep.md", "u", "clamped", parent_id=deepest)
+
+    by_id = {row["id"]: row for row in rows(cit, "articles", "deep.md")}
+    assert by_id[deepest]["depth"] == cit.COMMENT_MAX_DEPTH
+    assert by_id[clamped]["depth"] == cit.COMMENT_MAX_DEPTH
+    assert by_id[clamped]["parent_id"] == chain[-2]
+    # ترتيب العرض: الرد المقصوص يأتي مباشرة بعد التعليق الذي رد عليه
+    assert [row["id"] for row in rows(cit, "articles", "deep.md")] == chain + [clamped]
+
+
+def test_reply_count_is_updated_on_every_ancestor(cit):
+    root = cit.add_comment_to_db("articles", "counts.md", "u", "root")
+    a = cit.add_comment_to_db("articles", "counts.md", "u", "a", parent_id=root)
+    b = cit.add_comment_to_db("articles", "counts.md", "u", "b", parent_id=root)
+    a1 = cit.add_comment_to_db("articles", "counts.md", "u", "a1", parent_id=a)
+    a1x = cit.add_comment_to_db("articles", "counts.md", "u", "a1x", parent_id=a1)
+    other = cit.add_comment_to_db("articles", "counts.md", "u", "other")
+
+    counts = {row["id"]: row["reply_count"] for row in rows(cit, "articles", "counts.md")}
+    assert counts == {root: 4, a: 2, b: 0, a1: 1, a1x: 0, other: 0}
+    assert cit.count_comments([("articles", "counts.md")]) == {("articles", "counts.md"): 6}
+
+
+def test_reply_to_a_comment_on_another_post_is_refused(cit):
+    foreign = cit.add_comment_to_db("articles", "one.md", "u", "x")
+    assert cit.add_comment_to_db("articles", "two.md", "u", "y", parent_id=foreign) is None
+    assert cit.add_comment_to_db("articles", "two.md", "u", "y", parent_id=10 ** 9) is None
+    assert rows(cit, "articles", "two.md") == []
+
+
+def test_table_is_not_rechecked_per_call(cit, monkeypatch):
+    def fail():
+        raise AssertionError("يُهيَّأ الجدول مرة عند الاستيراد فقط")
+
+    monkeypatch.setattr(cit, "_ensure_comments_table", fail)
+    comment_id = cit.add_comment_to_db("articles", "once.md", "u", "x")
+    assert [row["id"] for row in rows(cit, "articles", "once.md")] == [comment_id]
+    assert cit.count_comments([("articles", "once.md")]) == {("articles", "once.md"): 1}
+
+
+@pytest.mark.parametrize("threads", [1, 2])
+def test_thread_pages(cit, threads):
+    filename = f"pages{threads}.md"
+    roots = [cit.add_comment_to_db("articles", filename, "u", str(i)) for i in range(3)]
+    cit.add_comment_to_db("articles", filename, "u", "reply", parent_id=roots[0])
+
+    seen, before = [], None
+    while True:
+        page, before = cit.get_comments("articles", filename, before=before, threads=threads)
+        seen += [row["comment"] for row in page]
+        if before is None:
+            break
+    assert seen == ["2", "1", "0", "reply"]
@@ -0,0 +1,36 @@
+def test_bulk_delete_removes_revisions_and_drafts(cit, client):
+    for name in ("gone.md", "kept.md"):
+        cit.save_post("articles", name, f"# {name}\nنص")
+    for user in ("admin", "sara"):
+        cit.apply_draft_patch(user, "articles/gone.md", 0, [[0, 0, "تعديل"]], {})
+    cit.apply_draft_patch("admin", "articles/kept.md", 0, [[0, 0, "تعديل"]], {})
+    cit.apply_draft_patch("admin", "new", 0, [[0, 0, "مقال جديد"]], {})
+
+    resp = client("admin").post("/admin/posts/bulk-delete",
+                                json={"items": ["articles/gone.md", "articles/never.md"]})
+    assert [r["result"] for r in resp.get_json()["results"]] == ["deleted", "not_found"]
+
+    assert cit.list_revisions("articles", "gone.md") == []
+    assert cit.get_draft("admin", "articles/gone.md") is None
+    assert cit.get_draft("sara", "articles/gone.md") is None
+    # مقالات ومسودات أخرى لا تُمس
+    assert cit.list_revisions("articles", "kept.md")
+    assert cit.get_draft("admin", "articles/kept.md") is not None
+    assert cit.get_draft("admin", "new") is not None
+
+
+def test_comment_caches_are_bumped_after_the_rows_are_gone(cit, monkeypatch):
+    cit.save_post("articles", "talk.md", "# نقاش\nنص")
+    cit.add_comment_to_db("articles", "talk.md", "ali", "أول تعليق")
+    seen = []
+    real_bump_many = cit.cache_bus_bump_many
+
+    def bump_many(pairs):
+        pairs = list(pairs)
+        if ("comments", "articles/talk.md") in pairs:
+            seen.append(cit.count_comments([("articles", "talk.md")]))
+        return real_bump_many(pairs)
+
+    monkeypatch.setattr(cit, "cache_bus_bump_many", bump_many)
+    cit.delete_posts([("articles", "talk.md")])
+    assert seen == [{("articles", "talk.md"): 0}]
@@ -0,0 +1,80 @@
+import pytest
+
+
+@pytest.fixture
+def admin(client):
+    return client("admin", "drafter")
+
+
+def patch(c, version, patches, key="articles/d.md", **meta):
+    return c.post("/drafts/patch", json={"key": key, "base_version": version, "patches": patches, **meta})
+
+
+def test_patches_build_the_draft_and_carry_metadata(admin):
+    resp = patch(admin, 0, [[0, 0, "مرحبا 😀 بالعالم"]], title="عنوان", category="articles")
+    assert resp.status_code == 200 and resp.get_json()["version"] == 1
+
+    # وحدات code point: الرمز التعبيري خانة واحدة
+    resp = patch(admin, 1, [[6, 1, "يا"], [0, 0, "» "]])
+    assert resp.get_json()["version"] == 2
+
+    draft = admin.get("/drafts?key=articles/d.md").get_json()
+    assert draft["content"] == "» مرحبا يا بالعالم"
+    assert draft["version"] == 2
+    # الحقول التي لم تُرسل تبقى من المسودة السابقة
+    assert (draft["title"], draft["category"], draft["filename"]) == ("عنوان", "articles", "")
+
+
+def test_stale_base_version_is_a_conflict(admin):
+    patch(admin, 0, [[0, 0, "نص"]], key="stale")
+    patch(admin, 1, [[2, 0, " أول"]], key="stale")
+
+    resp = patch(admin, 1, [[0, 0, "من نافذة أخرى "]], key="stale")
+    assert resp.status_code == 409
+    assert resp.get_json() == {"conflict": True, "version": 2}
+    assert admin.get("/drafts?key=stale").get_json()["content"] == "نص أول"
+
+    assert patch(admin, 0, [[0, 0, "x"]], key="new-key-conflict").status_code == 200
+    assert patch(admin, 0, [[0, 0, "x"]], key="new-key-conflict").status_code == 409
+
+
+@pytest.mark.parametrize("patches", [
+    [[5, 0, "x"]],            # بعد نهاية النص
+    [[0, 4, ""]],             # حذف أكثر من الموجود
+    [[-1, 0, "x"]],
+    [[0, -1, "x"]],
+    [[0, 0]],
+    [["0", 0, "x"]],
+    [[0, 0, 5]],
+    [[0.5, 0, "x"]],
+    [5],
+    ["abc"],
+])
+def test_bad_patches_are_rejected_without_changes(admin, patches):
+    key = f"bad-{abs(hash(repr(patches)))}"
+    patch(admin, 0, [[0, 0, "abc"]], key=key)
+    resp = patch(admin, 1, patches, key=key)
+    assert resp.status_code == 400 and resp.get_json() == {"error": "bad patch"}
+    assert admin.get(f"/drafts?key={key}").get_json()["version"] == 1
+
+
+@pytest.mark.parametrize("body", [
+    {"base_version": 0, "patches": []},
+    {"key": "x", "patches": []},
+    {"key": "x", "base_version": "0", "patches": []},
+    {"key": "x", "base_version": 0, "patches": {"0": [0, 0, "x"]}},
+])
+def test_malformed_requests_are_400(admin, body):
+    resp = admin.post("/drafts/patch", json=body)
+    assert resp.status_code == 400 and resp.get_json() == {"error": "bad request"}
+
+
+def test_drafts_are_per_user_and_admin_only(client, admin):
+    patch(admin, 0, [[0, 0, "سري"]], key="mine")
+    other = client("admin", "someone-else")
+    assert other.get("/drafts?key=mine").get_json() == {"exists": False, "version": 0}
+    assert patch(client("writer", "w"), 0, [[0, 0, "x"]]).status_code == 403
+    assert admin.get("/drafts").status_code == 400
+
+    assert admin.delete("/drafts?key=mine").get_json() == {"deleted": True}
+    assert admin.get("/drafts?key=mine").get_json()["exists"] is False
@@ -0,0 +1,85 @@
+import http.server
+import os
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def purge_server():
+    received = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_PURGE(self):
+            received.append((self.path, self.headers.get("xkey-purge", "").split()))
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/", received
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def edge(cit, purge_server, monkeypatch):
+    """ناقل HTTP حقيقي نحو الخادم المحلي؛ بلا خيط الخلفية فنفرّغ الطابور بأنفسنا."""
+    url, received = purge_server
+    monkeypatch.setattr(cit, "edge_purge_transport", cit.HttpPurgeTransport([url, url]))
+    monkeypatch.setitem(cit._edge_purger, "pid", os.getpid())
+    monkeypatch.setitem(cit._edge_purger, "wake", threading.Event())
+    cit._edge_pending.clear()
+    return received
+
+
+def purged(received):
+    return [key for _path, keys in received for key in keys]
+
+
+def test_batches_and_deduplicates(cit, edge, monkeypatch):
+    monkeypatch.setattr(cit, "EDGE_PURGE_MAX_KEYS", 2)
+    cit.edge_purge(["post:news/a.md", "listing"])
+    cit.edge_purge(["listing", "post:news/b.md", "post:news/a.md"])
+
+    assert cit.flush_edge_purges() == 3
+    # كل دفعة طلب واحد لكل خادم كاش؛ ومفتاح listing مرة واحدة فقط
+    assert edge == [
+        ("/", ["listing", "post:news/a.md"]), ("/", ["listing", "post:news/a.md"]),
+        ("/", ["post:news/b.md"]), ("/", ["post:news/b.md"]),
+    ]
+    assert cit.flush_edge_purges() == 0
+
+
+@pytest.mark.parametrize("pairs, expected", [
+    ([("posts", "news")], {"category:news", "listing"}),
+    ([("posts", "")], {"nav", "listing", "post:*", "category:*"}),
+    ([("comments", "news/a.md")], {"comments:news/a.md"}),
+    ([("comments", "")], {"comments:*"}),
+    ([("tags", "python")], {"tag:python"}),
+    ([("tags", "*")], {"tags"}),
+    ([("tags", "")], {"tags", "tag:*"}),
+    ([("post_index", ""), ("categories", "")], {"listing", "nav"}),
+])
+def test_bus_keys_mapping(cit, edge, pairs, expected):
+    cit.edge_purge_for_bus(pairs)
+    cit.flush_edge_purges()
+    assert set(purged(edge)) == expected
+
+
+def test_restore_bump_purges_every_post_page(cit, edge):
+    cit.cache_bus_bump_many([("posts", ""), ("tags", ""), ("comments", "")])
+    cit.flush_edge_purges()
+    assert {"post:*", "category:*", "tag:*", "comments:*"} <= set(purged(edge))
+
+
+def test_pages_carry_family_keys(cit, client, monkeypatch):
+    monkeypatch.setattr(cit, "EDGE_CACHE_ENABLED", True)
+    resp = client().get("/articles")
+    keys = resp.headers[cit.SURROGATE_KEY_HEADER].split()
+    assert {"nav", "category:articles", "category:*"} <= set(keys)
+    assert "s-maxage=300" in resp.headers["Cache-Control"]
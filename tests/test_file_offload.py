@@ -0,0 +1,68 @@
+import os
+import urllib.parse
+
+import pytest
+
+CONTENT = bytes(range(256)) * 4     # 1024 بايت
+NAME = "صورة 1.png"
+
+
+@pytest.fixture
+def upload(cit):
+    os.makedirs(cit.UPLOAD_FOLDER, exist_ok=True)
+    path = os.path.join(cit.UPLOAD_FOLDER, NAME)
+    with open(path, "wb") as f:
+        f.write(CONTENT)
+    yield "/static/uploads/" + urllib.parse.quote(NAME)
+    os.remove(path)
+
+
+def test_nginx_accel_redirect_quotes_internal_path(cit, client, upload, monkeypatch):
+    monkeypatch.setattr(cit, "FILE_OFFLOAD", "nginx")
+    resp = client().get(upload)
+    assert resp.status_code == 200
+    assert resp.headers["X-Accel-Redirect"] == "/_cit_files/uploads/" + urllib.parse.quote(NAME)
+    assert resp.data == b""
+    assert resp.mimetype == "image/png"
+    assert resp.cache_control.max_age == cit.UPLOADS_MAX_AGE and resp.cache_control.public
+
+
+def test_sendfile_absolute_path(cit, client, upload, monkeypatch):
+    monkeypatch.setattr(cit, "FILE_OFFLOAD", "sendfile")
+    resp = client().get(upload)
+    assert resp.headers["X-Sendfile"] == os.path.abspath(os.path.join(cit.UPLOAD_FOLDER, NAME))
+    assert resp.data == b""
+
+
+@pytest.mark.parametrize("mode", ["nginx", "sendfile"])
+def test_offload_refuses_missing_and_escaping_paths(cit, client, monkeypatch, mode):
+    monkeypatch.setattr(cit, "FILE_OFFLOAD", mode)
+    assert client().get("/static/uploads/missing.png").status_code == 404
+    assert client().get("/static/uploads/..%2F..%2Fapp.py").status_code == 404
+
+
+def test_direct_serving_ranges(client, upload):
+    c = client()
+    full = c.get(upload)
+    assert full.status_code == 200 and full.data == CONTENT
+    assert full.headers["Content-Length"] == str(len(CONTENT))
+    assert full.headers["Accept-Ranges"] == "bytes"
+    etag = full.headers["ETag"]
+
+    part = c.get(upload, headers={"Range": "bytes=10-19"})
+    assert part.status_code == 206
+    assert part.data == CONTENT[10:20]
+    assert part.headers["Content-Length"] == "10"
+    assert part.headers["Content-Range"] == f"bytes 10-19/{len(CONTENT)}"
+
+    beyond = c.get(upload, headers={"Range": "bytes=5000-6000"})
+    assert beyond.status_code == 416
+    assert beyond.headers["Content-Range"] == f"bytes */{len(CONTENT)}"
+
+    # If-Range لا يطابق => الملف كاملًا؛ يطابق => الجزء فقط
+    stale = c.get(upload, headers={"Range": "bytes=0-9", "If-Range": '"old-version"'})
+    assert stale.status_code == 200 and stale.data == CONTENT
+    fresh = c.get(upload, headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert fresh.status_code == 206 and fresh.data == CONTENT[:10]
+
+    assert c.get(upload, headers={"If-None-Match": etag}).status_code == 304
@@ -0,0 +1,89 @@
+import base64
+import hashlib
+import os
+
+import pytest
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+GIF = b"GIF89a" + b"\x01" * 20
+WEBP = b"RIFF\x10\x00\x00\x00WEBPVP8 " + b"\x02" * 8
+
+
+def data_uri(data, declared="png"):
+    return f"data:image/{declared};base64,{base64.b64encode(data).decode()}"
+
+
+def expected_name(data, ext):
+    return f"inline_{hashlib.sha256(data).hexdigest()[:32]}.{ext}"
+
+
+@pytest.fixture
+def extract(cit):
+    def run(text):
+        with cit.app.test_request_context():
+            return cit.extract_inline_images(text)
+    return run
+
+
+def test_data_uris_become_uploaded_files(cit, extract):
+    text = f'<p><img src="{data_uri(PNG)}"></p>\n![gif]({data_uri(GIF, "gif")})\n<img src=\'{data_uri(WEBP, "webp")}\'>'
+    new_text, count = extract(text)
+    assert count == 3
+    assert "data:image" not in new_text
+    for data, ext in ((PNG, "png"), (GIF, "gif"), (WEBP, "webp")):
+        name = expected_name(data, ext)
+        assert f"/static/uploads/{name}" in new_text
+        with open(os.path.join(cit.UPLOAD_FOLDER, name), "rb") as f:
+            assert f.read() == data
+    assert '<img src="/static/uploads/' in new_text and "![gif](/static/uploads/" in new_text
+
+
+def test_same_image_is_stored_once(cit, extract):
+    jpeg = b"\xff\xd8\xff\xe0" + os.urandom(64)
+    text = f'<img src="{data_uri(jpeg, "jpeg")}"><img src="{data_uri(jpeg, "jpg")}">'
+    new_text, count = extract(text)
+    name = expected_name(jpeg, "jpg")
+    assert count == 2 and new_text.count(name) == 2
+    assert [n for n in os.listdir(cit.UPLOAD_FOLDER) if n.startswith(name[:-4])] == [name]
+
+    # التشغيل مرة أخرى على النص الأصلي يعطي نفس الاسم ولا يكتب ملفًا جديدًا
+    mtime = os.stat(os.path.join(cit.UPLOAD_FOLDER, name)).st_mtime_ns
+    assert extract(text)[0] == new_text
+    assert os.stat(os.path.join(cit.UPLOAD_FOLDER, name)).st_mtime_ns == mtime
+    assert not [n for n in os.listdir(cit.UPLOAD_FOLDER) if n.endswith(".tmp")]
+
+
+@pytest.mark.parametrize("uri", [
+    data_uri(b"<svg onload=alert(1)>", "png"),          # ليس PNG فعلًا
+    data_uri(PNG, "gif"),                                # النوع المعلن لا يطابق المحتوى
+    data_uri(b"RIFF\x00\x00\x00\x00WAVE", "webp"),
+    "data:image/png;base64,iVBORw0KGgo=garbage",         # base64 غير صالح يبقى كما هو
+])
+def test_non_images_stay_inline(cit, extract, uri):
+    text = f'<img src="{uri}">'
+    assert extract(text) == (text, 0)
+
+
+def test_svg_is_not_extracted(extract):
+    text = f'<img src="data:image/svg+xml;base64,{base64.b64encode(b"<svg/>").decode()}">'
+    assert extract(text) == (text, 0)
+
+
+def test_oversized_payload_stays_inline(cit, extract, monkeypatch):
+    monkeypatch.setattr(cit, "INLINE_IMAGE_MAX_BYTES", 64)
+    big, small = PNG + b"\x01" * 100, PNG
+    text = f'<img src="{data_uri(big)}"><img src="{data_uri(small)}">'
+    new_text, count = extract(text)
+    assert count == 1
+    assert data_uri(big) in new_text
+    assert expected_name(small, "png") in new_text
+    assert not os.path.exists(os.path.join(cit.UPLOAD_FOLDER, expected_name(big, "png")))
+
+
+def test_saved_post_references_the_file(cit):
+    png = PNG + b"saved"
+    with cit.app.test_request_context():
+        cit.save_post("articles", "pics.md", f'# صور\n<p><img src="{data_uri(png)}"></p>')
+    stored = cit.post_storage().read("articles", "pics.md")
+    assert stored == f'# صور\n<p><img src="/static/uploads/{expected_name(png, "png")}"></p>'
+    assert cit.get_revision_text("articles", "pics.md", 1) == stored
@@ -0,0 +1,62 @@
+import random
+
+
+def test_merge_matches_a_full_sort(cit):
+    rng = random.Random(3)
+    categories = ["articles", "projects", "tutorials"]
+    days = [f"2026-0{m}-1{d} 09:00:00" for m in range(1, 4) for d in range(3)]   # تكرار الأوقات مقصود
+    created = {}
+    for i in range(45):
+        category, filename = rng.choice(categories), f"post{i:02d}.md"
+        kind = rng.choice(["published"] * 4 + ["draft", "due", "future"])
+        if kind == "published":
+            cit.save_post(category, filename, f"# {i}\n")
+            created[(category, filename)] = rng.choice(days)
+        elif kind == "draft":
+            cit.save_post(category, filename, f"# {i}\n", status="draft")
+            created[(category, filename)] = rng.choice(days)
+        else:
+            when = rng.choice(days) if kind == "due" else "2999-01-01 00:00:00"
+            cit.save_post(category, filename, f"# {i}\n", status="scheduled", publish_at=when)
+
+    conn = cit.db_connect(cit.POSTS_STATS_DB_PATH)
+    conn.executemany("UPDATE post_index SET created_at = ? WHERE category = ? AND filename = ?",
+                     [(when, category, filename) for (category, filename), when in created.items()])
+    conn.commit()
+    conn.close()
+    cit.cache_bus_bump("posts")
+
+    # المرجع: كل المقالات الظاهرة من كل الأقسام مرتبة كاملة
+    conn = cit.db_connect(cit.POSTS_STATS_DB_PATH)
+    rows = conn.execute("SELECT IFNULL(publish_at, created_at), category, filename FROM post_index").fetchall()
+    conn.close()
+    visible = {(category, filename) for category in categories
+               for filename, _title in cit.list_posts_in_category(category)}
+    expected = [(category, filename) for _published, category, filename in sorted(rows, reverse=True)
+                if (category, filename) in visible]
+    assert len(expected) > 20
+    assert len(visible) < 45        # فيها مسودات ومجدول لم يحن
+
+    merged = [(post["category"], post["filename"]) for post in cit.iter_latest_posts()]
+    assert merged == expected
+
+    paged, page = [], 1
+    while True:
+        items, has_next = cit.latest_posts_page(page, per_page=7)
+        paged += [(post["category"], post["filename"]) for post in items]
+        if not has_next:
+            break
+        page += 1
+    assert paged == expected
+    assert page == -(-len(expected) // 7)
+
+
+def test_latest_page_follows_writes(cit, client):
+    c = client()
+    cit.save_post("projects", "brand-new.md", "# أحدث مقال على الإطلاق\n")
+    body = c.get("/latest").get_data(as_text=True)
+    assert "أحدث مقال على الإطلاق" in body
+
+    cit.save_post("projects", "brand-new.md", "# مسودة الآن\n", status="draft")
+    body = c.get("/latest").get_data(as_text=True)
+    assert "أحدث مقال على الإطلاق" not in body and "مسودة الآن" not in body
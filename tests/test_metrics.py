@@ -0,0 +1,111 @@
+import re
+
+import pytest
+
+SAMPLE_RE = re.compile(r'^(?P<name>[a-z_]+)(?P<labels>\{[^}]*\})? (?P<value>[0-9.e+-]+)$')
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+@pytest.fixture
+def metered(cit, monkeypatch):
+    monkeypatch.setitem(cit.app.config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(cit, "_metrics_hist", {})
+    return cit
+
+
+def parse_exposition(text):
+    """{(name, labels): value} مع التحقق من ترتيب HELP/TYPE وشكل كل سطر."""
+    assert text.endswith("\n")
+    samples, declared = {}, {}
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name = line.split(" ")[2]
+            assert name not in declared
+            declared[name] = None
+        elif line.startswith("# TYPE "):
+            _hash, _type, name, kind = line.split(" ")
+            assert name in declared and kind == "histogram"
+            declared[name] = kind
+        else:
+            m = SAMPLE_RE.match(line)
+            assert m, line
+            base = re.sub(r"_(bucket|sum|count)$", "", m["name"])
+            assert declared.get(base) == "histogram", line
+            labels = tuple(LABEL_RE.findall(m["labels"] or ""))
+            samples[(m["name"], labels)] = float(m["value"])
+    return samples
+
+
+def test_prometheus_exposition_format(metered, client):
+    admin = client("admin")
+    for _ in range(3):
+        admin.get("/about").get_data()
+    resp = admin.get("/metrics")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    assert resp.headers["Content-Type"] == "text/plain; version=0.0.4; charset=utf-8"
+    samples = parse_exposition(resp.get_data(as_text=True))
+
+    endpoint = (("endpoint", "about_page"),)
+    buckets = [(dict(labels)["le"], value) for (name, labels), value in samples.items()
+               if name == "cit_request_duration_seconds_bucket" and labels[:-1] == endpoint]
+    assert [le for le, _value in buckets] == [str(b) for b in metered.METRICS_BUCKETS] + ["+Inf"]
+    values = [value for _le, value in buckets]
+    assert values == sorted(values)                     # تراكمية
+    assert values[-1] == samples[("cit_request_duration_seconds_count", endpoint)] == 3
+    assert samples[("cit_request_duration_seconds_sum", endpoint)] > 0
+    assert ("cit_phase_duration_seconds_count", (("phase", "template"), ("endpoint", "about_page"))) in samples
+
+
+def test_label_values_are_escaped(metered):
+    metered._observe("cit_phase_duration_seconds", (("phase", 'a"b\\c\nd'), ("endpoint", "x")), 0.002)
+    text = metered.render_prometheus_metrics()
+    assert 'phase="a\\"b\\\\c\\nd"' in text
+    samples = parse_exposition(text)
+    assert samples[("cit_phase_duration_seconds_bucket",
+                    (("phase", 'a\\"b\\\\c\\nd'), ("endpoint", "x"), ("le", "0.001")))] == 0
+    assert samples[("cit_phase_duration_seconds_bucket",
+                    (("phase", 'a\\"b\\\\c\\nd'), ("endpoint", "x"), ("le", "0.0025")))] == 1
+
+
+def test_server_timing_phases_on_a_buffered_request(metered, client, monkeypatch):
+    metered.save_post("articles", "timed.md", "# مقال\nنص")
+    resp = client("admin").get("/admin/posts/edit/articles/timed.md")
+    header = resp.headers["Server-Timing"]
+    phases = dict(re.findall(r"(\w+);dur=([0-9.]+)", header))
+    assert {"sql", "fs", "template", "total"} <= set(phases)
+    assert "headers" not in phases
+    assert re.search(r'sql;dur=[0-9.]+;desc="\d+ ops"', header)
+    assert float(phases["total"]) >= max(float(v) for k, v in phases.items() if k != "total")
+
+
+def test_streamed_pages_report_headers_not_total(metered, client):
+    metered.save_post("articles", "streamed.md", "# مقال\nنص")
+    header = client("admin").get("/post/articles/streamed.md").headers["Server-Timing"]
+    assert "headers;dur=" in header and "total;dur=" not in header
+
+
+def test_server_timing_is_for_admins_only(metered, client):
+    assert "Server-Timing" not in client().get("/about").headers
+    assert "Server-Timing" not in client("writer", "ali").get("/about").headers
+
+
+def test_disabled_metrics_cost_nothing(cit, client, monkeypatch):
+    monkeypatch.setitem(cit.app.config, "METRICS_ENABLED", False)
+    monkeypatch.setattr(cit, "_metrics_hist", {})
+    assert "Server-Timing" not in client("admin").get("/about").headers
+    conn = cit.db_connect(cit.DB_PATH)
+    assert type(conn) is cit.sqlite3.Connection
+    conn.close()
+    assert cit.timed("fs") is cit._NULL_TIMER
+    assert cit.render_prometheus_metrics() == "\n"
+
+
+def test_metrics_access(metered, client, monkeypatch):
+    monkeypatch.setitem(metered.app.config, "METRICS_TOKEN", "s3cret")
+    assert client().get("/metrics").status_code == 403
+    assert client("writer", "ali").get("/metrics").status_code == 403
+    assert client().get("/metrics", headers={"Authorization": "Bearer nope"}).status_code == 403
+    assert client().get("/metrics", headers={"Authorization": "Bearer s3cret"}).status_code == 200
+    monkeypatch.setitem(metered.app.config, "METRICS_TOKEN", "")
+    assert client().get("/metrics", headers={"Authorization": "Bearer "}).status_code == 403
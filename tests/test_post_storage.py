@@ -0,0 +1,112 @@
+import pytest
+
+
+@pytest.fixture(params=["fs", "sqlite"])
+def storage(request, cit, tmp_path):
+    if request.param == "fs":
+        return cit.FilePostStorage(str(tmp_path / "markdown"))
+    return cit.SQLitePostStorage(str(tmp_path / "posts.db"), compress=True)
+
+
+def test_write_read_and_titles(storage):
+    assert storage.read("articles", "a") is None
+    assert storage.read_versioned("articles", "a") == (None, None)
+    assert not storage.exists("articles", "a") and not storage.has_posts("articles")
+
+    storage.write("articles", "a", "# أهلًا\nنص")
+    storage.write("articles", "b", "بلا عنوان")
+    assert storage.read("articles", "a") == "# أهلًا\nنص"
+    assert storage.exists("articles", "a") and storage.has_posts("articles")
+    assert sorted(storage.list_titles("articles")) == [("a", "أهلًا"), ("b", "b")]
+    assert dict(storage.iter_texts("articles")) == {"a": "# أهلًا\nنص", "b": "بلا عنوان"}
+    assert set(storage.list_created("articles")) == {"a", "b"}
+    assert storage.categories() == ["articles"]
+    assert storage.list_titles("projects") == []
+
+
+def test_read_versioned_changes_on_every_write(storage):
+    storage.write("articles", "a", "# ١\nنص")
+    text, first = storage.read_versioned("articles", "a")
+    assert text == "# ١\nنص" and first
+    assert storage.read_versioned("articles", "a")[1] == first      # قراءة لا تغيّر النسخة
+
+    # نفس الطول عمدًا: معرّف fs يعتمد على mtime_ns والحجم
+    storage.write("articles", "a", "# ٢\nنص")
+    text, second = storage.read_versioned("articles", "a")
+    if storage.name == "fs" and second == first:
+        pytest.skip("دقة mtime في نظام الملفات أخشن من كتابتين متتاليتين")
+    assert text == "# ٢\nنص" and second != first
+    if storage.name == "sqlite":
+        assert first.endswith("@1") and second.endswith("@2")
+
+
+def test_delete_many_returns_only_existing(storage):
+    storage.write("articles", "a", "# a\n")
+    storage.write("projects", "b", "# b\n")
+    deleted = storage.delete_many([("articles", "a"), ("articles", "missing"), ("projects", "b"),
+                                   ("nope", "b")])
+    assert deleted == {("articles", "a"), ("projects", "b")}
+    assert storage.delete_many([("articles", "a")]) == set()
+    assert storage.delete_many(iter([])) == set()
+    assert not storage.exists("articles", "a")
+
+
+def test_search_is_case_insensitive_beyond_ascii(storage):
+    storage.write("articles", "ar", "# مقدمة في البرمجة\nنتعلم اليوم لغة Python خطوة بخطوة")
+    storage.write("articles", "fr", "# ÉCOLE\nCAFÉ ÉTÉ")
+    storage.write("articles", "other", "# شيء آخر\nلا علاقة")
+
+    assert [r[0] for r in storage.search("articles", "البرمجة")] == ["ar"]
+    assert [r[0] for r in storage.search("articles", "python")] == ["ar"]
+    # lower() في SQLite لا تطوي É؛ py_lower تفعل
+    assert [r[0] for r in storage.search("articles", "école")] == ["fr"]
+    [(filename, title, snippet)] = storage.search("articles", "café")
+    assert (filename, title) == ("fr", "ÉCOLE") and "CAFÉ" in snippet
+    assert storage.search("articles", "غير موجود") == []
+
+
+def test_large_posts_are_compressed(cit, tmp_path):
+    storage = cit.SQLitePostStorage(str(tmp_path / "posts.db"), compress=True)
+    small = "# قصير\n" + "ن" * 10
+    large = "# طويل\n" + "فقرة مكررة للاختبار. " * (cit.POSTS_COMPRESS_MIN_BYTES // 10)
+    storage.write("articles", "small", small)
+    storage.write("articles", "large", large + "كلمة_نادرة")
+
+    conn = storage._connect()
+    flags = dict(conn.execute("SELECT filename, compressed FROM posts").fetchall())
+    conn.close()
+    assert flags == {"small": 0, "large": 1}
+    assert storage.read("articles", "large") == large + "كلمة_نادرة"
+    assert storage.read("articles", "small") == small
+    assert [r[0] for r in storage.search("articles", "كلمة_نادرة")] == ["large"]
+    assert storage.list_titles("articles") == [("small", "قصير"), ("large", "طويل")]
+
+    plain = cit.SQLitePostStorage(str(tmp_path / "plain.db"), compress=False)
+    plain.write("articles", "large", large)
+    conn = plain._connect()
+    assert conn.execute("SELECT compressed FROM posts").fetchone() == (0,)
+    conn.close()
+
+
+def test_posts_migrate_cli(cit):
+    texts = {("articles", "m1"): "# الأول\nنص", ("projects", "m2"): "# الثاني\n" + "x" * 2000}
+    for (category, filename), text in texts.items():
+        cit.save_post(category, filename, text)
+
+    runner = cit.app.test_cli_runner()
+    result = runner.invoke(args=["posts-migrate", "--to", "sqlite"])
+    assert result.exit_code == 0, result.output
+    assert "✅" in result.output
+    sqlite = cit.post_storage("sqlite")
+    for (category, filename), text in texts.items():
+        assert sqlite.read(category, filename) == text
+
+    # العودة من sqlite إلى fs تكتب فوق الملفات بنفس المحتوى
+    sqlite.write("articles", "only_db", "# من القاعدة\n")
+    result = runner.invoke(args=["posts-migrate", "--to", "fs"])
+    assert result.exit_code == 0, result.output
+    assert cit.post_storage("fs").read("articles", "only_db") == "# من القاعدة\n"
+
+    result = runner.invoke(args=["posts-migrate", "--to", "fs", "--from", "fs"])
+    assert result.exit_code != 0
+    assert "متطابقان" in result.output
@@ -0,0 +1,159 @@
+import glob
+import json
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from conftest import load_app
+
+
+@pytest.fixture(scope="module")
+def cit(tmp_path_factory):
+    module = load_app(tmp_path_factory.mktemp("cit"))
+
+    @module.app.route("/_test/slow")
+    def _test_slow():
+        time.sleep(0.08)
+        return "ok"
+
+    return module
+
+
+@pytest.fixture
+def profiling(cit, monkeypatch):
+    """يضبط الإعدادات ويعيد دالة تحفظها؛ اللقطات تُمسح بعد كل اختبار."""
+    def configure(**settings):
+        cit.save_profile_settings({**cit.PROFILE_DEFAULTS, "enabled": True, **settings})
+
+    yield configure
+    cit.save_profile_settings(dict(cit.PROFILE_DEFAULTS))
+    for path in glob.glob(os.path.join(cit.PROFILE_DIR, "*")):
+        if os.path.basename(path) != "settings.json":
+            os.remove(path)
+
+
+def fixed_random(cit, monkeypatch, value):
+    monkeypatch.setattr(cit.random, "random", lambda: value)
+
+
+def test_sample_rate_threshold(cit, client, profiling, monkeypatch):
+    profiling(sample_rate=0.5)
+    fixed_random(cit, monkeypatch, 0.7)
+    client().get("/about")
+    assert cit.list_profile_captures() == []
+
+    fixed_random(cit, monkeypatch, 0.3)
+    client().get("/about")
+    [capture] = cit.list_profile_captures()
+    assert capture["reason"] == "sampled" and capture["endpoint"] == "about_page"
+    assert capture["status"] == 200 and capture["path"] == "/about"
+    assert "prof" in capture["files"]
+    assert os.path.exists(os.path.join(cit.PROFILE_DIR, f"{capture['id']}.prof"))
+    assert isinstance(capture["tracemalloc_top"], list)
+
+    profiling(sample_rate=0.0)
+    fixed_random(cit, monkeypatch, 0.0)
+    client().get("/about")
+    assert len(cit.list_profile_captures()) == 1
+
+
+def test_disabled_profiler_never_captures(cit, client, profiling, monkeypatch):
+    profiling(enabled=False, sample_rate=1.0, slow_ms=1)
+    client().get("/_test/slow")
+    assert cit.list_profile_captures() == []
+    assert cit._sampler_targets == {}
+
+
+def test_slow_requests_are_captured_with_stack_samples(cit, client, profiling):
+    profiling(slow_ms=50, interval_ms=2)
+    client().get("/about")                                # أسرع من الحد
+    assert cit.list_profile_captures() == []
+
+    client().get("/_test/slow")
+    [capture] = cit.list_profile_captures()
+    assert capture["reason"] == "slow" and capture["duration_ms"] >= 50
+    assert capture["tracemalloc_top"] is None and "prof" not in capture["files"]
+    assert capture["samples"] > 0 and "folded" in capture["files"]
+    with open(os.path.join(cit.PROFILE_DIR, f"{capture['id']}.folded"), encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert any("test_profiler.py:_test_slow" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert cit._sampler_targets == {}
+
+
+def test_tracemalloc_runs_only_while_sampled(cit, client, profiling, monkeypatch):
+    assert not tracemalloc.is_tracing()
+    profiling(sample_rate=1.0)
+    seen = []
+    real_acquire = cit._tracemalloc_acquire
+    monkeypatch.setattr(cit, "_tracemalloc_acquire",
+                        lambda: (real_acquire(), seen.append(tracemalloc.is_tracing()))[0])
+    client().get("/about")
+    assert seen == [True]
+    assert not tracemalloc.is_tracing() and cit._tracemalloc_users == 0
+
+
+def test_tracemalloc_started_elsewhere_is_left_running(cit):
+    tracemalloc.start()
+    try:
+        first = cit._tracemalloc_acquire()
+        second = cit._tracemalloc_acquire()
+        cit._tracemalloc_release(first)
+        cit._tracemalloc_release(second)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+    # وما بدأه المنمّط يوقفه آخر مستخدم فقط
+    first = cit._tracemalloc_acquire()
+    second = cit._tracemalloc_acquire()
+    cit._tracemalloc_release(first)
+    assert tracemalloc.is_tracing()
+    cit._tracemalloc_release(second)
+    assert not tracemalloc.is_tracing()
+
+
+def test_capture_ring_is_trimmed(cit, client, profiling, monkeypatch):
+    monkeypatch.setattr(cit, "PROFILE_MAX_CAPTURES", 2)
+    profiling(sample_rate=1.0)
+    for _ in range(4):
+        client().get("/about")
+        time.sleep(0.002)                                 # معرّفات مرتبة بالميلي ثانية
+    captures = cit.list_profile_captures()
+    assert len(captures) == 2
+    assert len(glob.glob(os.path.join(cit.PROFILE_DIR, "*.prof"))) == 2
+
+
+def test_captures_are_admin_only(cit, client, profiling, monkeypatch):
+    profiling(sample_rate=1.0)
+    client().get("/about")
+    [capture] = cit.list_profile_captures()
+    url = f"/admin/profiles/{capture['id']}.json"
+
+    assert client().get("/admin/profiles").status_code == 302          # تسجيل الدخول أولًا
+    assert client().get(url).status_code == 302
+    writer = client("writer", "ali")
+    assert writer.get("/admin/profiles").status_code == 403
+    assert writer.get(url).status_code == 403
+    assert writer.post("/admin/profiles", data={"enabled": "0"}).status_code == 403
+    assert cit.get_profile_settings()["enabled"] is True
+
+    admin = client("admin")
+    resp = admin.get(url)
+    assert resp.status_code == 200 and "attachment" in resp.headers["Content-Disposition"]
+    assert json.loads(resp.data)["id"] == capture["id"]
+    assert admin.get(f"/admin/profiles/{capture['id']}.py").status_code == 404
+    assert admin.get("/admin/profiles/settings.json").status_code == 404
+    assert capture["id"] in admin.get("/admin/profiles").get_data(as_text=True)
+    # صفحات التنميط نفسها لا تُنمَّط
+    assert len(cit.list_profile_captures()) == 1
+
+
+def test_settings_form_clamps_values(cit, client, profiling):
+    admin = client("admin")
+    admin.post("/admin/profiles", data={"enabled": "1", "sample_rate": "7", "slow_ms": "-5", "interval_ms": "0"})
+    assert cit.get_profile_settings() == {"enabled": True, "sample_rate": 1.0, "slow_ms": 0, "interval_ms": 1}
+    admin.post("/admin/profiles", data={"enabled": "1", "sample_rate": "كثير"})
+    assert cit.get_profile_settings()["sample_rate"] == 1.0            # القيم غير الصالحة لا تُحفظ
@@ -0,0 +1,154 @@
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def limited(cit, monkeypatch):
+    monkeypatch.setitem(cit.app.config, "RATE_LIMIT_ENABLED", True)
+    return cit
+
+
+_ips = iter(range(1, 10_000))
+
+
+def fresh_ip():
+    """كل اختبار من عنوان مختلف فلا تتشارك الدلاء بين الاختبارات."""
+    n = next(_ips)
+    return {"REMOTE_ADDR": f"10.1.{n // 256}.{n % 256}"}
+
+
+# --- جدول الدلاء (mmap) ---
+
+def test_bucket_capacity_and_refill(cit, tmp_path):
+    store = cit.TokenBucketStore(str(tmp_path / "rl.bin"), slots=128)
+    now = 1000.0
+    assert [store.take(42, 3, 1.0, now) for _ in range(3)] == [0, 0, 0]
+    assert store.take(42, 3, 1.0, now) == pytest.approx(1.0)
+    assert store.take(42, 3, 1.0, now + 0.25) == pytest.approx(0.75)
+    assert store.take(42, 3, 1.0, now + 1.25) == 0
+    assert store.take(43, 3, 1.0, now) == 0            # مفتاح آخر دلو آخر
+
+
+def test_state_is_shared_through_the_file(cit, tmp_path):
+    path = str(tmp_path / "rl.bin")
+    first, second = cit.TokenBucketStore(path, slots=128), cit.TokenBucketStore(path, slots=128)
+    assert first.take(7, 1, 0.001, 1000.0) == 0
+    assert second.take(7, 1, 0.001, 1000.0) > 0       # عامل آخر يرى الرمز مستهلكًا
+
+    # بعد fork يُعاد فتح الملف في العملية الجديدة والحالة باقية
+    second._pid = -1
+    assert second.take(7, 1, 0.001, 1000.0) > 0
+
+    # تغيير حجم الجدول يعيد تهيئة الملف بدل قراءة خانات بتخطيط آخر
+    resized = cit.TokenBucketStore(path, slots=256)
+    assert resized.take(7, 1, 0.001, 1000.0) == 0
+
+
+def test_full_probe_path_evicts_the_oldest_slot(cit, tmp_path):
+    store = cit.TokenBucketStore(str(tmp_path / "rl.bin"), slots=128)
+    probes, rate = cit.RATE_LIMIT_PROBES, 1e-9
+    # كل المفاتيح إلى نفس الخانة الأصلية (k * 128 + 5)
+    keys = [k * 128 + 5 for k in range(1, probes + 2)]
+    for i, key in enumerate(keys[:probes]):
+        store.take(key, 1, rate, 1000.0 + i)
+    store.take(keys[probes], 1, rate, 2000.0)     # لا خانة فارغة: يزيح الأقدم (keys[0])
+    assert all(store.take(key, 1, rate, 2000.0) > 0 for key in keys[1:])
+    assert store.take(keys[0], 1, rate, 2000.0) == 0   # نُسي فعاد بدلو ممتلئ
+
+
+def test_stripe_locks_under_threads(cit, tmp_path):
+    store = cit.TokenBucketStore(str(tmp_path / "rl.bin"), slots=128)
+    allowed = []
+
+    def worker():
+        for _ in range(50):
+            if store.take(99, 100, 0.0001, 1000.0) == 0:
+                allowed.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(allowed) == 100
+
+
+# --- الديكوريتر ---
+
+def test_search_returns_429_with_retry_after(limited, client):
+    c, ip = client(), fresh_ip()
+    for _ in range(30):
+        assert c.get("/search?q=x", environ_base=ip).status_code == 200
+    resp = c.get("/search?q=x", environ_base=ip)
+    assert resp.status_code == 429
+    assert resp.headers["Retry-After"] == "1"
+    assert "⏳" in resp.get_data(as_text=True)
+    assert c.get("/search?q=x", environ_base=fresh_ip()).status_code == 200
+
+
+def test_json_clients_get_a_json_429(limited, client, monkeypatch):
+    monkeypatch.setitem(limited.RATE_LIMIT_POLICIES, "api", (1, 0.01, ("ip",), ("GET",)))
+    c, ip = client(), fresh_ip()
+    c.get("/api/v1/categories", environ_base=ip)
+    resp = c.get("/api/v1/categories", environ_base=ip, headers={"Accept": "application/json"})
+    assert resp.status_code == 429
+    assert resp.get_json() == {"error": "rate_limited", "retry_after": 100}
+    assert resp.headers["Retry-After"] == "100"
+
+
+def test_only_listed_methods_are_counted(limited, client, monkeypatch):
+    monkeypatch.setitem(limited.RATE_LIMIT_POLICIES, "login", (1, 0.001, ("ip",), ("POST",)))
+    c, ip = client(), fresh_ip()
+    for _ in range(5):
+        assert c.get("/login", environ_base=ip).status_code != 429
+    assert c.post("/login", data={}, environ_base=ip).status_code != 429
+    assert c.post("/login", data={}, environ_base=ip).status_code == 429
+
+
+def test_comment_limit_follows_the_user_across_ips(limited, client, monkeypatch):
+    monkeypatch.setitem(limited.RATE_LIMIT_POLICIES, "comment", (2, 0.001, ("ip", "user"), ("POST",)))
+    limited.save_post("articles", "limits.md", "# حدود\nنص")
+    ali, sara = client("writer", "ali"), client("writer", "sara")
+    url = "/add_comment/articles/limits.md"
+    assert ali.post(url, data={"comment": "1"}, environ_base=fresh_ip()).status_code != 429
+    assert ali.post(url, data={"comment": "2"}, environ_base=fresh_ip()).status_code != 429
+    assert ali.post(url, data={"comment": "3"}, environ_base=fresh_ip()).status_code == 429
+    assert sara.post(url, data={"comment": "1"}, environ_base=fresh_ip()).status_code != 429
+
+
+def test_limiter_fails_open(limited, client, monkeypatch):
+    def broken(*args):
+        raise limited.SharedStateError("down")
+
+    monkeypatch.setattr(limited.shared_state, "take_token", broken)
+    monkeypatch.setitem(limited.RATE_LIMIT_POLICIES, "search", (1, 0.001, ("ip",), ("GET",)))
+    c, ip = client(), fresh_ip()
+    assert [c.get("/search?q=x", environ_base=ip).status_code for _ in range(3)] == [200, 200, 200]
+
+
+def test_disabled_limiter_never_counts(cit, client, monkeypatch):
+    monkeypatch.setitem(cit.app.config, "RATE_LIMIT_ENABLED", False)
+    monkeypatch.setitem(cit.RATE_LIMIT_POLICIES, "search", (1, 0.001, ("ip",), ("GET",)))
+    c, ip = client(), fresh_ip()
+    assert {c.get("/search?q=x", environ_base=ip).status_code for _ in range(3)} == {200}
+
+
+@pytest.mark.parametrize("policy, method, path, data", [
+    ("register", "post", "/register_user", {}),
+    ("login", "post", "/login", {}),
+    ("forgot_password", "post", "/forgot", {}),
+    ("comment", "post", "/add_comment/articles/limits.md", {"comment": "x"}),
+    ("suggest", "get", "/search/suggest?q=ab", None),
+    ("api", "get", "/api/v1/categories", None),
+    ("api", "get", "/api/v1/comments/counts?post=articles/limits.md", None),
+    ("search", "get", "/api/v1/search?q=ab", None),
+    ("view", "post", "/post/articles/limits.md/view", {}),
+])
+def test_each_decorated_route_is_limited(limited, client, monkeypatch, policy, method, path, data):
+    _capacity, _rate, kinds, methods = limited.RATE_LIMIT_POLICIES[policy]
+    monkeypatch.setitem(limited.RATE_LIMIT_POLICIES, policy, (2, 0.001, kinds, methods))
+    c, ip = client("writer", "limits-" + policy), fresh_ip()
+    send = getattr(c, method)
+    kwargs = {"environ_base": ip} if data is None else {"environ_base": ip, "data": data}
+    assert [send(path, **kwargs).status_code == 429 for _ in range(3)] == [False, False, True]
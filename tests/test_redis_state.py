@@ -0,0 +1,315 @@
+"""
+RedisSharedState ضد خادم RESP صغير داخل العملية: الأوامر التي يستعملها التطبيق فقط،
+وسكربتات Lua الخاصة به منفّذة بلغة بايثون (الخادم يعرفها من نصّها).
+"""
+import hashlib
+import math
+import socketserver
+import threading
+
+import pytest
+
+
+class StubRedis:
+    def __init__(self, cit):
+        self.data = {}
+        self.scripts = {}          # sha -> دالة بايثون (ما حمّله EVAL)
+        self.batches = []          # الأوامر التي وصلت في قراءة واحدة
+        self.lock = threading.Lock()
+        self.emulations = {
+            cit._REDIS_BUMP_SCRIPT: self._bump,
+            cit._REDIS_TOKEN_SCRIPT: self._token,
+            cit._REDIS_VIEWS_SCRIPT: self._views,
+            cit._REDIS_MERGE_VIEWS_SCRIPT: self._merge_views,
+            cit._REDIS_UNLOCK_SCRIPT: self._unlock,
+        }
+
+    # --- أنواع البيانات ---
+    def zset(self, key):
+        return self.data.setdefault(key, {})
+
+    def zincrby(self, key, amount, member):
+        board = self.zset(key)
+        board[member] = board.get(member, 0.0) + float(amount)
+        return board[member]
+
+    # --- السكربتات ---
+    def _bump(self, keys, args):
+        seq = int(self.data.get(keys[0], b"0")) + 1
+        self.data[keys[0]] = str(seq).encode()
+        for member in args:
+            self.zset(keys[1])[member] = float(seq)
+        return seq
+
+    def _token(self, keys, args):
+        capacity, rate, now = float(args[0]), float(args[1]), float(args[2])
+        state = self.data.get(keys[0]) or {}
+        tokens, last = state.get("t"), state.get("l")
+        if tokens is None or last is None:
+            tokens, last = capacity, now
+        tokens = min(capacity, tokens + max(now - last, 0) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self.data[keys[0]] = {"t": tokens, "l": now}
+        return repr(wait).encode()
+
+    def _views(self, keys, args):
+        prefix, now, lam, limit = args[0].decode(), float(args[1]), float(args[2]), float(args[3])
+        boards = self.data.setdefault(keys[1], set())
+        epoch = float(self.data[keys[0]]) if keys[0] in self.data else None
+        exponent = lam * (now - epoch) if epoch is not None else 0.0
+        if epoch is None or exponent > limit:
+            if epoch is not None:
+                for board in boards:
+                    self.data[board] = {m: s * math.exp(-exponent) for m, s in self.zset(board).items()}
+            self.data[keys[0]] = args[1]
+            exponent = 0.0
+        weight = math.exp(exponent)
+        boards.add((prefix + "trend:*").encode())
+        for i in range(4, len(args), 3):
+            category, filename, n = args[i].decode(), args[i + 1].decode(), float(args[i + 2])
+            member = f"{category}/{filename}".encode()
+            self.zincrby((prefix + "views:*").encode(), n, member)
+            self.zincrby((prefix + "views:c:" + category).encode(), n, filename.encode())
+            self.zincrby((prefix + "trend:*").encode(), n * weight, member)
+            self.zincrby((prefix + "trend:c:" + category).encode(), n * weight, filename.encode())
+            boards.add((prefix + "trend:c:" + category).encode())
+        return 1
+
+    def _merge_views(self, keys, args):
+        prefix, source_epoch, lam = args[0].decode(), float(args[1]), float(args[2])
+        if args[3] != b"1" and keys[2] in self.data:
+            return 0
+        if keys[0] not in self.data:
+            self.data[keys[0]] = args[1]
+        factor = math.exp(lam * (source_epoch - float(self.data[keys[0]])))
+        boards = self.data.setdefault(keys[1], set())
+        boards.add((prefix + "trend:*").encode())
+        for i in range(4, len(args), 4):
+            category, filename = args[i].decode(), args[i + 1].decode()
+            views, trend = float(args[i + 2]), float(args[i + 3]) * factor
+            member = f"{category}/{filename}".encode()
+            self.zincrby((prefix + "views:*").encode(), views, member)
+            self.zincrby((prefix + "views:c:" + category).encode(), views, filename.encode())
+            self.zincrby((prefix + "trend:*").encode(), trend, member)
+            self.zincrby((prefix + "trend:c:" + category).encode(), trend, filename.encode())
+            boards.add((prefix + "trend:c:" + category).encode())
+        self.data[keys[2]] = args[1]
+        return 1
+
+    def _unlock(self, keys, args):
+        if self.data.get(keys[0]) == args[0]:
+            del self.data[keys[0]]
+            return 1
+        return 0
+
+    # --- الأوامر ---
+    @staticmethod
+    def _score(value):
+        return repr(value).removesuffix(".0").encode()
+
+    def _range(self, key, start, stop, reverse, withscores):
+        items = sorted(self.zset(key).items(), key=lambda kv: (kv[1], kv[0]), reverse=reverse)
+        stop = len(items) if stop == -1 else stop + 1
+        flat = []
+        for member, score in items[start:stop]:
+            flat.append(member)
+            if withscores:
+                flat.append(self._score(score))
+        return flat
+
+    def command(self, name, args):
+        data = self.data
+        if name in ("AUTH", "SELECT"):
+            return "+OK"
+        if name == "GET":
+            return data.get(args[0])
+        if name == "SET":
+            options = [a.upper() for a in args[2:]]
+            if b"NX" in options and args[0] in data:
+                return None
+            data[args[0]] = args[1]
+            return "+OK"
+        if name == "ZSCORE":
+            score = self.zset(args[0]).get(args[1])
+            return None if score is None else self._score(score)
+        if name in ("ZRANGE", "ZREVRANGE"):
+            withscores = len(args) > 3 and args[3].upper() == b"WITHSCORES"
+            return self._range(args[0], int(args[1]), int(args[2]), name == "ZREVRANGE", withscores)
+        if name == "ZRANGEBYSCORE":
+            low = float(args[1].lstrip(b"("))
+            return [m for m, s in sorted(self.zset(args[0]).items(), key=lambda kv: kv[1]) if s > low]
+        if name == "ZREM":
+            return 1 if self.zset(args[0]).pop(args[1], None) is not None else 0
+        if name in ("EVAL", "EVALSHA"):
+            if name == "EVAL":
+                sha = hashlib.sha1(args[0]).hexdigest()
+                self.scripts[sha] = self.emulations[args[0].decode()]
+            else:
+                sha = args[0].decode()
+            if sha not in self.scripts:
+                return ValueError("NOSCRIPT No matching script. Please use EVAL.")
+            numkeys = int(args[1])
+            return self.scripts[sha](args[2:2 + numkeys], args[2 + numkeys:])
+        return ValueError(f"ERR unknown command '{name}'")
+
+    @staticmethod
+    def encode(reply):
+        if isinstance(reply, ValueError):
+            return b"-%s\r\n" % str(reply).encode()
+        if isinstance(reply, str):
+            return reply.encode() + b"\r\n"
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, list):
+            return b"*%d\r\n" % len(reply) + b"".join(StubRedis.encode(r) for r in reply)
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+def _parse(buffer):
+    """أوامر RESP كاملة من بداية buffer -> (الأوامر، البقية)."""
+    commands = []
+    while buffer.startswith(b"*") and b"\r\n" in buffer:
+        pos = buffer.index(b"\r\n")
+        count, pos, parts = int(buffer[1:pos]), pos + 2, []
+        for _ in range(count):
+            end = buffer.find(b"\r\n", pos)
+            if end < 0:
+                return commands, buffer
+            size = int(buffer[pos + 1:end])
+            if len(buffer) < end + 2 + size + 2:
+                return commands, buffer
+            parts.append(buffer[end + 2:end + 2 + size])
+            pos = end + 2 + size + 2
+        if len(parts) < count:
+            return commands, buffer
+        commands.append(parts)
+        buffer = buffer[pos:]
+    return commands, buffer
+
+
+@pytest.fixture
+def stub(cit):
+    state = StubRedis(cit)
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            buffer = b""
+            while True:
+                chunk = self.request.recv(65536)
+                if not chunk:
+                    return
+                commands, buffer = _parse(buffer + chunk)
+                if not commands:
+                    continue
+                with state.lock:
+                    state.batches.append([c[0].decode().upper() for c in commands])
+                    replies = [state.command(c[0].decode().upper(), c[1:]) for c in commands]
+                self.request.sendall(b"".join(state.encode(r) for r in replies))
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    state.url = f"redis://:secret@127.0.0.1:{server.server_address[1]}/2"
+    yield state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def redis_state(cit, stub):
+    return cit.RedisSharedState(stub.url, prefix="t:")
+
+
+def test_connection_setup_and_pipelining(redis_state, stub):
+    client = redis_state.client
+    assert client.pipeline([("SET", "t:a", "1"), ("SET", "t:b", "2"), ("GET", "t:a"), ("GET", "t:missing")]) \
+        == [b"OK", b"OK", b"1", None]
+    # AUTH + SELECT في رحلة، والأوامر الأربعة في رحلة واحدة
+    assert stub.batches == [["AUTH", "SELECT"], ["SET", "SET", "GET", "GET"]]
+    client.execute("GET", "t:a")
+    assert len(client._idle) == 1 and stub.batches[-1] == ["GET"]   # الاتصال أُعيد استعماله
+
+
+def test_error_reply_raises(cit, redis_state):
+    with pytest.raises(cit.SharedStateError) as info:
+        redis_state.client.execute("FLUSHEVERYTHING")
+    assert "unknown command" in str(info.value)
+
+
+def test_evalsha_falls_back_to_eval_after_noscript(cit, redis_state, stub):
+    assert redis_state.bump_versions([("posts", "news")]) == 1
+    assert redis_state.bump_versions([("tags", "*")]) == 2
+    assert [b[0] for b in stub.batches[1:]] == ["EVAL", "EVALSHA"]
+
+    stub.scripts.clear()    # كأن الخادم أُعيد تشغيله
+    assert redis_state.bump_versions([("posts", "")]) == 3
+    assert [b[0] for b in stub.batches[-2:]] == ["EVALSHA", "EVAL"]
+    assert redis_state.versions_since(1) == (3, [("tags", "*"), ("posts", "")])
+    assert stub.batches[-1] == ["GET", "ZRANGEBYSCORE"]
+    assert redis_state.versions_since(3) == (3, [])
+
+
+def test_token_bucket(redis_state):
+    now = 1000.0
+    assert [redis_state.take_token(0xABC, 2, 1.0, now) for _ in range(2)] == [0, 0]
+    assert redis_state.take_token(0xABC, 2, 1.0, now) == pytest.approx(1.0)
+    assert redis_state.take_token(0xABC, 2, 1.0, now + 0.5) == pytest.approx(0.5)
+    assert redis_state.take_token(0xABC, 2, 1.0, now + 1.5) == 0
+    assert redis_state.take_token(0xDEF, 2, 1.0, now) == 0    # مفتاح آخر دلو آخر
+
+
+def test_view_and_trending_boards(cit, redis_state):
+    now = cit.time.time()
+    redis_state.add_views({("news", "a.md"): 3, ("news", "b.md"): 1, ("tech", "c.md"): 2}, now)
+    redis_state.add_views({("news", "b.md"): 4}, now)
+
+    assert redis_state.get_views("news", "b.md") == 5
+    assert redis_state.get_views("news", "zzz.md") == 0
+    assert redis_state.all_views() == {("news", "a.md"): 3, ("news", "b.md"): 5, ("tech", "c.md"): 2}
+    assert redis_state.top_posts("views", None, 2) == [("news", "b.md", 5, 5), ("news", "a.md", 3, 3)]
+    assert [row[:3] for row in redis_state.top_posts("views", "tech", 5)] == [("tech", "c.md", 2)]
+
+    trending = redis_state.top_posts("trending", "news", 5)
+    assert [(c, f, v) for c, f, v, _s in trending] == [("news", "b.md", 5), ("news", "a.md", 3)]
+    assert trending[0][3] == pytest.approx(5, rel=1e-3)
+
+    redis_state.remove_posts([("news", "b.md")])
+    assert redis_state.get_views("news", "b.md") == 0
+    assert [row[1] for row in redis_state.top_posts("trending", None, 5)] == ["a.md", "c.md"]
+
+
+def test_try_lock(redis_state, stub):
+    with redis_state.try_lock("sitemap", 30) as first:
+        assert first
+        with redis_state.try_lock("sitemap", 30) as second:
+            assert not second
+        assert b"t:lock:sitemap" in stub.data     # المحاولة الفاشلة لا تحذف قفل غيرها
+    assert b"t:lock:sitemap" not in stub.data
+    with redis_state.try_lock("sitemap", 30) as again:
+        assert again
+
+
+def test_shared_state_migrate_copies_local_views(cit, redis_state, monkeypatch):
+    local = cit.LocalSharedState(cit.SHARED_CACHE_DIR)
+    local.add_views({("news", "old.md"): 7, ("tech", "x.md"): 2}, cit.time.time() - 3600)
+    monkeypatch.setattr(cit, "shared_state", redis_state)
+    runner = cit.app.test_cli_runner()
+
+    result = runner.invoke(args=["shared-state-migrate"])
+    assert result.exit_code == 0, result.output
+    assert redis_state.get_views("news", "old.md") == 7
+    top = redis_state.top_posts("trending", None, 5)
+    assert [row[:3] for row in top] == [("news", "old.md", 7), ("tech", "x.md", 2)]
+    assert top[0][3] == pytest.approx(7 * 0.5 ** (1 / cit.TREND_HALF_LIFE_HOURS), rel=1e-3)
+
+    # مرة ثانية لا تضاعف الأرقام إلا مع --force
+    assert runner.invoke(args=["shared-state-migrate"]).exit_code != 0
+    assert redis_state.get_views("news", "old.md") == 7
+    assert runner.invoke(args=["shared-state-migrate", "--force"]).exit_code == 0
+    assert redis_state.get_views("news", "old.md") == 14
@@ -0,0 +1,88 @@
+import hashlib
+import random
+
+import pytest
+
+
+def _texts(count, seed=7):
+    """نسخ متتالية بتعديلات عشوائية: إضافة وحذف واستبدال أسطر وكلمات (عربي وإنجليزي ورموز)."""
+    rng = random.Random(seed)
+    words = ["مقال", "النص", "flask", "كود", "😀", "  ", "\t", "سطر", "data", "<b>x</b>"]
+    lines = [" ".join(rng.choice(words) for _ in range(6)) for _ in range(20)]
+    texts = []
+    for _ in range(count):
+        op = rng.randrange(3)
+        i = rng.randrange(len(lines))
+        if op == 0:
+            lines.insert(i, " ".join(rng.choice(words) for _ in range(rng.randrange(1, 8))))
+        elif op == 1 and len(lines) > 3:
+            del lines[i]
+        else:
+            lines[i] = lines[i].replace(rng.choice(words), rng.choice(words), 1) + rng.choice(words)
+        texts.append("# عنوان\n" + "\n".join(lines) + ("\n" if rng.random() < 0.5 else ""))
+    return texts
+
+
+def _rows(cit, category, filename):
+    conn = cit.db_connect(cit.REVISIONS_DB_PATH)
+    rows = conn.execute("""
+        SELECT rev, kind, checksum, size FROM post_revisions
+        WHERE category = ? AND filename = ? ORDER BY rev
+    """, (category, filename)).fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.mark.parametrize("old, new", [
+    ("", "نص جديد"),
+    ("سطر أول\nسطر ثاني", ""),
+    ("a b  c\t d", "a  b c\td e"),
+    ("😀 مرحبا بالعالم", "مرحبا 😀 بالعالم!"),
+    ("same", "same"),
+])
+def test_delta_round_trip(cit, old, new):
+    assert cit._apply_delta(old, cit._make_delta(old, new)) == new
+
+
+def test_snapshot_every_n_revisions(cit):
+    texts = _texts(25)
+    for text in texts:
+        cit.record_revision("articles", "cadence.md", text)
+    kinds = {rev: kind for rev, kind, _c, _s in _rows(cit, "articles", "cadence.md")}
+    every = cit.REVISION_SNAPSHOT_EVERY
+    assert [rev for rev, kind in kinds.items() if kind == "snapshot"] == list(range(1, 26, every))
+    for rev, text in enumerate(texts, start=1):
+        assert cit.get_revision_text("articles", "cadence.md", rev) == text
+
+
+def test_pruning_keeps_every_revision_rebuildable(cit):
+    keep = cit.REVISION_MAX_PER_POST
+    texts = _texts(keep + 23)
+    for n, text in enumerate(texts, start=1):
+        assert cit.record_revision("articles", "pruned.md", text, author="admin") == n
+        if n > keep:
+            # أقدم نسخة باقية كانت دلتا قبل التقليم وصارت لقطة
+            oldest = n - keep + 1
+            assert cit.get_revision_text("articles", "pruned.md", oldest) == texts[oldest - 1]
+
+    rows = _rows(cit, "articles", "pruned.md")
+    assert [r[0] for r in rows] == list(range(len(texts) - keep + 1, len(texts) + 1))
+    assert rows[0][1] == "snapshot"
+    for rev, _kind, checksum, size in rows:
+        text = cit.get_revision_text("articles", "pruned.md", rev)
+        assert text == texts[rev - 1]
+        assert checksum == hashlib.sha1(text.encode("utf-8")).hexdigest()
+        assert size == len(text)
+    assert cit.get_revision_text("articles", "pruned.md", 1) is None
+
+
+def test_identical_save_is_skipped(cit):
+    assert cit.record_revision("articles", "same.md", "# نص\nواحد") == 1
+    assert cit.record_revision("articles", "same.md", "# نص\nواحد") == 1
+    assert cit.record_revision("articles", "same.md", "# نص\nاثنان") == 2
+    assert cit.record_revision("articles", "same.md", "# نص\nاثنان") == 2
+    assert len(_rows(cit, "articles", "same.md")) == 2
+
+    cit.save_post("articles", "saved.md", "# مقال\nنص")
+    cit.save_post("articles", "saved.md", "# مقال\nنص")
+    assert [r["rev"] for r in cit.list_revisions("articles", "saved.md")] == [1]
@@ -0,0 +1,69 @@
+import pytest
+
+
+@pytest.mark.parametrize("href", [
+    "javascript:alert(1)",
+    " JavaScript:alert(1)",
+    "&#106;avascript:alert(1)",
+    "&#x6A;avascript&#58;alert(1)",
+    "java&#9;script:alert(1)",
+    "data:text/html;base64,PHNjcmlwdD4=",
+    "vbscript:msgbox(1)",
+])
+def test_unsafe_hrefs_are_dropped(cit, href):
+    out = cit.sanitize_html(f'<a href="{href}">x</a>')
+    assert out == '<a rel="nofollow noopener">x</a>'
+
+
+@pytest.mark.parametrize("href", ["https://example.com/a?b=1", "mailto:a@b.c", "/post/x", "#sec", "../img.png",
+                                  "page.html"])
+def test_safe_hrefs_are_kept(cit, href):
+    assert f'href="{href}"' in cit.sanitize_html(f'<a href="{href}">x</a>')
+
+
+def test_event_handlers_and_unknown_attributes_are_dropped(cit):
+    out = cit.sanitize_html('<img src="/a.png" onerror="alert(1)" alt="صورة"><p onclick="x()">نص</p>')
+    assert out == '<img src="/a.png" alt="صورة"><p>نص</p>'
+    assert cit.sanitize_html('<img src="javascript:alert(1)">') == "<img>"
+
+
+def test_script_and_style_content_is_removed(cit):
+    out = cit.sanitize_html("<p>قبل</p><script>alert('x')</script><style>p{color:red}</style>"
+                            "<iframe src='//evil'>fallback</iframe><p>بعد</p>")
+    assert out == "<p>قبل</p><p>بعد</p>"
+    assert cit.sanitize_html("<svg><script>alert(1)</script></svg>ok") == "ok"
+
+
+def test_text_is_escaped(cit):
+    assert cit.sanitize_html("<p>1 &lt; 2 &amp; <b>3</b></p>") == "<p>1 &lt; 2 &amp; <b>3</b></p>"
+    assert cit.sanitize_html('<p title="x">"<x>"</p>') == '<p>""</p>'
+
+
+@pytest.mark.parametrize("style, kept", [
+    ("text-align: center", True),
+    ("TEXT-ALIGN:right;", True),
+    ("color: red", False),
+    ("text-align: center; background: url(javascript:alert(1))", False),
+    ("expression(alert(1))", False),
+])
+def test_only_text_align_styles_survive(cit, style, kept):
+    out = cit.sanitize_html(f'<table><tr><td style="{style}">x</td></tr></table>')
+    assert ("style=" in out) is kept
+
+
+def test_links_get_a_fixed_rel(cit):
+    out = cit.sanitize_html('<a href="https://x.y" rel="opener" target="_blank">x</a>')
+    assert out == '<a href="https://x.y" rel="nofollow noopener">x</a>'
+
+
+def test_render_markdown_sanitizes_raw_html(cit):
+    if cit.markdown_lib is None:
+        pytest.skip("Markdown غير مثبتة")
+    out = cit.render_markdown("# عنوان\n\n[اضغط](javascript:alert(1))\n\n<script>alert(1)</script>")
+    assert "<script" not in out and "javascript:" not in out
+    assert 'id="عنوان"' in out
+
+
+def test_render_markdown_without_library_shows_escaped_text(cit, monkeypatch):
+    monkeypatch.setattr(cit, "markdown_lib", None)
+    assert cit.render_markdown("<b>x</b>") == '<pre class="markdown-raw">&lt;b&gt;x&lt;/b&gt;</pre>'
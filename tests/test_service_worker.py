@@ -0,0 +1,72 @@
+import json
+import os
+import re
+
+from conftest import load_app
+
+
+def manifest(c):
+    resp = c.get("/sw.js")
+    assert resp.status_code == 200
+    return json.loads(re.search(r"const MANIFEST = (.*);", resp.get_data(as_text=True)).group(1))
+
+
+def test_sw_is_served_uncached_from_the_root(cit, client):
+    resp = client().get("/sw.js")
+    assert resp.mimetype == "text/javascript"
+    assert resp.cache_control.no_cache
+    assert "max-age" not in resp.headers.get("Cache-Control", "")
+    data = manifest(client())
+    assert data["offline"] == "/offline"
+    assert "/sw.js" in data["bypass"] and "/api/" in data["bypass"]
+    assert client().get("/offline").status_code == 200
+
+
+def test_version_changes_with_a_static_asset(cit, client):
+    c = client()
+    before = manifest(c)
+    assert manifest(c) == before                       # ثابت ما دامت الملفات لم تتغير
+
+    css = os.path.join(cit.app.static_folder, "styles.css")
+    with open(css, "a", encoding="utf-8") as f:
+        f.write("\n/* تعديل */\n")
+    after = manifest(c)
+    assert after["version"] != before["version"]
+    [old_css] = [url for url in before["precache"] if "styles.css" in url]
+    [new_css] = [url for url in after["precache"] if "styles.css" in url]
+    assert old_css != new_css
+    assert re.search(r"\?v=[0-9a-f]{12}$", new_css)
+
+
+def test_version_changes_with_a_shell_template(cit, client):
+    c = client()
+    before = manifest(c)["version"]
+    path = os.path.join(cit.app.root_path, cit.app.template_folder, "offline.html")
+    assert path.startswith(os.path.dirname(cit.__file__))
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n{# تعديل #}\n")
+    assert manifest(c)["version"] != before
+
+
+def test_pages_link_assets_with_their_hash(cit, client):
+    body = client().get("/offline").get_data(as_text=True)
+    digest = cit.file_hash(os.path.join(cit.app.static_folder, "styles.css"))
+    assert f"styles.css?v={digest}" in body
+
+
+def test_personal_pages_are_marked(cit, client):
+    assert "X-Cit-Personal" not in client().get("/offline").headers
+    assert client("writer", "ali").get("/offline").headers["X-Cit-Personal"] == "1"
+
+
+def test_manifest_does_not_depend_on_the_working_directory(cit, client, tmp_path, monkeypatch):
+    before = manifest(client())
+    monkeypatch.chdir(tmp_path)
+    assert manifest(client()) == before
+
+
+def test_disabled_worker_unregisters_itself(tmp_path):
+    off = load_app(tmp_path, CIT_SERVICE_WORKER="0")
+    body = off.app.test_client().get("/sw.js").get_data(as_text=True)
+    assert "unregister()" in body
+    assert 'addEventListener("fetch"' not in body
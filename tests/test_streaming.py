@@ -0,0 +1,79 @@
+import json
+import os
+
+
+def _progress_results(progress, count):
+    def iter_search_results(query):
+        for i in range(count):
+            progress.append(i)
+            yield {"category": "articles", "filename": f"p{i}", "title": f"{query} {i}", "snippet": "x" * 200}
+    return iter_search_results
+
+
+def test_search_sends_head_before_scanning(cit, client, monkeypatch):
+    progress = []
+    monkeypatch.setattr(cit, "iter_search_results", _progress_results(progress, 2000))
+
+    resp = client().get("/search?q=flask", buffered=False)
+    chunks = iter(resp.response)
+    first = next(chunks)
+    assert b"</head>" in first
+    assert len(progress) < 2000
+
+    body = first + b"".join(chunks)
+    resp.close()
+    assert len(progress) == 2000
+    assert body.count(b"<li style") == 2000
+
+
+def test_admin_posts_streams_rows(cit, client, monkeypatch):
+    progress = []
+
+    def iter_all_posts_with_category():
+        for i in range(1000):
+            progress.append(i)
+            yield {"category_folder": "articles", "category_name": "a", "category_slug": "articles",
+                   "filename": f"p{i}", "title": f"t{i}", "status": "published", "publish_at": None}
+
+    monkeypatch.setattr(cit, "iter_all_posts_with_category", iter_all_posts_with_category)
+    resp = client("admin").get("/admin/posts", buffered=False)
+    chunks = iter(resp.response)
+    next(chunks)
+    assert len(progress) < 1000
+    b"".join(chunks)
+    resp.close()
+    assert len(progress) == 1000
+
+
+def test_metrics_and_profiler_cover_the_streamed_body(cit, client, monkeypatch):
+    observed, progress = [], []
+    monkeypatch.setitem(cit.app.config, "METRICS_ENABLED", True)
+    monkeypatch.setattr(cit, "_observe", lambda name, labels, value: observed.append((name, dict(labels), value)))
+    monkeypatch.setattr(cit, "get_profile_settings",
+                        lambda: {"enabled": True, "sample_rate": 1.0, "slow_ms": 0, "interval_ms": 5})
+    monkeypatch.setattr(cit, "iter_search_results", _progress_results(progress, 500))
+
+    resp = client("admin").get("/search?q=flask", buffered=False)
+    assert "headers;dur=" in resp.headers["Server-Timing"]
+    assert not [o for o in observed if o[0] == "cit_request_duration_seconds"]
+
+    b"".join(resp.response)
+    resp.close()
+    assert len(progress) == 500
+    [(_name, labels, _value)] = [o for o in observed if o[0] == "cit_request_duration_seconds"]
+    assert labels == {"endpoint": "search"}
+    assert any(o[0] == "cit_phase_duration_seconds" and o[1]["phase"] == "template" for o in observed)
+
+    captures = [name for name in os.listdir(cit.PROFILE_DIR) if name.endswith(".json") and name != "settings.json"]
+    assert captures
+    with open(os.path.join(cit.PROFILE_DIR, sorted(captures)[-1]), encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["endpoint"] == "search" and meta["reason"] == "sampled" and "prof" in meta["files"]
+
+
+def test_flash_is_consumed_once(cit, client):
+    admin = client("admin")
+    with admin.session_transaction() as sess:
+        sess["_flashes"] = [("success", "FLASH-ONCE")]
+    assert b"FLASH-ONCE" in admin.get("/admin/posts").data
+    assert b"FLASH-ONCE" not in admin.get("/admin/posts").data
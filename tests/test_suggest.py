@@ -0,0 +1,109 @@
+import random
+
+import pytest
+
+
+def subtree_ids(node):
+    ids = set(node.ids)
+    for child in node.children.values():
+        ids |= subtree_ids(child)
+    return ids
+
+
+def assert_top_k_everywhere(index, node=None, prefix=""):
+    """كل عقدة تحفظ أفضل K فعلًا من كل ما تحتها، ولا عقد فارغة متروكة."""
+    node = node or index.root
+    expected = sorted(subtree_ids(node), key=index._rank)[:index.TOP_K]
+    assert node.top == expected, prefix
+    for ch, child in node.children.items():
+        assert child.ids or child.children, prefix + ch
+        assert_top_k_everywhere(index, child, prefix + ch)
+
+
+@pytest.mark.parametrize("raw, folded", [
+    ("أَحْمَدُ", "احمد"),
+    ("إسلام آمن ٱلوصل", "اسلام امن الوصل"),
+    ("مدرسة مستشفى مؤتمر قائمة", "مدرسه مستشفي موتمر قايمه"),
+    ("العـــربية", "العربيه"),
+    ("  Flask،  و Python!! ", "flask و python"),
+    ("", ""),
+    (None, ""),
+])
+def test_normalize_ar(cit, raw, folded):
+    assert cit.normalize_ar(raw) == folded
+
+
+def test_query_folds_arabic_forms(cit):
+    index = cit.SuggestIndex()
+    index.upsert(("post", "a", "1"), "مقدّمة في الإدارة", type="post")
+    for prefix in ("مقدمة", "مُقَدِّمه", "الادارة", "الإدارة", "في الا"):
+        assert [e["title"] for e in index.query(prefix)] == ["مقدّمة في الإدارة"], prefix
+    assert index.query("ادارة") == []    # البادئة من أول كلمة لا من وسطها
+    assert [e["title"] for e in index.match("ادارة")] == ["مقدّمة في الإدارة"]
+
+
+def test_top_k_per_node_under_random_updates(cit):
+    index = cit.SuggestIndex()
+    rng = random.Random(7)
+    words = ["برمجة", "بايثون", "برنامج", "بحث", "تعلم", "تطبيق", "بيانات"]
+    live = set()
+    for step in range(400):
+        entry_id = ("post", "c", str(rng.randrange(40)))
+        if entry_id in live and rng.random() < 0.3:
+            index.remove(entry_id)
+            live.discard(entry_id)
+        else:
+            title = " ".join(rng.sample(words, 2)) + f" {entry_id[2]}"
+            index.upsert(entry_id, title, rng.randrange(5), type="post")
+            live.add(entry_id)
+        if step % 50 == 0:
+            assert_top_k_everywhere(index)
+    assert_top_k_everywhere(index)
+    assert set(index.entries) == live
+
+
+def test_query_returns_heaviest_first(cit):
+    index = cit.SuggestIndex()
+    for i in range(12):
+        index.upsert(("post", "c", str(i)), f"برمجة {i:02d}", i, type="post")
+    index.upsert(("category", "prog"), "برمجيات", float("inf"), type="category")
+    titles = [e["title"] for e in index.query("برمج", 20)]
+    assert len(titles) == index.TOP_K
+    assert titles == ["برمجيات"] + [f"برمجة {i:02d}" for i in range(11, 4, -1)]
+
+    # رفع الوزن يعيد الترتيب، وحذف الأثقل يُظهر التالي من تحت العقدة
+    index.upsert(("post", "c", "0"), "برمجة 00", 100, type="post")
+    assert [e["title"] for e in index.query("برمجة", 2)] == ["برمجة 00", "برمجة 11"]
+    index.remove(("post", "c", "0"))
+    assert [e["title"] for e in index.query("برمجة", 2)] == ["برمجة 11", "برمجة 10"]
+    assert_top_k_everywhere(index)
+
+
+def test_removal_prunes_the_path(cit):
+    index = cit.SuggestIndex()
+    index.upsert(("post", "c", "x"), "فريد جدا", type="post")
+    index.remove(("post", "c", "x"))
+    index.remove(("post", "c", "x"))     # حذف غير الموجود لا يفعل شيئًا
+    assert index.root.children == {} and index.root.top == []
+    assert index.query("فريد") == []
+
+
+def suggestions(client, q):
+    return [s["title"] for s in client.get("/search/suggest", query_string={"q": q}).get_json()["suggestions"]]
+
+
+def test_index_follows_post_saves_and_deletes(cit, client):
+    c = client()
+    cit.save_post("articles", "rename.md", "# عنوان قديم مميز\nنص")
+    assert suggestions(c, "عنوان قديم") == ["عنوان قديم مميز"]
+
+    cit.save_post("articles", "rename.md", "# عنوان جديد مميز\nنص")
+    assert suggestions(c, "عنوان قديم") == []
+    assert suggestions(c, "عنوان جديد") == ["عنوان جديد مميز"]
+
+    cit.save_post("articles", "hidden.md", "# عنوان مسودة مميز\nنص", status="draft")
+    assert suggestions(c, "عنوان مسودة") == []
+
+    cit.delete_posts([("articles", "rename.md")])
+    assert suggestions(c, "عنوان جديد") == []
+    assert ("post", "articles", "rename.md") not in cit._suggest_index.entries
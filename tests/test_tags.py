@@ -0,0 +1,79 @@
+import pytest
+
+
+def counts(cit):
+    return {tag["name"]: tag["count"] for tag in cit.popular_tags()}
+
+
+def submit(c, filename, tags, **extra):
+    return c.post("/submit", data=dict({"title": filename, "filename": filename, "content": "<p>نص</p>",
+                                        "category": "articles", "tags": tags}, **extra))
+
+
+def edit(c, filename, tags):
+    return c.post(f"/admin/posts/edit/articles/{filename}",
+                  data={"title": filename, "content": "<p>نص معدل</p>", "tags": tags})
+
+
+@pytest.mark.parametrize("raw, tags", [
+    ("Python، Flask, #ويب", ["python", "flask", "ويب"]),
+    ("machine learning; C++ ;\n.net", ["machine-learning", "c++", "net"]),
+    ("python, PYTHON, #python", ["python"]),
+    (" , ،", []),
+    (",".join(f"t{i}" for i in range(15)), [f"t{i}" for i in range(10)]),
+])
+def test_parse_tags(cit, raw, tags):
+    assert cit.parse_tags(raw) == tags
+
+
+def test_tags_follow_new_edited_and_deleted_posts(cit, client):
+    c = client("admin")
+    submit(c, "t1", "python, flask")
+    submit(c, "t2", "python، ويب")
+    assert cit.get_post_tags("articles", "t1") == ["flask", "python"]
+    assert counts(cit) == {"python": 2, "flask": 1, "ويب": 1}
+    assert list(counts(cit))[0] == "python"
+    assert cit.posts_with_tags(["python", "flask"]) == {("articles", "t1")}
+
+    # إعادة التسمية: flask -> django (الوسم الذي لم يعد له مقال يُحذف)
+    edit(c, "t1", "python, django")
+    assert cit.get_post_tags("articles", "t1") == ["django", "python"]
+    assert counts(cit) == {"python": 2, "django": 1, "ويب": 1}
+    assert cit.posts_with_tags(["flask"]) == set()
+    assert cit.posts_with_tags(["django"]) == {("articles", "t1")}
+    assert "t1" not in c.get("/tag/flask").get_data(as_text=True)
+    assert "t1" in c.get("/tag/django").get_data(as_text=True)
+
+    # إزالة كل الوسوم
+    edit(c, "t1", "")
+    assert cit.get_post_tags("articles", "t1") == []
+    assert counts(cit) == {"python": 1, "ويب": 1}
+    assert cit.posts_with_tags(["python"]) == {("articles", "t2")}
+
+    # الحذف ينزع الوسوم ويبطل الكاش
+    cit.delete_posts([("articles", "t2")])
+    assert counts(cit) == {}
+    assert cit.tags_for_posts([("articles", "t1"), ("articles", "t2")]) == {
+        ("articles", "t1"): [], ("articles", "t2"): []}
+    assert cit.posts_with_tags(["python"]) == set()
+
+
+def test_tags_for_posts_in_one_query(cit):
+    cit.save_post("articles", "m1", "# م1\n")
+    cit.save_post("projects", "m2", "# م2\n")
+    cit.set_post_tags("articles", "m1", ["b", "a"])
+    cit.set_post_tags("projects", "m2", ["a"])
+    assert cit.tags_for_posts([("articles", "m1"), ("projects", "m2"), ("articles", "m1"), ("x", "y")]) == {
+        ("articles", "m1"): ["a", "b"], ("projects", "m2"): ["a"], ("x", "y"): []}
+    assert cit.tags_for_posts([]) == {}
+
+    # إعادة الحفظ بنفس الوسوم لا تغيّر العدّادات ولا ترفع الإصدار
+    assert cit.set_post_tags("articles", "m1", ["a", "b"]) == []
+    assert counts(cit)["a"] == 2
+
+
+def test_unpublished_posts_are_hidden_from_tag_pages(cit, client):
+    c = client("admin")
+    submit(c, "hidden-tagged", "سري", status="draft")
+    assert cit.posts_with_tags(["سري"]) == {("articles", "hidden-tagged")}
+    assert cit.tag_listing(["سري"]) == []
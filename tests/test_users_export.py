@@ -0,0 +1,49 @@
+import csv
+import io
+import json
+
+
+def _progress_users(cit, progress, count):
+    def iter_users(filters, batch_size=500):
+        for i in range(count):
+            progress.append(i)
+            yield (i, f"user{i}", f"user{i}@example.com", "writer", "active", "2025-01-01 00:00:00", 1)
+    return iter_users
+
+
+def test_csv_export_streams_with_access_log_on(cit, client, monkeypatch):
+    # سجل الطلبات مفعّل افتراضيًا؛ يجب ألا يجمع الملف في الذاكرة قبل الإرسال
+    progress = []
+    monkeypatch.setitem(cit.app.config, "ACCESS_LOG_ENABLED", True)
+    monkeypatch.setattr(cit, "log_access", lambda record: None)
+    monkeypatch.setattr(cit, "iter_users", _progress_users(cit, progress, 3000))
+
+    resp = client("admin").get("/admin/users/export.csv", buffered=False)
+    assert resp.is_streamed
+    chunks = iter(resp.response)
+    first = next(chunks)
+    assert len(progress) <= 500      # أول دفعة = أول 500 صف فقط
+    body = first + b"".join(chunks)
+    resp.close()
+
+    rows = list(csv.reader(io.StringIO(body.decode("utf-8-sig"))))
+    assert rows[0] == list(cit.USER_EXPORT_COLUMNS)
+    assert len(rows) == 3001 and rows[-1][1] == "user2999"
+    assert resp.headers["Content-Disposition"].startswith("attachment; filename=users-")
+
+
+def test_jsonl_export_uses_filters(cit, client, monkeypatch):
+    seen = []
+
+    def iter_users(filters, batch_size=500):
+        seen.append(filters)
+        yield (1, "ali", "ali@example.com", "admin", "active", "2025-01-01 00:00:00", 1)
+
+    monkeypatch.setattr(cit, "iter_users", iter_users)
+    resp = client("admin").get("/admin/users/export.jsonl?role=admin")
+    assert json.loads(resp.data.decode().splitlines()[0])["username"] == "ali"
+    assert seen[0]["role"] == "admin"
+
+
+def test_export_requires_admin(client):
+    assert client("writer", "bob").get("/admin/users/export.csv").status_code == 403
@@ -0,0 +1,56 @@
+import pytest
+
+
+@pytest.fixture
+def counted(cit, monkeypatch):
+    views = []
+    monkeypatch.setattr(cit, "increment_view", lambda category, filename: views.append((category, filename)))
+    return views
+
+
+def test_counts_published_post(cit, client, counted):
+    cit.save_post("articles", "counted.md", "# مقال منشور\nنص")
+    resp = client().get("/post/articles/counted.md")
+    assert resp.status_code == 200 and "مقال منشور" in resp.get_data(as_text=True)
+    assert counted == [("articles", "counted.md")]
+
+
+def test_missing_post_is_not_counted(client, counted):
+    assert client().get("/post/articles/missing.md").status_code == 404
+    assert client("admin").get("/post/articles/missing.md").status_code == 404
+    assert counted == []
+
+
+def test_admin_preview_of_draft_is_not_counted(cit, client, counted):
+    cit.save_post("articles", "draft.md", "# مسودة\nنص", status="draft")
+    assert client().get("/post/articles/draft.md").status_code == 404
+    resp = client("admin").get("/post/articles/draft.md")
+    assert resp.status_code == 200 and "مسودة" in resp.get_data(as_text=True)
+    assert counted == []
+
+
+def test_repeated_beacons_count_once_per_window(cit, client, counted, monkeypatch):
+    cit.save_post("articles", "beacon.md", "# منارة\nنص")
+    c = client()
+    for _ in range(5):
+        resp = c.post("/post/articles/beacon.md/view", environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        assert resp.status_code == 204
+    assert counted == [("articles", "beacon.md")]
+
+    # عنوان آخر مشاهدة أخرى، وبعد انتهاء النافذة تُعدّ من جديد
+    c.post("/post/articles/beacon.md/view", environ_base={"REMOTE_ADDR": "10.0.0.2"})
+    later = cit.time.time() + cit.VIEW_DEDUPE_SECONDS + 1
+    monkeypatch.setattr(cit.time, "time", lambda: later)
+    c.post("/post/articles/beacon.md/view", environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    assert len(counted) == 3
+
+
+def test_beacons_are_rate_limited_per_ip(cit, client, counted, monkeypatch):
+    monkeypatch.setitem(cit.app.config, "RATE_LIMIT_ENABLED", True)
+    capacity = cit.RATE_LIMIT_POLICIES["view"][0]
+    c = client()
+    statuses = [c.post("/post/articles/missing.md/view", environ_base={"REMOTE_ADDR": "10.0.0.9"}).status_code
+                for _ in range(capacity + 5)]
+    assert statuses[:capacity] == [204] * capacity
+    assert set(statuses[capacity:]) == {429}
+    assert c.post("/post/articles/missing.md/view", environ_base={"REMOTE_ADDR": "10.0.0.10"}).status_code == 204